@@ -6,10 +6,12 @@ import streamlit as st
 # ✅ 关键：引用 hotel_utils
 import hotel_utils as utils
 import logic
+import scenario_pool
 import random
 import json
 import datetime
 import uuid
+import threading
 import pandas as pd
 import plotly.graph_objects as go
 
@@ -32,6 +34,7 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 utils.init_dirs()
+utils.flush_spooled_uploads()  # 上次没传上去的实验日志在后台补传
 
 # API Key 配置
 api_key = None
@@ -41,7 +44,9 @@ except: pass
 if api_key: logic.configure_genai(api_key)
 else:
     user_key = st.sidebar.text_input("Google API Key", type="password")
-    if user_key: logic.configure_genai(user_key)
+    if user_key:
+        logic.configure_genai(user_key)
+        api_key = user_key
 
 # ==========================================
 # 🧠 2. 状态管理 (State Management)
@@ -74,10 +79,15 @@ def init_state():
         "last_audio_signature": None,
         # app.py 约 70 行左右
         "last_audio_data": None,  # 新增：用于存储二进制音频
+        "last_audio_mime": None,  # 上面音频的 MIME (随 HOTEL_TTS_FORMAT 变化)
         
         "temp_world": None,
         "temp_guest": None,
         "temp_staff": None,
+        "quick_play_parts": {},   # Quick Play 中已成功生成的部分 (失败时只重试缺的)
+        "chat_compactor": None,   # 会话压缩 (logic.ChatCompactor，可选)
+        "eval_job": None,         # 后台评价任务 (见 start_evaluation_job)
+        "trace": None,            # 当前对话的调用耗时记录 (logic.Trace)
         
         "w_rnd": {
             "name": "グランド・ホテル", "type": "高級旅館", "season": "繁忙期", 
@@ -97,6 +107,103 @@ def init_state():
         if k not in st.session_state: st.session_state[k] = v
 
 init_state()
+logic.use_trace(st.session_state.trace)  # 本次 rerun 里的外部调用记到当前会话的 trace 上
+
+def refresh_chat_model():
+    """每轮发送前：Context Cache 快过期就续期；已经过期只能重建时，用原来的 history 接着聊"""
+    old = st.session_state.get("chat_model")
+    if old is None: return
+    model = logic.refresh_session_model(old)
+    if model is old: return
+    st.session_state.chat_model = model
+    st.session_state.chat = model.start_chat(history=list(st.session_state.chat.history))
+    compactor = st.session_state.get("chat_compactor")
+    if compactor: compactor.chat = st.session_state.chat
+
+# --- 评价在后台进行 (按下「終了/評価」时开始，Post-test 表单不用等它) ---
+def start_evaluation_job():
+    """为当前对话开始后台评价；对话没变时复用已有的任务"""
+    log_text = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages])
+    job = st.session_state.get("eval_job")
+    if job and job["log_text"] == log_text: return job
+    world_ctx = utils.world_eval_context(st.session_state.get('active_world_name'))
+    job = {
+        "future": logic.start_evaluation(log_text, world_ctx),
+        "world_ctx": world_ctx,
+        "log_text": log_text,
+        # 写履历要用的会话信息先记下来：任务被丢下时在后台线程里写，那里读不到 session_state
+        "guest": st.session_state.get('active_guest_name'),
+        "trace": st.session_state.trace,
+        "finalized": False,
+    }
+    st.session_state.eval_job = job
+    return job
+
+_FINALIZE_LOCK = threading.Lock()
+
+def _record_evaluation(job, result):
+    """
+    更新酒店评分、写本地历史；同一个任务只执行一次 (结果页和后台回调都可能调用)。
+    返回 (旧评分, 新评分)；已经写过时返回 None。
+    """
+    with _FINALIZE_LOCK:
+        if job["finalized"]: return None
+        job["finalized"] = True
+
+    # [经营模拟] 更新酒店评分
+    satisfaction_text = result.get('guest_inner_voice', {}).get('satisfaction', '★3')
+    guest_stars = utils.parse_stars(satisfaction_text)
+    rating_change = utils.update_world_rating(job["world_ctx"]["name"], guest_stars)
+
+    # 保存本地历史
+    history_entry = {
+        "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
+        "world": job["world_ctx"]["name"],
+        "guest": job["guest"],
+        "score": result.get('manager_review', {}).get('score', 0),
+        "status": result.get('manager_review', {}).get('overall_status', 'N/A'),
+        "result": result,
+        "log_text": job["log_text"],  # 评价标准更新后可用 batch_eval.py 重新评分
+        "trace": job["trace"].to_list() if job["trace"] else [],
+    }
+    utils.add_to_history(history_entry)
+    return rating_change
+
+def finalize_evaluation(wait=False):
+    """
+    评价完成后只执行一次：更新酒店评分、练习次数、本地历史。
+    返回评价结果；还没完成且 wait=False 时返回 None。
+    """
+    if st.session_state.evaluation_result: return st.session_state.evaluation_result
+    job = start_evaluation_job()
+    if not wait and not job["future"].done(): return None
+    result = job["future"].result()
+    st.session_state.evaluation_result = result
+    rating_change = _record_evaluation(job, result)
+    if rating_change is None: return result  # 评分 / 履历已经写过，不重复
+    st.session_state.rating_change = rating_change
+
+    # [MBA数据] 增加练习次数计数
+    st.session_state.total_play_count += 1
+    return result
+
+def drop_evaluation_job():
+    """
+    离开结果页 / 开始新的一局时调用，代替直接清空 eval_job：
+    评价还没写入的话，等后台评价完成后照样写入评分和履历 (不阻塞页面)。
+    """
+    job = st.session_state.get("eval_job")
+    st.session_state.eval_job = None
+    st.session_state.evaluation_result = None
+    if not job or job["finalized"]: return
+    st.session_state.total_play_count += 1
+
+    def on_done(future):
+        try:
+            _record_evaluation(job, future.result())
+        except Exception as e:
+            print(f"Background evaluation failed: {e}")
+    job["future"].add_done_callback(on_done)
 
 # ==========================================
 # 🧭 3. 侧边栏导航 (Sidebar)
@@ -131,11 +238,12 @@ with st.sidebar:
     st.markdown("### ☁️ クラウド共有 (Cloud Assets)")
     if st.button("🔄 クラウドから設定読込", use_container_width=True):
         with st.spinner("同期中..."):
-            # 🔴 统一使用 utils
+            # 🔴 统一使用 utils (增量同步，只拉取新增的行)
             cloud_data = utils.fetch_assets_from_cloud()
             if cloud_data:
-                st.session_state.cloud_assets = cloud_data
-                st.toast("✅ クラウドデータを同期しました！", icon="🌐")
+                # 资产本体由 utils 进程内共享，这里只记录数量；需要时用 utils.get_cloud_assets()
+                st.session_state.cloud_assets_count = len(cloud_data)
+                st.toast(f"✅ クラウドデータを同期しました！ ({len(cloud_data)}件)", icon="🌐")
             else:
                 st.warning("クラウドデータはありません。")
 
@@ -144,14 +252,8 @@ with st.sidebar:
     with st.expander("📂 ローカルデータ管理 (Save/Load)"):
         st.caption("※ PC環境でのバックアップ用")
         
-        # 保存逻辑
-        current_data = {
-            "worlds": utils.load_json(utils.WORLDS_FILE),
-            "guests": utils.load_json(utils.CHARS_FILE),
-            "staffs": utils.load_json(utils.STAFF_FILE),
-            "history": utils.load_json(utils.HISTORY_FILE)
-        }
-        json_str = json.dumps(current_data, ensure_ascii=False, indent=2)
+        # 保存逻辑 (数据没变时复用缓存，不重新读盘)
+        json_str = utils.build_backup_json()
         
         st.download_button(
             label="⬇️ セーブ (Download)",
@@ -169,7 +271,7 @@ with st.sidebar:
                 if "worlds" in data: utils.save_json(utils.WORLDS_FILE, data["worlds"])
                 if "guests" in data: utils.save_json(utils.CHARS_FILE, data["guests"])
                 if "staffs" in data: utils.save_json(utils.STAFF_FILE, data["staffs"])
-                if "history" in data: utils.save_json(utils.HISTORY_FILE, data["history"])
+                if "history" in data: utils.save_history(data["history"])
                 st.toast("✅ データを復元しました！", icon="🎉")
                 st.rerun()
             except Exception as e:
@@ -181,9 +283,33 @@ with st.sidebar:
 if st.session_state.nav_page == "dashboard":
     st.markdown("<div class='main-header'>📊 Dashboard</div>", unsafe_allow_html=True)
     c1, c2, c3 = st.columns(3)
-    c1.metric("Worlds", len(utils.load_json(utils.WORLDS_FILE)))
-    c2.metric("Guests", len(utils.load_json(utils.CHARS_FILE)))
-    c3.metric("Staff", len(utils.load_json(utils.STAFF_FILE)))
+    c1.metric("Worlds", len(utils.list_names(utils.WORLDS_FILE)))
+    c2.metric("Guests", len(utils.list_names(utils.CHARS_FILE)))
+    c3.metric("Staff", len(utils.list_names(utils.STAFF_FILE)))
+
+    # ⏱️ 最近的对话里各阶段的响应时间 (履历里保存的 trace)
+    with st.expander("⏱️ 応答速度 (STT / LLM / TTS)", expanded=False):
+        lat = utils.trace_latency_stats()
+        if not lat:
+            st.caption("まだ計測データがありません。")
+        else:
+            st.dataframe(pd.DataFrame([
+                {"段階": stage, "件数": v["n"], "p50 (ms)": v["p50"], "p95 (ms)": v["p95"], "p99 (ms)": v["p99"]}
+                for stage, v in sorted(lat.items())
+            ]), hide_index=True, use_container_width=True)
+        pc = logic.prompt_cache_stats()
+        if pc["hits"] + pc["misses"]:
+            st.caption(f"🧩 プロンプトキャッシュ: ヒット率 {pc['hit_rate']:.0%} / Context Cache {pc['context_cached']} 件"
+                       f" (短すぎて対象外 {pc['too_short']} 件, 延長 {pc['refreshes']} 回)"
+                       + (f" / キャッシュ済みトークン {pc['prompt_token_savings']:.0%}" if pc["prompt_token_savings"] is not None else ""))
+        stt_cache = logic.stt_cache_stats()
+        if stt_cache["hit_rate"] is not None:
+            st.caption(f"🎧 音声認識キャッシュ: {stt_cache['entries']} 件 / ヒット率 {stt_cache['hit_rate']:.0%}")
+        tts = logic.tts_latency_stats()
+        if tts["cold_calls"] + tts["warm_calls"]:
+            st.caption(f"🔊 音声合成 初回バイト: 新規接続 {tts['cold_first_byte_ms'] or '-'} ms / 再利用 {tts['warm_first_byte_ms'] or '-'} ms"
+                       + (f" (1回あたり {tts['saved_ms_per_call']} ms 短縮)" if tts["saved_ms_per_call"] is not None else "")
+                       + f" / 再接続 {tts['rebuilds']} 回")
     
     st.divider()
     
@@ -192,81 +318,64 @@ if st.session_state.nav_page == "dashboard":
         st.subheader("⚡ クイックスタート")
         st.caption("全設定をランダム生成して即座に開始します")
         
-        # 👇👇👇 从这里开始完全替换 👇👇👇
+        # 🎲 预生成场景池：池子里有现成的就直接用，不用等 Gemini
+        pool = scenario_pool.get_pool() if api_key else None
+
         if st.button("🎲 今すぐ始める (Quick Play)", type="primary", use_container_width=True):
-            
-            # 1. 定义随机池 (为了让每次生成的都不一样)
-            POLICIES = ["お客様は神様 (CS重視)", "利益第一 (コストカット)", "事なかれ主義", "伝統と格式", "フレンドリー＆カジュアル", "完全なる放置"]
-            DIFFICULTY_LEVELS = ["Easy (初級)", "Normal (中級)", "Hard (上級)", "Hell (理不尽)"]
-            FACILITIES = ["雨漏りするボロ宿", "昭和レトロな設備", "一般的なビジネスホテル", "リノベーション済み", "最新鋭のスマート設備", "王宮のような豪華設備"]
-            EXP_LEVELS = ["新人 (研修中)", "1年目", "3年 (一人前)", "10年のベテラン", "伝説のコンシェルジュ"]
-            STRESS_LEVELS = ["やる気満々", "通常", "少し疲れている", "疲労困憊", "辞める寸前"]
-
-            with st.spinner("運命のサイコロを振っています..."):
-                # 2. 随机生成 World (注意：这里用了 random 生成星级和难度)
-                rnd_stars = round(random.uniform(1.0, 5.0), 1)
-                rnd_diff = random.choice(DIFFICULTY_LEVELS)
-                
-                w = logic.generate_world_setting(
-                    random.choice(utils.HOTEL_NAMES), 
-                    random.choice(utils.HOTEL_TYPES),
-                    random.choice(utils.SEASONS), 
-                    rnd_stars,                  # 随机星级
-                    random.choice(FACILITIES),  # 随机设施
-                    random.choice(POLICIES),    # ✅ 随机经营方针 (替代了原来的 occupancy)
-                    random.choice(utils.SPECIAL_CONDITIONS),
-                    rnd_diff                    # ✅ 必须加上这个 difficulty 参数！
-                )
-                
-                # 3. 随机生成 Staff
-                s = logic.generate_staff_profile(
-                    "", 
-                    "フロント", 
-                    random.choice(EXP_LEVELS),    # 随机经验
-                    random.choice(STRESS_LEVELS), # 随机压力
-                    "特になし", 
-                    random.choice(["男性", "女性"])
-                )
-                
-                # 4. 随机生成 Guest
-                c = logic.generate_guest_profile({
-                    "name": random.choice(utils.CHAR_NAMES),
-                    "job": random.choice(utils.CHAR_JOBS),
-                    "booking_channel": random.choice(utils.BOOKING_CHANNELS),
-                    "date_context": random.choice(utils.DATE_CONTEXTS),
-                    "incident_type": random.choice(utils.COMPLAINT_TYPES),
-                    "severity": random.randint(1, 5), # 随机严重度
-                    "vip_level": random.choice(utils.VIP_LEVELS),
-                    "initial_mood": random.choice(utils.INITIAL_MOODS)
-                })
-                
-                # 5. 保存并跳转
-                if "error" not in w and "error" not in s and "error" not in c:
-                    # 保存到库
-                    utils.add_to_library(utils.WORLDS_FILE, w)
-                    utils.add_to_library(utils.STAFF_FILE, s)
-                    utils.add_to_library(utils.CHARS_FILE, c)
-                    
-                    # 激活当前选择
-                    st.session_state.active_world_name = w['name']
-                    st.session_state.active_staff_name = s['name']
-                    st.session_state.active_guest_name = c['name']
-                    
-                    # 存入临时状态 (Preview用，虽然直接跳转了但也存一下)
-                    st.session_state.temp_world = w
-                    st.session_state.temp_staff = s
-                    st.session_state.temp_guest = c
-
-                    # 重置对话
-                    st.session_state.messages = []
-                    st.session_state.evaluation_result = None
-                    
-                    # 跳转到模式选择
-                    st.session_state.nav_page = "mode_select"
-                    st.rerun()
-                else:
-                    st.error("生成エラーが発生しました。もう一度試してください。")
-    
+            # 上次失败时保留下来的成功部分，这次只重新生成缺的那几项
+            parts = st.session_state.quick_play_parts
+            failed = {}
+
+            scenario = pool.take() if (pool and not parts) else None
+            if scenario:
+                parts = scenario
+            else:
+                with st.spinner("運命のサイコロを振っています..."):
+                    # ⚡ 三个请求同时发出，等最慢的那个 (随机参数见 scenario_pool.random_scenario_args)
+                    parts, failed = scenario_pool.generate_scenario(parts)
+            st.session_state.quick_play_parts = parts
+
+            # 保存并跳转
+            if not failed:
+                w, s, c = parts["world"], parts["staff"], parts["guest"]
+                st.session_state.quick_play_parts = {}
+
+                # 保存到库
+                utils.add_to_library(utils.WORLDS_FILE, w)
+                utils.add_to_library(utils.STAFF_FILE, s)
+                utils.add_to_library(utils.CHARS_FILE, c)
+
+                # 激活当前选择
+                st.session_state.active_world_name = w['name']
+                st.session_state.active_staff_name = s['name']
+                st.session_state.active_guest_name = c['name']
+
+                # 存入临时状态 (Preview用，虽然直接跳转了但也存一下)
+                st.session_state.temp_world = w
+                st.session_state.temp_staff = s
+                st.session_state.temp_guest = c
+
+                # 重置对话
+                st.session_state.messages = []
+                drop_evaluation_job()
+
+                # 跳转到模式选择
+                st.session_state.nav_page = "mode_select"
+                st.rerun()
+            else:
+                part_labels = {"world": "World", "staff": "Staff", "guest": "Guest"}
+                for key, err in failed.items():
+                    st.error(f"{part_labels[key]} の生成エラー: {err}")
+                if parts:
+                    done = " / ".join(part_labels[k] for k in parts)
+                    st.info(f"✅ {done} は生成済みです。もう一度押すと失敗した分だけ再生成します。")
+
+        if pool:
+            ps = pool.stats()
+            refill = f" / 補充 {ps['refill_avg_s']}秒" if ps["refill_avg_s"] else ""
+            if ps["retry_in_s"]: refill += f" / 生成失敗のため {ps['retry_in_s']:.0f}秒後に再補充"
+            st.caption(f"⚡ 待機中のシナリオ: {ps['depth']}/{ps['target_depth']}{refill}")
+
     with c_info:
         #以此替换原来的 User Manual 部分
         with st.expander("📖 ユーザーマニュアル (About this Simulator)", expanded=True):
@@ -697,9 +806,9 @@ elif st.session_state.nav_page == "mode_select":
     st.markdown("<div class='main-header'>🚀 出撃準備</div>", unsafe_allow_html=True)
 
     # 加载数据用于显示验证
-    w = next((x for x in utils.load_json(utils.WORLDS_FILE) if x["name"] == st.session_state.active_world_name), None)
-    g = next((x for x in utils.load_json(utils.CHARS_FILE) if x["name"] == st.session_state.active_guest_name), None)
-    s = next((x for x in utils.load_json(utils.STAFF_FILE) if x["name"] == st.session_state.active_staff_name), None)
+    w = utils.get_by_name(utils.WORLDS_FILE, st.session_state.active_world_name)
+    g = utils.get_by_name(utils.CHARS_FILE, st.session_state.active_guest_name)
+    s = utils.get_by_name(utils.STAFF_FILE, st.session_state.active_staff_name)
     
     # 显示状态栏
     col1, col2, col3 = st.columns(3)
@@ -719,7 +828,7 @@ elif st.session_state.nav_page == "mode_select":
         def set_mode_and_go(role):
             st.session_state.current_role = role
             st.session_state.messages = []
-            st.session_state.evaluation_result = None
+            drop_evaluation_job()
             st.session_state.rating_change = None
             # 💡 关键路径：去中转门
             st.session_state.nav_page = "pre_test_gate"
@@ -847,50 +956,42 @@ elif st.session_state.nav_page == "chat":
     date_ctx = "Weekday" 
 
     # 2. 关键：确保 g 和 s 在所有逻辑运行前都被定义
-    # 首先加载世界观数据
-    w_list = utils.load_json(utils.WORLDS_FILE)
-    w = next((x for x in w_list if x["name"] == st.session_state.active_world_name), {})
+    # 按名字索引直接取当前激活的记录 (不再整文件读取)
+    w = utils.get_by_name(utils.WORLDS_FILE, st.session_state.active_world_name) or {}
 
     # --- 这里是重点：检查你的变量名 ---
     # 有的代码里叫 GUEST_FILE，有的叫 CHARS_FILE，我们统一尝试读取
     guest_path = getattr(utils, 'GUEST_FILE', getattr(utils, 'CHARS_FILE', 'data/guests.json'))
-    g_list = utils.load_json(guest_path)
     # 根据当前激活的顾客姓名匹配数据
-    g = next((x for x in g_list if x["name"] == st.session_state.active_guest_name), {})
+    g = utils.get_by_name(guest_path, st.session_state.active_guest_name) or {}
 
     # 加载员工数据
-    s_list = utils.load_json(utils.STAFF_FILE)
-    s = next((x for x in s_list if x["name"] == st.session_state.active_staff_name), {})
+    s = utils.get_by_name(utils.STAFF_FILE, st.session_state.active_staff_name) or {}
 
     # 3. UI 头部渲染
     c1, c2 = st.columns([5, 1])
     c1.subheader(f"💬 {role.upper()} MODE")
     if c2.button("終了/評価"): 
+        start_evaluation_job()  # 评价在后台先跑起来
         st.session_state.nav_page = "eval"
         st.rerun()
     
     # 4. 初始化对话逻辑
     if not st.session_state.messages:
-        sys_prompt = ""
         first_msg = ""
         
         # 此时 g, s, w 已经在上方定义，不会再报 NameError
         if role == "staff": 
-            sys_prompt = logic.get_staff_system_instruction(w, g, s, date_ctx)
             first_msg = g.get('default_complaint', 'すみません、ちょっといいですか！')
         elif role == "guest": 
-            sys_prompt = logic.get_guest_system_instruction(w, g, s, date_ctx)
-            first_msg = "お電話ありがとうございます。フロントでございます。いかがなさいましたか？"
+            first_msg = logic.GUEST_MODE_OPENER
         else: 
-            # 1. 即使是观察者模式，也使用专门的“现场再现”指令
-            sys_prompt = logic.get_observer_system_instruction(w, g, s, date_ctx)
-            
-            # 2. 获取实时变量
+            # 1. 获取实时变量 (观察者模式的“现场再现”指令由 logic.get_session_model 构建)
             h_name = w.get('name', '当ホテル')
             g_name = g.get('name', 'お客様')
             incident = g.get('specific_incident', 'ご指摘の事項')
 
-            # 3. 采用“现场再现 / 记录档案”的口吻，增加真实感
+            # 2. 采用“现场再现 / 记录档案”的口吻，增加真实感
             # 模拟监控录像或事故调查报告的开场
             first_msg = (
                 f"【現場再現：{h_name} フロントデスク】\n"
@@ -899,10 +1000,25 @@ elif st.session_state.nav_page == "chat":
                 "これより、当時の状況を記録に基づき詳細に再現します。"
             )
 
+        # ⏱️ 新对话开始记录各外部调用的耗时 (第 0 轮 = 开场白)
+        st.session_state.trace = logic.use_trace(logic.Trace())
+
+        # 🔌 后台预先打开双方声优的 Azure 连接，第一句回复不再等握手
+        logic.prewarm_synthesizers([
+            logic.resolve_voice(g.get("gender", "女性"), g.get("voice_id")),
+            logic.resolve_voice(s.get("gender", "女性"), s.get("voice_id"))
+        ])
+
         # 启动聊天 session
         st.session_state.messages.append({"role": "assistant", "content": first_msg})
-        st.session_state.chat_model = logic.get_model(sys_prompt)
+        # 同一场景 + 角色的 system prompt 只编译一次，所有会话共用 (支持时走 Context Caching)
+        st.session_state.chat_model = logic.get_session_model(role, w, g, s, date_ctx)
         st.session_state.chat = st.session_state.chat_model.start_chat(history=[])
+        # 🗜️ 可选：旧对话在后台折叠成记忆摘要 (HOTEL_CHAT_COMPACT_EVERY > 0 时开启)
+        st.session_state.chat_compactor = (
+            logic.ChatCompactor(st.session_state.chat, constraints=w.get("constraints"))
+            if logic.CHAT_COMPACT_EVERY > 0 else None
+        )
 
         # 处理第一句话的语音
         speaker_data = g if role == "staff" else s
@@ -920,6 +1036,7 @@ elif st.session_state.nav_page == "chat":
             )
             if init_audio: 
                 st.session_state.last_audio_data = init_audio
+                st.session_state.last_audio_mime = logic.audio_mime(init_audio)
 
         st.rerun()
 
@@ -928,11 +1045,20 @@ elif st.session_state.nav_page == "chat":
         st.chat_message(msg["role"]).write(msg["content"])
 
     # ✅ 3. 核心：Azure 语音播放器 (替换了原来的 utils.autoplay_audio)
+    # 排进浏览器的播放队列：上一轮边生成边播放的句子还没放完时，接在后面播
+    for err in st.session_state.pop("tts_errors", None) or []:
+        st.warning(f"🔇 音声の一部を生成できませんでした: {err}")
     if "last_audio_data" in st.session_state and st.session_state.last_audio_data:
-        st.audio(st.session_state.last_audio_data, format="audio/wav", autoplay=True)
+        utils.queue_audio(st.session_state.last_audio_data,
+                          st.session_state.get("last_audio_mime") or "audio/wav")
         # 播完即焚，防止刷新时复读
         del st.session_state.last_audio_data
 
+    # ⏱️ 本轮编号：STT 和回复记在同一轮 (观察者模式按已生成的发言数)
+    if st.session_state.trace:
+        st.session_state.trace.turn = (len(st.session_state.messages) if role == "observer"
+                                       else sum(m["role"] == "user" for m in st.session_state.messages) + 1)
+
     # ✅ 4. 输入区域
     if role == "observer":
         st.info("👁️ 観察者モード: 下のボタンを押してドラマを進めてください")
@@ -941,7 +1067,10 @@ elif st.session_state.nav_page == "chat":
             with st.spinner("現場状況を再現中..."):
                 try:
                     # 1. 向 AI 发送 Next 指令
-                    resp = st.session_state.chat.send_message("Next")
+                    refresh_chat_model()
+                    with logic.span("llm", model=logic.chat_model_name(st.session_state.chat), chars_in=4) as sp:
+                        resp = logic.call_gemini(st.session_state.chat.send_message, "Next")
+                        sp["chars_out"] = len(resp.text)
                     
                     # 2. 解析 JSON (配合 logic.py 的新格式)
                     import json
@@ -972,6 +1101,7 @@ elif st.session_state.nav_page == "chat":
                     
                     if audio_bytes:
                         st.session_state.last_audio_data = audio_bytes
+                        st.session_state.last_audio_mime = logic.audio_mime(audio_bytes)
                     
                     st.rerun()
                 except Exception as e: 
@@ -984,10 +1114,15 @@ elif st.session_state.nav_page == "chat":
 
         # 录音去重逻辑 (保留你原来的代码)
         if audio_value:
-            current_audio_hash = hash(audio_value.getvalue())
+            audio_bytes_in = audio_value.getvalue()
+            current_audio_hash = logic.audio_digest(audio_bytes_in)
             if st.session_state.last_audio_id != current_audio_hash:
                 with st.spinner("🎧 音声をテキストに変換中..."):
-                    transcript = logic.transcribe_audio(audio_value.read())
+                    partial_box = st.empty()  # 流式识别的中间结果
+                    transcript = logic.transcribe_audio(
+                        audio_bytes_in, digest=current_audio_hash,
+                        on_partial=lambda t: partial_box.caption(f"🎧 {t}…"))
+                    partial_box.empty()
                     if "[Error" not in transcript:
                         final_input = transcript
                         st.session_state.last_audio_id = current_audio_hash
@@ -998,32 +1133,57 @@ elif st.session_state.nav_page == "chat":
         # ✅ 5. 发送逻辑 + 动态语音生成
         if final_input:
             st.session_state.messages.append({"role": "user", "content": final_input})
-            with st.spinner("Thinking..."):
-                try:
-                    resp = st.session_state.chat.send_message(final_input)
-                    ai_text = resp.text
-                    st.session_state.messages.append({"role": "assistant", "content": ai_text})
-                    
-                    # 🔴 检查这里！确保下面这些行前面没有多余的空格
-                    current_style = "customer-service"
-                    if any(w in ai_text for w in ["申し訳", "すみません", "お詫び"]):
-                        current_style = "empathetic"
+            # 历史消息已在上方渲染过，这一句单独补上
+            st.chat_message("user").write(final_input)
+            try:
+                # 判定发声角色并获取 Voice ID
+                speaker_data = g if role == "staff" else s
+                # 🔊 句子级流水线：每生成完一句就开始合成，和后面的生成重叠
+                pipeline = logic.SpeechPipeline(
+                    gender=speaker_data.get("gender", "女性"), 
+                    voice_name=speaker_data.get("voice_id")
+                )
 
-                    # 判定发声角色并获取 Voice ID
-                    speaker_data = g if role == "staff" else s
-                    audio_bytes = logic.get_azure_speech(
-                        ai_text, 
-                        gender=speaker_data.get("gender", "女性"), 
-                        style=current_style, 
-                        voice_name=speaker_data.get("voice_id")
-                    )
-                    
-                    if audio_bytes:
-                        st.session_state.last_audio_data = audio_bytes
-                    
-                    st.rerun()
-                except Exception as e: 
-                    st.error(str(e))
+                refresh_chat_model()
+                compactor = st.session_state.get("chat_compactor")
+                if compactor: compactor.apply()  # 后台折叠好了就换上摘要
+
+                # 🔊 每句合成好就排进播放队列：第一句在后面还在生成/合成时就开始播放
+                audio_slot = st.container()
+                def play_as_ready(chunks):
+                    for chunk in chunks:
+                        yield chunk
+                        for audio in pipeline.ready_audio():
+                            with audio_slot: utils.queue_audio(audio, logic.audio_mime(audio))
+
+                # ⚡ 流式渲染：第一块文字一到就显示，不用等整句生成完
+                with st.chat_message("assistant"):
+                    ai_text = st.write_stream(play_as_ready(
+                        pipeline.wrap(logic.stream_chat_reply(st.session_state.chat, final_input))))
+                if not isinstance(ai_text, str): ai_text = "".join(map(str, ai_text))
+                st.session_state.messages.append({"role": "assistant", "content": ai_text})
+                if compactor: compactor.maybe_compact()
+
+                # 剩下的句子按顺序等；最后一句留到 rerun 之后再入队 (rerun 前刚加的组件可能来不及执行)
+                last_audio = None
+                with st.spinner("🔊 音声を生成中..."):
+                    for audio in pipeline.iter_audio():
+                        if last_audio:
+                            with audio_slot: utils.queue_audio(last_audio, logic.audio_mime(last_audio))
+                        last_audio = audio
+                
+                if last_audio:
+                    st.session_state.last_audio_data = last_audio
+                    st.session_state.last_audio_mime = logic.audio_mime(last_audio)
+                if pipeline.errors:
+                    st.session_state.tts_errors = [str(e) for e in pipeline.errors]
+                
+                st.rerun()
+            except Exception as e: 
+                # 这一轮没完成：撤回刚加的发言，和模型那边的 history 保持一致
+                msgs = st.session_state.messages
+                if msgs and msgs[-1] == {"role": "user", "content": final_input}: msgs.pop()
+                st.error(str(e))
 
 # ==========================================
 # 📊 11. Evaluation & Post-test (评价与后测)
@@ -1031,112 +1191,84 @@ elif st.session_state.nav_page == "chat":
 elif st.session_state.nav_page == "eval":
     st.markdown("<div class='main-header'>📊 最終分析レポート</div>", unsafe_allow_html=True)
     
-    # --- 1. 获取或生成评价结果 ---
-    if not st.session_state.evaluation_result:
-        with st.spinner("支配人が接客ログを分析中..."):
-            # A. 整理对话文本
-            log_text = "\n".join([f"{m['role']}: {m['content']}" for m in st.session_state.messages])
-            
-            # B. 准备环境锚定信息
-            world_ctx = {
-                "name": st.session_state.get('active_world_name'),
-                "type": st.session_state.get('world_type', 'ホテル'),
-                "constraints": st.session_state.get('active_world_constraints'),
-                "context": st.session_state.get('active_world_context')
-            }
-            
-            # C. 调用逻辑分析
-            result = logic.evaluate_interaction(log_text, world_ctx)
-            st.session_state.evaluation_result = result
-            
-            # D. [经营模拟] 更新酒店评分
-            satisfaction_text = result.get('guest_inner_voice', {}).get('satisfaction', '★3')
-            guest_stars = utils.parse_stars(satisfaction_text)
-            old_r, new_r = utils.update_world_rating(world_ctx["name"], guest_stars)
-            st.session_state.rating_change = (old_r, new_r)
-            
-            # E. [MBA数据] 增加练习次数计数
-            st.session_state.total_play_count += 1 
-
-            # F. 保存本地历史
-            history_entry = {
-                "timestamp": datetime.datetime.now().strftime("%Y-%m-%d %H:%M"),
-                "world": world_ctx["name"],
-                "guest": st.session_state.get('active_guest_name'),
-                "score": result.get('manager_review', {}).get('score', 0),
-                "status": result.get('manager_review', {}).get('overall_status', 'N/A'),
-                "result": result
-            }
-            utils.add_to_history(history_entry)
-
-    # --- 渲染详细结果 ---
-    res = st.session_state.evaluation_result
-    m = res.get('manager_review', {})
-    g = res.get('guest_inner_voice', {})
-
-    if "error" in res:
-        st.error(f"評価エラー: {res['error']}")
-    else:
-        # === A. 核心得分与经营影响 ===
-        st.subheader(f"👨‍💼 支配人の判定: {m.get('overall_status', '評価中')}")
+    # --- 1. 评价在后台进行，报告区域定时检查，完成后自动显示 ---
+    @st.fragment(run_every=None if st.session_state.evaluation_result else 2)
+    def render_report():
+        if not st.session_state.evaluation_result:
+            if finalize_evaluation() is None:
+                st.info("⏳ 支配人が接客ログを分析中... (先に下の振り返りを入力できます)")
+                return
+            st.rerun()  # 整页刷新一次，让下方表单也拿到结果
+
+        res = st.session_state.evaluation_result
+        m = res.get('manager_review', {})
+        g = res.get('guest_inner_voice', {})
+
+        if "error" in res:
+            st.error(f"評価エラー: {res['error']}")
+        else:
+            # === A. 核心得分与经营影响 ===
+            st.subheader(f"👨‍💼 支配人の判定: {m.get('overall_status', '評価中')}")
         
-        col_score, col_tycoon = st.columns(2)
-        with col_score:
-            final_score = m.get('score', 0)
-            st.metric("総合得点 (AI Score)", f"{final_score} / 100")
-            st.progress(final_score / 100)
-
-        with col_tycoon: 
-            if "rating_change" in st.session_state:
-                old_r, new_r = st.session_state.rating_change
-                diff = round(new_r - old_r, 2)
-                st.metric(
-                    label="🏨 ホテルの評判 (Tycoon Rating)",
-                    value=f"{new_r} / 5.0",
-                    delta=f"{diff}",
-                    delta_color="normal"
-                )
+            col_score, col_tycoon = st.columns(2)
+            with col_score:
+                final_score = m.get('score', 0)
+                st.metric("総合得点 (AI Score)", f"{final_score} / 100")
+                st.progress(final_score / 100)
+
+            with col_tycoon: 
+                if st.session_state.get("rating_change"):
+                    old_r, new_r = st.session_state.rating_change
+                    diff = round(new_r - old_r, 2)
+                    st.metric(
+                        label="🏨 ホテルの評判 (Tycoon Rating)",
+                        value=f"{new_r} / 5.0",
+                        delta=f"{diff}",
+                        delta_color="normal"
+                    )
 
-        st.divider()
+            st.divider()
 
-        # === B. LEARN模型分析 ===
-        st.subheader("📚 LEARNモデル適用チェック")
-        l_analysis = res.get('learn_analysis', {})
-        l_cols = st.columns(5)
-        learn_steps = [("L", "Listen"), ("E", "Empathize"), ("A", "Apologize"), ("R", "Resolve"), ("N", "Notify")]
-        for i, (letter, full) in enumerate(learn_steps):
-            l_cols[i].markdown(f"### {letter}")
-            l_cols[i].caption(full)
-        st.info(f"**LEARN総評**: {l_analysis.get('summary', '分析中...')}")
+            # === B. LEARN模型分析 ===
+            st.subheader("📚 LEARNモデル適用チェック")
+            l_analysis = res.get('learn_analysis', {})
+            l_cols = st.columns(5)
+            learn_steps = [("L", "Listen"), ("E", "Empathize"), ("A", "Apologize"), ("R", "Resolve"), ("N", "Notify")]
+            for i, (letter, full) in enumerate(learn_steps):
+                l_cols[i].markdown(f"### {letter}")
+                l_cols[i].caption(full)
+            st.info(f"**LEARN総評**: {l_analysis.get('summary', '分析中...')}")
 
-        st.divider()
+            st.divider()
 
-        # === C. 玩家行为分析 ===
-        st.subheader("👤 プレイヤー分析")
-        p_analysis = res.get('player_analysis', {})
-        pa_c1, pa_c2 = st.columns([1, 2])
-        with pa_c1:
-            st.success(f"**タイプ**: {p_analysis.get('type', '標準')}")
-        with pa_c2:
-            st.write(f"**特徴**: {p_analysis.get('traits', '...')}")
-            st.warning(f"🚀 **成長のヒント**: {p_analysis.get('growth_tip', '...')}")
-
-        # === D. 强项弱项 ===
-        st.divider()
-        c1, c2 = st.columns(2)
-        with c1:
-            st.success("🌟 **良かった点**")
-            for s in m.get('strengths', []): st.write(f"✅ {s}")
-        with c2:
-            st.error("⚠️ **改善すべき点**")
-            for w in m.get('weaknesses', []): st.write(f"❌ {w}")
-
-        # === E. 客人本音 ===
-        st.divider()
-        with st.expander("😠 お客様の生々しい本音 (Guest Voice)", expanded=False):
-            st.write(f"**満足度**: {g.get('satisfaction')}")
-            st.write(f"**感情推移**: {g.get('emotional_curve')}")
-            st.write(g.get('detailed_comment'))
+            # === C. 玩家行为分析 ===
+            st.subheader("👤 プレイヤー分析")
+            p_analysis = res.get('player_analysis', {})
+            pa_c1, pa_c2 = st.columns([1, 2])
+            with pa_c1:
+                st.success(f"**タイプ**: {p_analysis.get('type', '標準')}")
+            with pa_c2:
+                st.write(f"**特徴**: {p_analysis.get('traits', '...')}")
+                st.warning(f"🚀 **成長のヒント**: {p_analysis.get('growth_tip', '...')}")
+
+            # === D. 强项弱项 ===
+            st.divider()
+            c1, c2 = st.columns(2)
+            with c1:
+                st.success("🌟 **良かった点**")
+                for s in m.get('strengths', []): st.write(f"✅ {s}")
+            with c2:
+                st.error("⚠️ **改善すべき点**")
+                for w in m.get('weaknesses', []): st.write(f"❌ {w}")
+
+            # === E. 客人本音 ===
+            st.divider()
+            with st.expander("😠 お客様の生々しい本音 (Guest Voice)", expanded=False):
+                st.write(f"**満足度**: {g.get('satisfaction')}")
+                st.write(f"**感情推移**: {g.get('emotional_curve')}")
+                st.write(g.get('detailed_comment'))
+
+    render_report()
 
     st.markdown("---")
 
@@ -1175,6 +1307,10 @@ elif st.session_state.nav_page == "eval":
         
     # ✅ 重点：这里缩进退回最左边（或者与 with st.form 对齐）
     if submit_cloud:
+        # 评价还没回来的话在这里等它 (评分和履历只会写入一次)
+        with st.spinner("支配人が接客ログを分析中..."):
+            res = finalize_evaluation(wait=True)
+        final_score = res.get('manager_review', {}).get('score', 0)
         st.success("分析レポートを生成しました！")
         
         # ---------------------------------------------------------
@@ -1258,8 +1394,9 @@ elif st.session_state.nav_page == "eval":
                 str(st.session_state.messages) 
             ]
             
+            # 入队后立即返回，实际上传在后台批量进行
             if utils.upload_log_to_cloud(log_data):
-                st.toast("✅ データ送信完了！分析ありがとうございました！", icon="🎓")
+                st.toast("✅ データを送信しました！分析ありがとうございました！", icon="🎓")
                 st.balloons()
             else:
                 st.error("送信失敗。Secrets設定を確認してください。")
@@ -1268,7 +1405,7 @@ elif st.session_state.nav_page == "eval":
     if st.button("🏠 ダッシュボードに戻る", type="secondary", use_container_width=True):
         st.session_state.nav_page = "dashboard"
         st.session_state.messages = []
-        st.session_state.evaluation_result = None
+        drop_evaluation_job()
         st.rerun()
 
 # ==========================================
@@ -1281,7 +1418,7 @@ elif st.session_state.nav_page == "history":
         st.rerun()
     
     # 重新加载数据
-    hist = utils.load_json(utils.HISTORY_FILE)
+    hist = utils.load_history()
     
     if not hist:
         st.info("履歴はまだありません。")
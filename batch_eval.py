@@ -0,0 +1,195 @@
+# batch_eval.py
+# ==========================================
+# 📦 离线批量重新评分 (Batch Evaluation)
+# ==========================================
+# 评价标准 (logic.evaluate_interaction) 改了以后，把存下来的对话记录整批重新评一遍：
+#   python batch_eval.py --history --out regrade.jsonl
+#   python batch_eval.py --csv sheets_export.csv --workers 8 --rpm 60 --tpm 200000 --out regrade.jsonl
+# - 来源：本地履历 (history 里的 log_text) 和 Google Sheets 日志导出的 CSV (最后一列是 messages)
+# - 中断后用同一个 --out 再跑一次即可续跑 (已成功的跳过，失败的重试)
+# - 需要 GOOGLE_API_KEY (环境变量或 .streamlit/secrets.toml)
+import argparse
+import ast
+import csv
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import hotel_utils as utils
+import logic
+
+PROMPT_OVERHEAD_TOKENS = 1500  # evaluate_interaction 里固定的评价说明 + 输出，粗略估计
+
+
+# ==========================================
+# 📥 1. 读取对话记录
+# ==========================================
+def _job_id(source, timestamp, world, guest, log_text):
+    raw = json.dumps([source, timestamp, world, guest, log_text], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+def _job(source, timestamp, world, guest, log_text):
+    return {
+        "id": _job_id(source, timestamp, world, guest, log_text),
+        "source": source, "timestamp": timestamp, "world": world, "guest": guest,
+        "log_text": log_text,
+    }
+
+def jobs_from_history():
+    """本地履历 (只有带 log_text 的记录才能重新评分)"""
+    for h in utils.iter_history():
+        if h.get("log_text"):
+            yield _job("history", h.get("timestamp"), h.get("world"), h.get("guest"), h["log_text"])
+
+def jobs_from_sheet_csv(path):
+    """
+    Sheets 日志导出的 CSV。列顺序与 app.py 的 log_data 一致：
+    时间, user_id, 昵称, 角色, 次数, 酒店, 客人, 得分, …, 感想, str(messages)
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 8: continue
+            try:
+                messages = ast.literal_eval(row[-1])
+            except (ValueError, SyntaxError):
+                continue  # 表头或损坏的行
+            if not isinstance(messages, list) or not messages: continue
+            log_text = "\n".join(f"{m.get('role')}: {m.get('content')}" for m in messages if isinstance(m, dict))
+            yield _job(os.path.basename(path), row[0], row[5], row[6], log_text)
+
+
+# ==========================================
+# 🚦 2. 限流 (每分钟请求数 / token 数)
+# ==========================================
+class RateLimiter:
+    """两个令牌桶：requests/min 与 tokens/min，acquire 在额度不够时阻塞"""
+
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm, self.tpm = rpm, tpm
+        self._req = float(rpm or 0)
+        self._tok = float(tpm or 0)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed, self._last = now - self._last, now
+        if self.rpm: self._req = min(self.rpm, self._req + elapsed * self.rpm / 60)
+        if self.tpm: self._tok = min(self.tpm, self._tok + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens=0):
+        if self.tpm: tokens = min(tokens, self.tpm)  # 单个超大请求也要能发出去
+        while True:
+            with self._lock:
+                self._refill()
+                if (not self.rpm or self._req >= 1) and (not self.tpm or self._tok >= tokens):
+                    if self.rpm: self._req -= 1
+                    if self.tpm: self._tok -= tokens
+                    return
+                wait = 0.0
+                if self.rpm and self._req < 1: wait = max(wait, (1 - self._req) * 60 / self.rpm)
+                if self.tpm and self._tok < tokens: wait = max(wait, (tokens - self._tok) * 60 / self.tpm)
+            time.sleep(min(wait, 5.0))
+
+def estimate_tokens(log_text):
+    # 日文约 1 字 ≈ 1 token，偏保守
+    return len(log_text) + PROMPT_OVERHEAD_TOKENS
+
+
+# ==========================================
+# ⚙️ 3. 执行
+# ==========================================
+def load_done_ids(out_path):
+    """已成功评分的 id (续跑时跳过)"""
+    done = set()
+    if not os.path.exists(out_path): return done
+    with open(out_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中断时写了一半的行
+            if "error" not in rec.get("result", {}): done.add(rec["id"])
+    return done
+
+def run_batch(jobs, out_path, workers=4, limiter=None):
+    done = load_done_ids(out_path)
+    todo, seen = [], set(done)
+    for j in jobs:
+        if j["id"] not in seen:
+            seen.add(j["id"])
+            todo.append(j)
+    print(f"{len(done)} already graded, {len(todo)} to go", flush=True)
+
+    write_lock = threading.Lock()
+    stats = {"ok": 0, "error": 0}
+    start = time.perf_counter()
+
+    def grade(job):
+        if limiter: limiter.acquire(estimate_tokens(job["log_text"]))
+        t0 = time.perf_counter()
+        result = logic.evaluate_interaction(job["log_text"], utils.world_eval_context(job["world"]))
+        return job, result, time.perf_counter() - t0
+
+    with open(out_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(grade, j) for j in todo]
+        for i, future in enumerate(as_completed(futures), 1):
+            job, result, secs = future.result()
+            rec = {k: job[k] for k in ("id", "source", "timestamp", "world", "guest")}
+            rec.update({
+                "score": result.get("manager_review", {}).get("score"),
+                "status": result.get("manager_review", {}).get("overall_status"),
+                "latency_s": round(secs, 2),
+                "result": result,
+            })
+            with write_lock:
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                out.flush()
+            stats["error" if "error" in result else "ok"] += 1
+            if i % 10 == 0 or i == len(futures):
+                per_min = i / (time.perf_counter() - start) * 60
+                print(f"  {i}/{len(futures)}  {per_min:.1f} transcripts/min", flush=True)
+
+    elapsed = time.perf_counter() - start
+    stats["elapsed_s"] = round(elapsed, 1)
+    stats["per_min"] = round((stats["ok"] + stats["error"]) / elapsed * 60, 1) if elapsed else None
+    return stats
+
+
+def _api_key():
+    if os.environ.get("GOOGLE_API_KEY"): return os.environ["GOOGLE_API_KEY"]
+    try:
+        return logic.st.secrets["GOOGLE_API_KEY"]
+    except Exception:
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-run evaluate_interaction over stored transcripts")
+    parser.add_argument("--history", action="store_true", help="grade local history entries")
+    parser.add_argument("--csv", nargs="*", default=[], help="Sheets log export(s) in CSV")
+    parser.add_argument("--out", required=True, help="JSONL output (also used to resume)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--rpm", type=float, help="max requests per minute")
+    parser.add_argument("--tpm", type=float, help="max (estimated) tokens per minute")
+    parser.add_argument("--limit", type=int, help="grade at most this many transcripts")
+    args = parser.parse_args()
+
+    if not args.history and not args.csv:
+        parser.error("nothing to grade: pass --history and/or --csv")
+    key = _api_key()
+    if not key: sys.exit("GOOGLE_API_KEY is not set")
+    logic.configure_genai(key)
+
+    jobs = []
+    if args.history: jobs.extend(jobs_from_history())
+    for path in args.csv: jobs.extend(jobs_from_sheet_csv(path))
+    if args.limit: jobs = jobs[:args.limit]
+
+    stats = run_batch(jobs, args.out, args.workers, RateLimiter(args.rpm, args.tpm))
+    print(f"Done: {stats['ok']} ok, {stats['error']} failed in {stats['elapsed_s']}s "
+          f"({stats['per_min']} transcripts/min)")
@@ -0,0 +1,179 @@
+# bench_hotel_utils.py
+# ==========================================
+# 📈 hotel_utils 读写路径基准 (回归对比用)
+# ==========================================
+# 用 bench_storage 的合成数据 (1k / 10k / 100k 条) 逐个测 hotel_utils 的 I/O 函数：
+# 每个操作的耗时 (中位数 / p95) 和 tracemalloc 峰值内存，结果写成 JSON，
+# 与上一个版本的结果对比就能看出回归：
+#   python bench_hotel_utils.py --out bench/v2.json
+#   python bench_hotel_utils.py --sizes 1000 10000 --compare bench/v1.json --threshold 1.3
+#   python bench_hotel_utils.py --compare bench/v1.json --min-delta-ms 1 --min-delta-kib 64  # 比例和绝对差值都超过才算回归
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import hotel_utils as utils
+from bench_storage import make_guest, make_history, make_library, populate, use_data_dir
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def measure(fn, repeat, setup=None):
+    """
+    先计时 repeat 次 (不开 tracemalloc，避免拖慢)，再单独跑一次记录峰值内存。
+    setup() 在每次调用前执行，不计入耗时。
+    """
+    samples = []
+    for _ in range(repeat):
+        if setup: setup()
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    if setup: setup()
+    tracemalloc.start()
+    try:
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    samples.sort()
+    return {
+        "median_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(samples[max(0, int(len(samples) * 0.95) - 1)], 3),
+        "min_ms": round(samples[0], 3),
+        "peak_kib": round(peak / 1024, 1),
+        "repeat": repeat,
+    }
+
+
+def bench_size(n, repeat, backend="json", seed=0):
+    rng = random.Random(seed + 1)
+    lib = make_library(n, seed)
+    world_names = [w["name"] for w in lib["worlds"]]
+    guest_names = [g["name"] for g in lib["characters"]]
+    deletable = rng.sample(guest_names, min(len(guest_names), repeat + 1))
+    counter = iter(range(n, n + 100 * repeat))
+    data_dir = tempfile.mkdtemp(prefix="hotel_bench_utils_")
+    try:
+        use_data_dir(data_dir, backend)
+        ops = {}
+        ops["populate"] = measure(lambda: populate(lib), 1)
+        ops["load_json_cold"] = measure(lambda: utils.load_json(utils.CHARS_FILE), repeat,
+                                        setup=utils.invalidate_cache)
+        ops["load_json_warm"] = measure(lambda: utils.load_json(utils.CHARS_FILE), repeat)
+        ops["save_json"] = measure(lambda: utils.save_json(utils.CHARS_FILE, lib["characters"]), repeat)
+        ops["get_by_name"] = measure(lambda: utils.get_by_name(utils.CHARS_FILE, rng.choice(guest_names)), repeat)
+        ops["list_names"] = measure(lambda: utils.list_names(utils.CHARS_FILE), repeat)
+        ops["add_to_library"] = measure(
+            lambda: utils.add_to_library(utils.CHARS_FILE, make_guest(next(counter), rng)), repeat)
+        ops["add_to_library_overwrite"] = measure(
+            lambda: utils.add_to_library(utils.CHARS_FILE, dict(lib["characters"][rng.randrange(n)])), repeat)
+        ops["delete_from_library"] = measure(
+            lambda: utils.delete_from_library(utils.CHARS_FILE, deletable.pop()), repeat)
+        ops["add_to_history"] = measure(lambda: utils.add_to_history(make_history(next(counter), rng)), repeat)
+        ops["load_history_page"] = measure(lambda: utils.load_history(0, 20), repeat)
+        ops["load_history_all"] = measure(lambda: utils.load_history(), max(1, repeat // 5),
+                                          setup=utils.invalidate_cache)
+        ops["update_world_rating"] = measure(
+            lambda: utils.update_world_rating(rng.choice(world_names), rng.randint(1, 5)), repeat)
+        disk = sum(os.path.getsize(os.path.join(data_dir, f)) for f in os.listdir(data_dir))
+        return {"records": n, "backend": backend, "disk_bytes": disk, "ops": ops}
+    finally:
+        if utils._STORE is not None: utils._STORE.close_all()
+        utils._STORE = None
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def compare(current, baseline, threshold, min_delta_ms=0.5, min_delta_kib=16.0):
+    """返回回归列表：同一 (records, backend, op) 的中位数耗时或峰值内存超过 baseline × threshold，
+    且绝对差值也超过 min_delta (亚毫秒级操作的抖动只看比例会误报)"""
+    floors = {"median_ms": min_delta_ms, "peak_kib": min_delta_kib}
+    base = {(r["records"], r["backend"]): r["ops"] for r in baseline["results"]}
+    regressions = []
+    for r in current["results"]:
+        old_ops = base.get((r["records"], r["backend"]))
+        if not old_ops: continue
+        for op, new in r["ops"].items():
+            old = old_ops.get(op)
+            if not old: continue
+            for metric in ("median_ms", "peak_kib"):
+                if (old[metric] > 0 and new[metric] > old[metric] * threshold
+                        and new[metric] - old[metric] > floors[metric]):
+                    regressions.append({"records": r["records"], "backend": r["backend"], "op": op,
+                                        "metric": metric, "baseline": old[metric], "current": new[metric],
+                                        "ratio": round(new[metric] / old[metric], 2)})
+    return regressions
+
+
+def print_results(results):
+    for r in results:
+        print(f"\n▶ {r['backend']} @ {r['records']:,} records  (disk {r['disk_bytes'] / 1e6:.1f} MB)")
+        print(f"  {'op':<26}{'median ms':>12}{'p95 ms':>12}{'peak KiB':>12}")
+        for op, m in r["ops"].items():
+            print(f"  {op:<26}{m['median_ms']:>12,.2f}{m['p95_ms']:>12,.2f}{m['peak_kib']:>12,.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark hotel_utils I/O paths (time + peak memory)")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=20, help="timed calls per operation")
+    parser.add_argument("--backends", nargs="+", default=["json"], choices=["json", "sqlite"])
+    parser.add_argument("--out", help="write results as JSON to this path")
+    parser.add_argument("--compare", help="baseline results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="ratio that counts as a regression")
+    parser.add_argument("--min-delta-ms", type=float, default=0.5,
+                        help="a time regression must also be slower by at least this many ms")
+    parser.add_argument("--min-delta-kib", type=float, default=16.0,
+                        help="a memory regression must also grow by at least this many KiB")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        for backend in args.backends:
+            print(f"▶ {backend} @ {n:,} records ...", flush=True)
+            results.append(bench_size(n, args.repeat, backend))
+    report = {
+        "meta": {
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    print_results(results)
+
+    if args.out:
+        out_dir = os.path.dirname(args.out)
+        if out_dir and not os.path.exists(out_dir): os.makedirs(out_dir)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold, args.min_delta_ms, args.min_delta_kib)
+        if regressions:
+            print(f"\n⚠️ {len(regressions)} regression(s) vs {args.compare}:")
+            for r in regressions:
+                print(f"  {r['backend']}@{r['records']} {r['op']} {r['metric']}: "
+                      f"{r['baseline']} → {r['current']} (x{r['ratio']})")
+            sys.exit(1)
+        print(f"\n✅ no regressions vs {args.compare} (threshold x{args.threshold}, "
+              f"min delta {args.min_delta_ms} ms / {args.min_delta_kib} KiB)")
@@ -0,0 +1,200 @@
+# bench_load.py
+# ==========================================
+# 🚦 端到端压测 (模拟 N 个研修生同时上课)
+# ==========================================
+# 每个模拟研修生走一遍：Quick Play → 开始对话 → K 轮 (STT → 流式回复 + 句子级 TTS) → 评价
+# 默认用本地桩后端 (stub_backends.py)，不花额度、不需要网络；数据写在临时目录里。
+#   python bench_load.py --trainees 30 --turns 6
+#   python bench_load.py --trainees 30 --pool 10 --time-scale 0 --out load.json   # 只测 app 自身开销
+import os
+os.environ.setdefault("HOTEL_AI_BACKEND", "stub")  # 必须在 import logic 之前
+
+import argparse
+import io
+import json
+import math
+import random
+import shutil
+import tempfile
+import threading
+import time
+import wave
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import hotel_utils as utils
+import logic
+import scenario_pool
+from bench_storage import use_data_dir
+
+STAGES = ["quick_play", "chat_init", "stt", "llm_first_token", "llm_turn", "tts_tail", "turn_total", "evaluation"]
+
+
+def _fake_recording(seconds, rng):
+    """研修生的录音 (随机噪声 WAV，只为了让 STT 有输入)"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(16000)
+        w.writeframes(bytes(rng.getrandbits(8) for _ in range(int(16000 * seconds) * 2)))
+    return buf.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        with self._lock: self.samples[stage].append(seconds)
+
+    def error(self, stage):
+        with self._lock: self.errors[stage] += 1
+
+    def timed(self, stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            self.error(stage)
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+
+def percentile(values, p):
+    """最近秩法"""
+    if not values: return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+# ==========================================
+# 🧑‍🎓 一个模拟研修生
+# ==========================================
+def run_trainee(idx, turns, rec, pool=None, seed=0):
+    rng = random.Random(seed * 1000 + idx)
+
+    # 1. Quick Play
+    def quick_play():
+        scenario = pool.take() if pool else None
+        if scenario is None:
+            scenario, failed = scenario_pool.generate_scenario()
+            if failed: raise RuntimeError(failed)
+        utils.add_to_library(utils.WORLDS_FILE, scenario["world"])
+        utils.add_to_library(utils.STAFF_FILE, scenario["staff"])
+        utils.add_to_library(utils.CHARS_FILE, scenario["guest"])
+        return scenario
+    scenario = rec.timed("quick_play", quick_play)
+    w, s, g = scenario["world"], scenario["staff"], scenario["guest"]
+
+    # 2. 开始对话 (与 app.py 的 Staff Mode 相同：AI 演客人)
+    def chat_init():
+        chat = logic.get_session_model("staff", w, g, s, "Weekday").start_chat(history=[])
+        logic.get_azure_speech(g.get("default_complaint", "すみません！"), gender=g.get("gender", "女性"),
+                               voice_name=g.get("voice_id"))
+        return chat
+    chat = rec.timed("chat_init", chat_init)
+    messages = []
+
+    # 3. 对话轮次
+    for _ in range(turns):
+        turn_start = time.perf_counter()
+        text = rec.timed("stt", logic.transcribe_audio, _fake_recording(rng.uniform(1.0, 3.0), rng))
+        messages.append({"role": "user", "content": text})
+
+        pipeline = logic.SpeechPipeline(gender=g.get("gender", "女性"), voice_name=g.get("voice_id"))
+        llm_start = time.perf_counter()
+        first = None
+        parts = []
+        for piece in pipeline.wrap(logic.stream_chat_reply(chat, text)):
+            if first is None:
+                first = time.perf_counter()
+                rec.record("llm_first_token", first - llm_start)
+            parts.append(piece)
+        rec.record("llm_turn", time.perf_counter() - llm_start)
+        messages.append({"role": "assistant", "content": "".join(parts)})
+
+        rec.timed("tts_tail", lambda: logic.join_audio_chunks(pipeline.iter_audio()))
+        rec.record("turn_total", time.perf_counter() - turn_start)
+
+    # 4. 评价 + 评分 + 履历 (与 app.py 的 finalize_evaluation 相同)
+    def evaluation():
+        log_text = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+        result = logic.evaluate_interaction(log_text, {"name": w.get("name"), "constraints": w.get("constraints")})
+        stars = utils.parse_stars(result.get("guest_inner_voice", {}).get("satisfaction", "★3"))
+        utils.update_world_rating(w.get("name"), stars)
+        utils.add_to_history({
+            "timestamp": time.strftime("%Y-%m-%d %H:%M"), "world": w.get("name"), "guest": g.get("name"),
+            "score": result.get("manager_review", {}).get("score", 0), "result": result, "log_text": log_text,
+        })
+    rec.timed("evaluation", evaluation)
+
+
+def run_load_test(trainees, turns, pool_depth=0, seed=0, backend="json"):
+    data_dir = tempfile.mkdtemp(prefix="hotel_load_")
+    rec = Recorder()
+    try:
+        use_data_dir(data_dir, backend)
+        for f in (utils.WORLDS_FILE, utils.CHARS_FILE, utils.STAFF_FILE): utils.save_json(f, [])
+
+        pool = None
+        if pool_depth:
+            pool = scenario_pool.ScenarioPool(target_depth=pool_depth)
+            pool.refill()
+            while pool.stats()["depth"] < pool_depth and pool.stats()["refilling"]: time.sleep(0.05)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=trainees) as ex:
+            futures = [ex.submit(run_trainee, i, turns, rec, pool, seed) for i in range(trainees)]
+            failed = sum(1 for f in futures if f.exception() is not None)
+        wall = time.perf_counter() - start
+
+        report = {"trainees": trainees, "turns": turns, "pool_depth": pool_depth, "backend": logic.AI_BACKEND,
+                  "wall_s": round(wall, 2), "failed_trainees": failed, "stages": {}}
+        for stage in STAGES:
+            vals = rec.samples.get(stage, [])
+            report["stages"][stage] = {
+                "n": len(vals), "errors": rec.errors.get(stage, 0),
+                **{f"p{p}_ms": round(percentile(vals, p) * 1000, 1) if vals else None for p in (50, 95, 99)},
+            }
+        return report
+    finally:
+        if utils._STORE is not None: utils._STORE.close_all()
+        utils._STORE = None
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def print_report(report):
+    print(f"{report['trainees']} trainees x {report['turns']} turns on '{report['backend']}' "
+          f"in {report['wall_s']}s ({report['failed_trainees']} failed)")
+    print(f"{'stage':<18}{'n':>6}{'err':>5}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}")
+    for stage, r in report["stages"].items():
+        cells = "".join(f"{r[k]:>11,.1f}" if r[k] is not None else f"{'-':>11}" for k in ("p50_ms", "p95_ms", "p99_ms"))
+        print(f"{stage:<18}{r['n']:>6}{r['errors']:>5}{cells}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end load test with simulated trainees")
+    parser.add_argument("--trainees", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--pool", type=int, default=0, help="pre-fill a scenario pool of this depth")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--storage", default="json", choices=["json", "sqlite"])
+    parser.add_argument("--time-scale", type=float, help="scale stub latencies (0 = no sleeping)")
+    parser.add_argument("--profile", help="JSON overrides for the stub latency/size profile")
+    parser.add_argument("--out", help="write the report as JSON to this path")
+    args = parser.parse_args()
+
+    if logic.AI_BACKEND == "stub":
+        import stub_backends
+        stub_backends.configure(profile=json.loads(args.profile) if args.profile else None,
+                                seed=args.seed, time_scale=args.time_scale)
+
+    report = run_load_test(args.trainees, args.turns, args.pool, args.seed, args.storage)
+    print_report(report)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,179 @@
+# bench_storage.py
+# ==========================================
+# ⏱️ 存储后端对比基准 (JSON 文件 vs SQLite)
+# ==========================================
+# 用 hotel_utils 的词库生成合成数据，在临时目录里分别测两个后端：
+#   python bench_storage.py                       # 10k / 100k 条
+#   python bench_storage.py --sizes 1000 --ops 50 --out bench_storage.json
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+import hotel_utils as utils
+
+FILLER = "ロビーは静まり返っていたが、フロントの電話だけが鳴り続けている。"
+
+
+# ==========================================
+# 🧪 1. 合成数据 (Synthetic Library)
+# ==========================================
+def _story(rng, n=12):
+    """约 500 字的背景故事 (与真实生成结果体量相近)"""
+    words = utils.SPECIAL_CONDITIONS + utils.COMPLAINT_TYPES + utils.SEASONS
+    return "".join(rng.choice(words) + FILLER for _ in range(n))
+
+def make_world(i, rng):
+    return {
+        "name": f"{rng.choice(utils.HOTEL_NAMES)} #{i}",
+        "type": rng.choice(utils.HOTEL_TYPES),
+        "policy": rng.choice(["お客様は神様 (CS重視)", "利益第一 (コストカット)", "伝統と格式"]),
+        "occupancy": rng.choice(utils.OCCUPANCY_STATES),
+        "stars": round(rng.uniform(1.0, 5.0), 1),
+        "allowed_compensations": "ドリンク券配布, 部屋交換",
+        "constraints": rng.choice(utils.OCCUPANCY_STATES),
+        "background_story": _story(rng),
+    }
+
+def make_guest(i, rng):
+    return {
+        "name": f"{rng.choice(utils.CHAR_NAMES)} #{i}",
+        "gender": rng.choice(utils.GENDERS),
+        "job": rng.choice(utils.CHAR_JOBS),
+        "personality": rng.choice(utils.PERSONALITY_TRAITS),
+        "vip_level": rng.choice(utils.VIP_LEVELS),
+        "initial_mood": rng.choice(utils.INITIAL_MOODS),
+        "initial_anger": rng.randint(10, 100),
+        "bio": _story(rng),
+        "specific_incident": rng.choice(utils.COMPLAINT_TYPES),
+        "default_complaint": "ちょっと、どうなってるんですか！",
+        "voice_id": "ja-JP-NanamiNeural",
+    }
+
+def make_staff(i, rng):
+    gender = rng.choice(utils.GENDERS)
+    names = utils.STAFF_NAMES_MALE if gender == "男性" else utils.STAFF_NAMES_FEMALE
+    role = rng.choice(list(utils.STAFF_PRESETS.keys()))
+    return {
+        "name": f"{rng.choice(names)} #{i}",
+        "gender": gender,
+        "role": role,
+        "experience": rng.choice(utils.STAFF_PRESETS[role]),
+        "personality": rng.choice(utils.PERSONALITY_TRAITS),
+        "bio": _story(rng),
+        "voice_id": "ja-JP-KeitaNeural",
+    }
+
+def make_history(i, rng):
+    score = rng.randint(0, 100)
+    return {
+        "timestamp": f"2026-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(0, 23):02d}:00",
+        "world": f"{rng.choice(utils.HOTEL_NAMES)} #{rng.randint(0, i + 1)}",
+        "guest": f"{rng.choice(utils.CHAR_NAMES)} #{i}",
+        "score": score,
+        "status": "見習い",
+        "result": {
+            "manager_review": {"score": score, "advice": _story(rng, 4)},
+            "guest_inner_voice": {"satisfaction": "★" * rng.randint(1, 5), "detailed_comment": _story(rng, 6)},
+        },
+    }
+
+def make_library(n, seed=0):
+    rng = random.Random(seed)
+    return {
+        "worlds": [make_world(i, rng) for i in range(n)],
+        "characters": [make_guest(i, rng) for i in range(n)],
+        "staff": [make_staff(i, rng) for i in range(n)],
+        "history": [make_history(i, rng) for i in range(n)],
+    }
+
+
+# ==========================================
+# 📂 2. 临时数据目录 (重定向 hotel_utils 的路径)
+# ==========================================
+def use_data_dir(data_dir, backend):
+    utils.WORLDS_FILE = os.path.join(data_dir, "worlds.json")
+    utils.CHARS_FILE = os.path.join(data_dir, "characters.json")
+    utils.STAFF_FILE = os.path.join(data_dir, "staff.json")
+    utils.HISTORY_FILE = os.path.join(data_dir, "history.json")
+    utils.HISTORY_LOG = os.path.join(data_dir, "history.jsonl")
+    utils.set_storage_backend(backend, os.path.join(data_dir, "hotel.db"))
+
+def populate(lib):
+    utils.save_json(utils.WORLDS_FILE, lib["worlds"])
+    utils.save_json(utils.CHARS_FILE, lib["characters"])
+    utils.save_json(utils.STAFF_FILE, lib["staff"])
+    utils.save_history(lib["history"])
+
+
+# ==========================================
+# ⏱️ 3. 计时
+# ==========================================
+def timed(fn, repeat=1):
+    """返回每次调用的平均毫秒数"""
+    start = time.perf_counter()
+    for _ in range(repeat): fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def bench_backend(backend, n, ops, seed=0):
+    rng = random.Random(seed + 1)
+    lib = make_library(n, seed)
+    names = [g["name"] for g in lib["characters"]]
+    data_dir = tempfile.mkdtemp(prefix=f"hotel_bench_{backend}_")
+    try:
+        use_data_dir(data_dir, backend)
+        res = {"backend": backend, "records": n}
+        res["populate_ms"] = timed(lambda: populate(lib))
+
+        utils.invalidate_cache()
+        res["load_json_cold_ms"] = timed(lambda: utils.load_json(utils.CHARS_FILE))
+        res["load_json_warm_ms"] = timed(lambda: utils.load_json(utils.CHARS_FILE), ops)
+        res["list_names_ms"] = timed(lambda: utils.list_names(utils.CHARS_FILE), ops)
+        res["get_by_name_ms"] = timed(lambda: utils.get_by_name(utils.CHARS_FILE, rng.choice(names)), ops * 10)
+
+        counter = iter(range(n, n + 10 * ops))
+        res["add_to_library_ms"] = timed(
+            lambda: utils.add_to_library(utils.CHARS_FILE, make_guest(next(counter), rng)), ops)
+        res["delete_from_library_ms"] = timed(
+            lambda: utils.delete_from_library(utils.CHARS_FILE, rng.choice(names)), ops)
+        res["add_to_history_ms"] = timed(lambda: utils.add_to_history(make_history(next(counter), rng)), ops)
+        res["load_history_page_ms"] = timed(lambda: utils.load_history(0, 20), ops)
+        world_names = [w["name"] for w in lib["worlds"]]
+        res["update_world_rating_ms"] = timed(
+            lambda: utils.update_world_rating(rng.choice(world_names), rng.randint(1, 5)), ops)
+        res["disk_bytes"] = sum(os.path.getsize(os.path.join(data_dir, f)) for f in os.listdir(data_dir))
+        return res
+    finally:
+        if utils._STORE is not None: utils._STORE.close_all()
+        utils._STORE = None
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def print_table(results):
+    keys = [k for k in results[0] if k not in ("backend", "records")]
+    print(f"{'metric':<26}" + "".join(f"{r['backend'] + '@' + str(r['records']):>18}" for r in results))
+    for k in keys:
+        row = "".join(f"{r[k]:>18,.2f}" if isinstance(r[k], float) else f"{r[k]:>18,}" for r in results)
+        print(f"{k:<26}{row}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the JSON and SQLite storage backends")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--ops", type=int, default=10, help="repetitions per mutating operation")
+    parser.add_argument("--backends", nargs="+", default=["json", "sqlite"], choices=["json", "sqlite"])
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        for backend in args.backends:
+            print(f"▶ {backend} @ {n:,} records ...", flush=True)
+            results.append(bench_backend(backend, n, args.ops))
+    print_table(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,142 @@
+# bench_tts_formats.py
+# ==========================================
+# 🔊 TTS 输出格式对比 (WAV vs MP3 / Opus)
+# ==========================================
+# 同样的句子用不同的 SpeechSynthesisOutputFormat 合成，比较：
+# - payload 大小 (每轮发给浏览器的字节数) 和实际码率
+# - 首字节 / 合成完成耗时
+# - 能开始播放的时间 ≈ 合成完成 + payload 按给定带宽传完 (st.audio 整段下载后播放)
+# 需要 Azure Speech 密钥 (环境变量 AZURE_SPEECH_KEY / AZURE_SPEECH_REGION 或 .streamlit/secrets.toml)：
+#   python bench_tts_formats.py --out bench/tts_formats.json
+#   python bench_tts_formats.py --formats wav mp3-48k opus-24k --mbps 1 5 20 --repeat 5
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import logic
+
+SAMPLES = {
+    "short": "かしこまりました。少々お待ちくださいませ。",
+    "medium": "大変申し訳ございません。ただいまお部屋の状況を確認いたしますので、恐れ入りますが少々お待ちいただけますでしょうか。",
+    "angry_monologue": (
+        "ちょっと、どういうことなの！？予約サイトでは確かにオーシャンビューって書いてあったのよ。"
+        "それなのに案内された部屋の窓からは隣のビルの壁しか見えないじゃない。"
+        "記念日だから何ヶ月も前から楽しみにしていたのに、チェックインでも三十分も待たされて、"
+        "説明もなければ謝罪もない。こんな対応をされるなんて本当に信じられないわ。"
+        "責任者を呼んでちょうだい。今すぐ部屋を替えるか、それができないなら全額返金してもらいます。"
+        "口コミにも全部書かせてもらいますからね。聞いてるの？黙っていないで何とか言いなさいよ！"
+    ),
+}
+
+
+def _use_env_credentials():
+    """环境变量里有密钥时优先用 (脚本不经过 streamlit 也能跑)"""
+    key, region = os.environ.get("AZURE_SPEECH_KEY"), os.environ.get("AZURE_SPEECH_REGION")
+    if key and region:
+        logic._azure_credentials = lambda: (key, region)
+
+
+def _duration_ms(result):
+    d = getattr(result, "audio_duration", None)
+    return d.total_seconds() * 1000 if d else None
+
+
+def bench_format(fmt, texts, repeat, voice, style):
+    """每个格式先合成一次预热 (连接建立不计入)，之后每句测 repeat 次"""
+    entry = logic._new_synthesizer(voice, fmt)
+    synth = entry["synth"]
+    try:
+        synth.speak_ssml_async(logic.build_ssml("テスト", voice, style, 1.2)).get()
+        rows = {}
+        for name, text in texts.items():
+            ssml = logic.build_ssml(text, voice, style, 1.2)
+            first, total, size, duration = [], [], None, None
+            for _ in range(repeat):
+                entry["t0"], entry["first_byte"] = time.perf_counter(), None
+                result = synth.speak_ssml_async(ssml).get()
+                elapsed = (time.perf_counter() - entry["t0"]) * 1000
+                if result.reason != logic.speechsdk.ResultReason.SynthesizingAudioCompleted:
+                    raise RuntimeError(f"{fmt}: synthesis failed ({result.reason})")
+                total.append(elapsed)
+                if entry["first_byte"] is not None: first.append(entry["first_byte"])
+                size, duration = len(result.audio_data), _duration_ms(result)
+            rows[name] = {
+                "chars": len(text),
+                "bytes": size,
+                "audio_ms": round(duration) if duration else None,
+                "kbps": round(size * 8 / duration, 1) if duration else None,
+                "first_byte_ms": round(statistics.median(first), 1) if first else None,
+                "synth_ms": round(statistics.median(total), 1),
+                "mime": logic.audio_mime(result.audio_data),
+            }
+        return rows
+    finally:
+        logic._close_synthesizer(entry)
+
+
+def time_to_play(row, mbps):
+    """合成完成 + 整段 payload 传到浏览器 (不含浏览器解码，MP3/Opus 的解码开销在毫秒级)"""
+    return round(row["synth_ms"] + row["bytes"] * 8 / (mbps * 1e6) * 1000, 1)
+
+
+def print_results(results, mbps_list, baseline="wav"):
+    if not results: return
+    base = results.get(baseline)
+    for name in next(iter(results.values())):
+        print(f"\n▶ {name}")
+        header = f"  {'format':<10}{'bytes':>10}{'vs wav':>8}{'kbps':>8}{'1st byte':>10}{'synth':>9}"
+        header += "".join(f"{f'play@{m}M':>11}" for m in mbps_list)
+        print(header)
+        for fmt, rows in results.items():
+            r = rows[name]
+            ratio = f"{r['bytes'] / base[name]['bytes']:.2f}" if base else "-"
+            line = (f"  {fmt:<10}{r['bytes']:>10,}{ratio:>8}{r['kbps'] or 0:>8,.1f}"
+                    f"{r['first_byte_ms'] or 0:>10,.0f}{r['synth_ms']:>9,.0f}")
+            line += "".join(f"{time_to_play(r, m):>11,.0f}" for m in mbps_list)
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare Azure TTS output formats: payload size and time-to-play")
+    parser.add_argument("--formats", nargs="+", default=["wav", "mp3-32k", "mp3-48k", "mp3-96k", "opus-24k"],
+                        choices=sorted(logic.TTS_FORMATS))
+    parser.add_argument("--repeat", type=int, default=3, help="timed syntheses per sentence and format")
+    parser.add_argument("--mbps", type=float, nargs="+", default=[1, 5, 20], help="link speeds for time-to-play")
+    parser.add_argument("--voice", default="ja-JP-NanamiNeural")
+    parser.add_argument("--style", default="angry")
+    parser.add_argument("--text", help="extra sentence to include as 'custom'")
+    parser.add_argument("--out", help="write results as JSON to this path")
+    args = parser.parse_args()
+
+    _use_env_credentials()
+    texts = dict(SAMPLES)
+    if args.text: texts["custom"] = args.text
+
+    results = {}
+    for fmt in args.formats:
+        print(f"▶ {fmt} ...", flush=True)
+        try:
+            results[fmt] = bench_format(fmt, texts, args.repeat, args.voice, args.style)
+        except Exception as e:
+            sys.exit(f"{fmt}: {e}")
+    print_results(results, args.mbps)
+
+    if args.out:
+        report = {
+            "meta": {
+                "python": platform.python_version(),
+                "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "voice": args.voice, "style": args.style, "repeat": args.repeat, "mbps": args.mbps,
+            },
+            "results": results,
+            "time_to_play_ms": {fmt: {name: {str(m): time_to_play(r, m) for m in args.mbps}
+                                      for name, r in rows.items()} for fmt, rows in results.items()},
+        }
+        out_dir = os.path.dirname(args.out)
+        if out_dir and not os.path.exists(out_dir): os.makedirs(out_dir)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
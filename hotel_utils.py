@@ -17,7 +17,21 @@ import os
 import re
 import io
 import random
+import textwrap
+import itertools
+import threading
+import hashlib
+import unicodedata
+import time
+import queue
+import atexit
+import array
+import wave
+import sys
+from datetime import datetime
 import streamlit as st
+import streamlit.components.v1 as components
+import base64
 from gtts import gTTS
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
@@ -35,7 +49,12 @@ DATA_DIR = os.path.join(BASE_DIR, "data")
 CHARS_FILE = os.path.join(DATA_DIR, "characters.json")
 STAFF_FILE = os.path.join(DATA_DIR, "staff.json")
 WORLDS_FILE = os.path.join(DATA_DIR, "worlds.json")
-HISTORY_FILE = os.path.join(DATA_DIR, "history.json")
+HISTORY_FILE = os.path.join(DATA_DIR, "history.json")   # 旧格式 (整文件 JSON 数组)，仅用于迁移
+HISTORY_LOG = os.path.join(DATA_DIR, "history.jsonl")   # 新格式：一行一条，只追加
+
+# 4. 存储后端："json" (默认，data/ 下的文件) 或 "sqlite" (见 storage_sqlite.py)
+STORAGE_BACKEND = os.environ.get("HOTEL_STORAGE_BACKEND", "json").lower()
+DB_FILE = os.environ.get("HOTEL_DB_FILE", os.path.join(DATA_DIR, "hotel.db"))
 
 # 确保 data 目录一定存在（如果不存在则自动创建）
 if not os.path.exists(DATA_DIR):
@@ -165,6 +184,15 @@ TIME_SETTINGS = [
     "早朝 (6:00)", "昼下がり (14:00)", "夕方 (18:00)", "深夜 (2:00)"
 ]
 
+# ==========================================
+# 🎲 5.5 Quick Play 随机参数 (app 与 scenario_pool 共用)
+# ==========================================
+QUICK_POLICIES = ["お客様は神様 (CS重視)", "利益第一 (コストカット)", "事なかれ主義", "伝統と格式", "フレンドリー＆カジュアル", "完全なる放置"]
+DIFFICULTY_LEVELS = ["Easy (初級)", "Normal (中級)", "Hard (上級)", "Hell (理不尽)"]
+FACILITY_LEVELS = ["雨漏りするボロ宿", "昭和レトロな設備", "一般的なビジネスホテル", "リノベーション済み", "最新鋭のスマート設備", "王宮のような豪華設備"]
+EXP_LEVELS = ["新人 (研修中)", "1年目", "3年 (一人前)", "10年のベテラン", "伝説のコンシェルジュ"]
+STRESS_LEVELS = ["やる気満々", "通常", "少し疲れている", "疲労困憊", "辞める寸前"]
+
 # ==========================================
 # 📜 6. Prompt 基础设定
 # ==========================================
@@ -210,9 +238,39 @@ def validate_data(data_list):
         if item.get("name"): valid_data.append(item)
     return valid_data
 
+# ⚡ 进程级读取缓存：以 路径 + (mtime, size) 为键，所有 Streamlit 会话共享。
+# 文件没变就不再解析；save_json 写完后主动失效。
+# 注意：缓存里的记录是共享对象，调用方只读，需要修改时先 dict(...) 复制。
+_JSON_CACHE = {}  # filepath -> (文件签名, 数据)
+_JSON_CACHE_LOCK = threading.Lock()
+
+def _cached_read(filepath, loader):
+    """按文件签名缓存 loader(filepath) 的结果"""
+    sig = _file_sig(filepath)
+    cached = _JSON_CACHE.get(filepath)
+    if cached and cached[0] == sig: return cached[1]
+    data = loader(filepath)
+    with _JSON_CACHE_LOCK:
+        _JSON_CACHE[filepath] = (sig, data)
+    return data
+
+def invalidate_cache(filepath=None):
+    """清除读取缓存 (filepath=None 时全部清除)"""
+    with _JSON_CACHE_LOCK:
+        if filepath is None: _JSON_CACHE.clear()
+        else: _JSON_CACHE.pop(filepath, None)
+    _BACKUP_CACHE.clear()
+
 def load_json(filepath):
-    """读取 JSON 文件"""
+    """读取 JSON 文件 (带缓存，返回列表的浅拷贝)"""
+    if _use_sqlite(filepath): return _sqlite_store().load_assets(asset_kind(filepath))
     if not os.path.exists(filepath): return []
+    try:
+        return list(_cached_read(filepath, _load_json_uncached))
+    except FileNotFoundError:
+        return []
+
+def _load_json_uncached(filepath):
     try:
         with open(filepath, "r", encoding="utf-8") as f:
             data = json.load(f)
@@ -227,20 +285,218 @@ def load_json(filepath):
         print(f"Error loading {filepath}: {e}")
         return []
 
+def _tmp_path(path):
+    """每个写入者 (进程 + 线程) 各用自己的临时文件，并发写时不会互相覆盖、互相 rename 走"""
+    return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
 def save_json(filepath, data):
-    """保存 JSON 文件"""
+    """保存 JSON 文件（库文件同时写出名字索引）"""
+    if _use_sqlite(filepath):
+        try: _sqlite_store().replace_assets(asset_kind(filepath), validate_data(data or []))
+        except Exception as e: st.error(f"Save failed: {e}")
+        return
     dir_path = os.path.dirname(filepath)
     if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+    tmp_path = _tmp_path(filepath)
     try:
-        with open(filepath, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        entries = []
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            if isinstance(data, list) and data:
+                # 与 json.dump(indent=4) 输出完全一致，只是逐条写入以便记录字节偏移
+                offset = _write_text(f, "[\n", 0)
+                for i, item in enumerate(data):
+                    if i > 0: offset = _write_text(f, ",\n", offset)
+                    chunk = textwrap.indent(json.dumps(item, indent=4, ensure_ascii=False), "    ")
+                    length = len(chunk.encode("utf-8"))
+                    name = ensure_dict(item).get("name")
+                    if name: entries.append([name, offset, length])
+                    offset = _write_text(f, chunk, offset)
+                _write_text(f, "\n]", offset)
+            else:
+                json.dump(data, f, indent=4, ensure_ascii=False)
+        sig = _file_sig(tmp_path)  # rename 不改 mtime/size；rename 之后再取可能已经是别人写的文件
+        os.replace(tmp_path, filepath)
+        invalidate_cache(filepath)
+        if "history" not in os.path.basename(filepath):
+            _write_index(filepath, entries, sig)
     except Exception as e:
         st.error(f"Save failed: {e}")
+        try: os.remove(tmp_path)
+        except OSError: pass
+
+# ==========================================
+# 🗄️ 7.4 存储后端调度 (json / sqlite)
+# ==========================================
+_STORE = None
+
+def set_storage_backend(backend, db_path=None):
+    """切换存储后端 (导入脚本 / 基准测试用)"""
+    global STORAGE_BACKEND, DB_FILE
+    STORAGE_BACKEND = backend
+    if db_path: DB_FILE = db_path
+    invalidate_cache()
+
+def _sqlite_store():
+    global _STORE
+    if _STORE is None or _STORE.db_path != DB_FILE:
+        from storage_sqlite import SQLiteStore
+        if _STORE is not None: _STORE.close_all()
+        _STORE = SQLiteStore(DB_FILE)
+    return _STORE
+
+@atexit.register
+def _close_sqlite_store():
+    """进程退出时关闭所有 SQLite 连接 (最后一条连接关闭时 WAL 会 checkpoint 回主库)"""
+    if _STORE is not None: _STORE.close_all()
+
+def asset_kind(filepath):
+    """文件路径 -> 资产类别 (worlds / characters / staff)"""
+    return os.path.splitext(os.path.basename(filepath))[0]
+
+def _use_sqlite(filepath=None):
+    """履历的旧 JSON 文件 (只用于迁移) 永远走文件"""
+    if STORAGE_BACKEND != "sqlite": return False
+    return filepath is None or "history" not in os.path.basename(filepath)
+
+# ==========================================
+# 🗂️ 7.5 名字索引 (Indexed Asset Store)
+# ==========================================
+# 每个库文件旁边有一个 <file>.idx，记录 name -> (字节偏移, 长度)。
+# 按名字取一条记录时只 seek + 解析这一条，不再整文件 json.load + validate_data。
+_INDEX_CACHE = {}  # filepath -> (文件签名, 索引)
+
+def _write_text(f, text, offset):
+    f.write(text)
+    return offset + len(text.encode("utf-8"))
+
+def _file_sig(filepath):
+    """文件签名：mtime + size，任何改写都会变"""
+    info = os.stat(filepath)
+    return [info.st_mtime_ns, info.st_size]
+
+def _index_path(filepath):
+    return filepath + ".idx"
+
+def _scan_offsets(filepath):
+    """[慢路径] 扫描一遍 JSON 数组，算出每条记录的字节偏移（手动改过文件/旧文件时用）"""
+    with open(filepath, "r", encoding="utf-8") as f:
+        text = f.read()
+    entries = []
+    pos = text.find("[")
+    if pos < 0: return entries
+    decoder = json.JSONDecoder()
+    pos += 1
+    byte_pos = len(text[:pos].encode("utf-8"))
+    while True:
+        start = pos
+        while pos < len(text) and text[pos] in " \t\r\n,": pos += 1
+        byte_pos += len(text[start:pos].encode("utf-8"))
+        if pos >= len(text) or text[pos] == "]": break
+        obj, end = decoder.raw_decode(text, pos)
+        length = len(text[pos:end].encode("utf-8"))
+        name = ensure_dict(obj).get("name")
+        if name: entries.append([name, byte_pos, length])
+        byte_pos += length
+        pos = end
+    return entries
+
+def _write_index(filepath, entries, sig):
+    """sig = 写入的那个数据文件的签名；读的时候对不上就当索引过期"""
+    try:
+        tmp_path = _tmp_path(_index_path(filepath))
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"sig": sig, "entries": entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, _index_path(filepath))
+    except Exception as e:
+        print(f"Index write failed for {filepath}: {e}")
+
+def _build_index(entries):
+    offsets = {}
+    for name, off, length in entries:
+        offsets.setdefault(name, (off, length))  # 同名时与 next(...) 一样取第一条
+    return {"names": list(offsets.keys()), "offsets": offsets}
+
+def _get_index(filepath):
+    """取名字索引：进程内缓存 -> .idx 文件 -> 全量扫描重建"""
+    if not os.path.exists(filepath): return _build_index([])
+    sig = _file_sig(filepath)
+    cached = _INDEX_CACHE.get(filepath)
+    if cached and cached[0] == sig: return cached[1]
+
+    entries = None
+    try:
+        with open(_index_path(filepath), "r", encoding="utf-8") as f:
+            idx = json.load(f)
+        if idx.get("sig") == sig: entries = idx.get("entries", [])
+    except Exception:
+        pass
+    if entries is None:
+        try:
+            entries = _scan_offsets(filepath)
+            if _file_sig(filepath) == sig:  # 扫描期间没被别人改写才落盘
+                _write_index(filepath, entries, sig)
+        except Exception as e:
+            print(f"Error indexing {filepath}: {e}")
+            entries = []
+
+    index = _build_index(entries)
+    _INDEX_CACHE[filepath] = (sig, index)
+    return index
+
+def _read_record(filepath, offset, length):
+    with open(filepath, "rb") as f:
+        f.seek(offset)
+        return ensure_dict(json.loads(f.read(length).decode("utf-8")))
+
+def get_by_name(filepath, name):
+    """按名字读取一条记录（只解析这一条），找不到返回 None"""
+    if not name: return None
+    if _use_sqlite(filepath): return _sqlite_store().get_asset(asset_kind(filepath), name)
+    loc = _get_index(filepath)["offsets"].get(name)
+    if not loc: return None
+    try:
+        return _read_record(filepath, *loc)
+    except Exception as e:
+        print(f"Error reading {name} from {filepath}: {e}")
+        return None
+
+def world_eval_context(world_name):
+    """评价用的环境锚定信息 (app.py 和 batch_eval 共用，从世界观库里补全)"""
+    w = get_by_name(WORLDS_FILE, world_name) or {}
+    return {
+        "name": world_name,
+        "type": w.get("type", "ホテル"),
+        "constraints": w.get("constraints"),
+        "context": w.get("context"),
+    }
+
+def list_names(filepath):
+    """库里所有名字（保持文件顺序，最新的在前）"""
+    if _use_sqlite(filepath): return _sqlite_store().list_names(asset_kind(filepath))
+    return list(_get_index(filepath)["names"])
+
+def load_page(filepath, page, page_size=50):
+    """分页读取：第 page 页 (从 0 开始) 的记录列表"""
+    if _use_sqlite(filepath): return _sqlite_store().load_page(asset_kind(filepath), page, page_size)
+    index = _get_index(filepath)
+    names = index["names"][page * page_size:(page + 1) * page_size]
+    page_items = []
+    for name in names:
+        try: page_items.append(_read_record(filepath, *index["offsets"][name]))
+        except Exception as e: print(f"Error reading {name} from {filepath}: {e}")
+    return page_items
+
+def iter_pages(filepath, page_size=50):
+    """按页迭代整个库，每次只解析一页"""
+    total = len(list_names(filepath))
+    for page in range((total + page_size - 1) // page_size):
+        yield load_page(filepath, page, page_size)
 
 def add_to_library(filepath, new_item):
     """添加到库（去重）"""
     new_item = ensure_dict(new_item)
     if not new_item.get("name"): return
+    if _use_sqlite(filepath): return _sqlite_store().add_asset(asset_kind(filepath), new_item)
     data = load_json(filepath)
     data = [d for d in data if d.get("name") != new_item.get("name")]
     data.insert(0, new_item)
@@ -248,6 +504,7 @@ def add_to_library(filepath, new_item):
 
 def delete_from_library(filepath, name_to_delete):
     """从库中删除"""
+    if _use_sqlite(filepath): return _sqlite_store().delete_asset(asset_kind(filepath), name_to_delete)
     data = load_json(filepath)
     new_data = [d for d in data if d.get("name") != name_to_delete]
     save_json(filepath, new_data)
@@ -259,15 +516,44 @@ def autoplay_audio(text):
         clean_text = re.sub(r'（.*?）', '', clean_text)
         clean_text = re.sub(r'\(.*?\)', '', clean_text)
         if not clean_text: return
-        
-        tts = gTTS(text=clean_text, lang='ja')
-        fp = io.BytesIO()
-        tts.write_to_fp(fp)
-        fp.seek(0)
-        st.audio(fp, format='audio/mp3', autoplay=True)
+
+        cache_key = tts_cache_key(clean_text, "gtts-ja", "", 0, fmt="mp3")
+        audio = tts_cache_get(cache_key)
+        if not audio:
+            tts = gTTS(text=clean_text, lang='ja')
+            fp = io.BytesIO()
+            tts.write_to_fp(fp)
+            audio = fp.getvalue()
+            tts_cache_put(cache_key, audio)
+        st.audio(audio, format='audio/mp3', autoplay=True)
     except Exception as e:
         print(f"TTS Error: {e}")
 
+# 浏览器端的播放队列：挂在父页面 window 上，所有 queue_audio 调用共用，一段放完接下一段。
+# rerun 会移除组件 iframe，但已经入队的音频在父页面里继续按顺序播放。
+_AUDIO_QUEUE_JS = """
+<script>
+const w = window.parent;
+const q = w.__hotelAudioQueue || (w.__hotelAudioQueue = {items: [], playing: false});
+q.items.push("data:%s;base64,%s");
+function next() {
+    if (q.playing || !q.items.length) return;
+    q.playing = true;
+    const a = new w.Audio(q.items.shift());
+    const done = () => { q.playing = false; next(); };
+    a.onended = done;
+    a.onerror = done;
+    a.play().catch(done);
+}
+next();
+</script>
+"""
+
+def queue_audio(audio, mime="audio/wav"):
+    """把一段音频排进浏览器的播放队列 (按调用顺序连续播放，不打断正在放的)"""
+    if not audio: return
+    components.html(_AUDIO_QUEUE_JS % (mime, base64.b64encode(audio).decode("ascii")), height=0)
+
 # ==========================================
 # 📈 8. 经营核心算法 (Tycoon Rating)
 # ==========================================
@@ -283,22 +569,8 @@ def parse_stars(star_text):
     if star_count > 0: return min(star_count, 5)
     return 3
 
-def update_world_rating(world_name, new_guest_score):
-    """更新酒店评分（加权平均）"""
-    if not world_name: return 3.0, 3.0
-    
-    worlds = load_json(WORLDS_FILE)
-    target_world = None
-    target_index = -1
-    
-    for i, w in enumerate(worlds):
-        if w['name'] == world_name:
-            target_world = w
-            target_index = i
-            break
-            
-    if not target_world: return 3.0, 3.0
-    
+def _apply_rating(target_world, new_guest_score):
+    """在 target_world 上计入一次评分，返回 (旧评分, 新评分)"""
     if 'rating_count' not in target_world: target_world['rating_count'] = 10
     if 'current_rating' not in target_world:
         try:
@@ -318,34 +590,418 @@ def update_world_rating(world_name, new_guest_score):
     
     target_world['current_rating'] = new_rating
     target_world['rating_count'] += 1
+    return old_rating, new_rating
+
+def update_world_rating(world_name, new_guest_score):
+    """更新酒店评分（加权平均）"""
+    if not world_name: return 3.0, 3.0
+
+    if _use_sqlite():
+        # 读-算-写在同一个事务里，并发评分不会互相覆盖
+        result = _sqlite_store().update_world(world_name, _apply_rating, new_guest_score)
+        return result if result else (3.0, 3.0)
+    
+    worlds = load_json(WORLDS_FILE)
+    target_world = None
+    target_index = -1
+    
+    for i, w in enumerate(worlds):
+        if w['name'] == world_name:
+            target_world = dict(w)  # 复制一份，不改动缓存里的共享记录
+            target_index = i
+            break
+            
+    if not target_world: return 3.0, 3.0
+    
+    old_rating, new_rating = _apply_rating(target_world, new_guest_score)
     
     worlds[target_index] = target_world
     save_json(WORLDS_FILE, worlds)
     
     return old_rating, new_rating
 
-# 9. 追加到play履历中
+# ==========================================
+# 📜 9. 追加到play履历中 (Append-only JSONL)
+# ==========================================
+# 一行一条记录，最早的在文件开头；“最新的在最上面”靠倒序读取实现。
+# 追加只写一行，不再读取+重写整个履历文件。
+_HISTORY_LOCK = threading.Lock()
+_HISTORY_READ_BLOCK = 64 * 1024
+
+def migrate_history_json():
+    """
+    [一次性] 把旧的 history.json (最新在前的数组) 转成 history.jsonl，
+    旧文件改名为 history.json.migrated 保留备份。
+    """
+    if not os.path.exists(HISTORY_FILE): return False
+    with _HISTORY_LOCK:
+        if not os.path.exists(HISTORY_FILE): return False
+        old_entries = load_json(HISTORY_FILE)
+        # 旧数据比 jsonl 里已有的都早，所以写在前面
+        existing = b""
+        if os.path.exists(HISTORY_LOG):
+            with open(HISTORY_LOG, "rb") as f: existing = f.read()
+        tmp_path = _tmp_path(HISTORY_LOG)
+        with open(tmp_path, "wb") as f:
+            for entry in reversed(old_entries):
+                f.write(_history_line(entry))
+            f.write(existing)
+        os.replace(tmp_path, HISTORY_LOG)
+        os.replace(HISTORY_FILE, HISTORY_FILE + ".migrated")
+    print(f"History migrated: {len(old_entries)} entries -> {HISTORY_LOG}")
+    return True
+
+def _history_line(entry):
+    return (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+
+def _ends_with_newline(filepath):
+    """文件为空 / 不存在时也算 True"""
+    try:
+        with open(filepath, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0: return True
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+    except FileNotFoundError:
+        return True
 
 def add_to_history(entry):
     """
-    将评估结果追加到历史记录文件中
+    将评估结果追加到历史记录文件中 (O(1)：只追加一行)
     """
     try:
-        # 1. 尝试读取现有记录
-        data = load_json(HISTORY_FILE)
-        if not isinstance(data, list):
-            data = []
-            
-        # 2. 插入新记录到最前面 (最新的在最上面)
-        data.insert(0, entry)
-        
-        # 3. 写入文件
-        save_json(HISTORY_FILE, data)
+        if _use_sqlite():
+            _sqlite_store().add_history(entry)
+            return True
+        migrate_history_json()
+        line = _history_line(entry)
+        with _HISTORY_LOCK:
+            # 上次写到一半 (进程被杀) 时先换行，否则这一条会接在残行后面一起被丢掉
+            if not _ends_with_newline(HISTORY_LOG): line = b"\n" + line
+            # O_APPEND + 单次 write：多个会话同时结束也不会互相覆盖
+            fd = os.open(HISTORY_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        invalidate_cache(HISTORY_LOG)
         return True
     except Exception as e:
         print(f"Error saving history: {e}")
         return False
+
+def iter_history():
+    """倒序读取履历 (最新的在前)，从文件末尾按块往回读，不加载整个文件"""
+    if _use_sqlite():
+        yield from _sqlite_store().iter_history()
+        return
+    migrate_history_json()
+    if not os.path.exists(HISTORY_LOG): return
+    with open(HISTORY_LOG, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        tail = b""
+        while pos > 0:
+            size = min(_HISTORY_READ_BLOCK, pos)
+            pos -= size
+            f.seek(pos)
+            lines = (f.read(size) + tail).split(b"\n")
+            tail = lines.pop(0)  # 可能是不完整的一行，留到下一块
+            for line in reversed(lines):
+                entry = _parse_history_line(line)
+                if entry is not None: yield entry
+        entry = _parse_history_line(tail)
+        if entry is not None: yield entry
+
+def _parse_history_line(line):
+    if not line.strip(): return None
+    try:
+        return ensure_dict(json.loads(line.decode("utf-8")))
+    except Exception as e:
+        # 写到一半的行 (进程被杀) 直接跳过
+        print(f"Skipping broken history line: {e}")
+        return None
+
+def load_history(page=0, page_size=None):
+    """读取履历 (最新的在前)；page_size=None 时返回全部"""
+    if _use_sqlite(): return _sqlite_store().load_history(page, page_size)
+    if page_size is None:
+        migrate_history_json()
+        if not os.path.exists(HISTORY_LOG): return []
+        return list(_cached_read(HISTORY_LOG, lambda _: list(iter_history())))
+    start = page * page_size
+    return list(itertools.islice(iter_history(), start, start + page_size))
+
+def save_history(entries):
+    """整体覆盖履历 (仅用于备份恢复)，entries 为最新在前的列表"""
+    if _use_sqlite(): return _sqlite_store().replace_history([ensure_dict(e) for e in entries or []])
+    with _HISTORY_LOCK:
+        tmp_path = _tmp_path(HISTORY_LOG)
+        with open(tmp_path, "wb") as f:
+            for entry in reversed(entries or []):
+                f.write(_history_line(ensure_dict(entry)))
+        # 备份就是完整的履历：还没迁移的旧 history.json 直接退役，
+        # 否则之后的迁移会把旧条目再插到恢复后的履历前面 (重复 / 已删除的条目复活)
+        if os.path.exists(HISTORY_FILE): os.replace(HISTORY_FILE, HISTORY_FILE + ".migrated")
+        os.replace(tmp_path, HISTORY_LOG)
+    invalidate_cache(HISTORY_LOG)
+
+# 侧边栏“セーブ”用的整包 JSON：四个文件都没变时直接复用上次序列化的结果
+_BACKUP_CACHE = {}
+
+def _sig_or_none(filepath):
+    try: return tuple(_file_sig(filepath))
+    except OSError: return None
+
+def build_backup_json():
+    """把 worlds/guests/staffs/history 打包成一个 JSON 字符串 (带缓存)"""
+    if _use_sqlite(): watched = (DB_FILE, DB_FILE + "-wal")  # 任何提交都会改动 WAL 文件
+    else: watched = (WORLDS_FILE, CHARS_FILE, STAFF_FILE, HISTORY_LOG)
+    sigs = (STORAGE_BACKEND,) + tuple(_sig_or_none(p) for p in watched)
+    if _BACKUP_CACHE.get("sigs") == sigs: return _BACKUP_CACHE["json"]
+    current_data = {
+        "worlds": load_json(WORLDS_FILE),
+        "guests": load_json(CHARS_FILE),
+        "staffs": load_json(STAFF_FILE),
+        "history": load_history()
+    }
+    json_str = json.dumps(current_data, ensure_ascii=False, indent=2)
+    _BACKUP_CACHE.update({"sigs": sigs, "json": json_str})
+    return json_str
+
+def _percentile(ordered, p):
+    return ordered[max(0, -(-p * len(ordered) // 100) - 1)]  # 最近秩法
+
+_TRACE_STATS_CACHE = {}  # limit -> (履历签名, stats)
+
+def _history_sig():
+    """履历存储的签名 (sqlite 时连同 -wal 文件，写入未 checkpoint 时 .db 的 mtime 不变)"""
+    paths = [DB_FILE, DB_FILE + "-wal"] if _use_sqlite() else [HISTORY_LOG]
+    return tuple(_sig_or_none(p) for p in paths)
+
+def trace_latency_stats(limit=200):
+    """
+    最近 limit 条带 trace 的履历里，按阶段 (stt / llm / tts / eval ...) 汇总耗时百分位 (毫秒)。
+    llm 的首字延迟单独作为 llm_first_token。履历没变时直接返回上次的结果 (和 _cached_read 一样按签名)。
+    """
+    sig = _history_sig()
+    cached = _TRACE_STATS_CACHE.get(limit)
+    if cached and cached[0] == sig: return cached[1]
+    stats = _trace_latency_stats(limit)
+    with _JSON_CACHE_LOCK:
+        _TRACE_STATS_CACHE[limit] = (sig, stats)
+    return stats
+
+def _trace_latency_stats(limit):
+    samples = {}
+    for entry in itertools.islice((h for h in iter_history() if h.get("trace")), limit):
+        for sp in entry["trace"]:
+            if not isinstance(sp, dict) or "ms" not in sp: continue
+            samples.setdefault(sp.get("stage", "?"), []).append(sp["ms"])
+            if sp.get("first_token_ms") is not None:
+                samples.setdefault("llm_first_token", []).append(sp["first_token_ms"])
+    stats = {}
+    for stage, vals in samples.items():
+        vals.sort()
+        stats[stage] = {"n": len(vals), "p50": _percentile(vals, 50),
+                        "p95": _percentile(vals, 95), "p99": _percentile(vals, 99)}
+    return stats
     
+# ==========================================
+# 🔊 9.5 TTS 音频缓存 (内容寻址 + 磁盘 LRU)
+# ==========================================
+# 键 = sha256(规范化文本 + 声优 + 语气 + 强度 + 格式)。
+# 命中时 touch 文件 mtime，超过容量上限时按 mtime 从旧到新淘汰。
+TTS_CACHE_DIR = os.path.join(DATA_DIR, "tts_cache")
+TTS_CACHE_MAX_BYTES = int(os.environ.get("HOTEL_TTS_CACHE_MB", "200")) * 1024 * 1024
+TTS_CACHE_STATS = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+_TTS_CACHE_LOCK = threading.Lock()
+_tts_cache_bytes = None  # 首次写入时扫描一次目录，之后增量维护
+
+def normalize_tts_text(text):
+    """全角/半角统一、空白折叠，让只差空格的同一句话命中同一条缓存"""
+    text = unicodedata.normalize("NFKC", str(text))
+    return re.sub(r"\s+", " ", text).strip()
+
+def tts_cache_key(text, voice_id, style, styledegree, fmt="wav"):
+    raw = "\x1f".join([normalize_tts_text(text), str(voice_id), str(style), str(styledegree), str(fmt)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _tts_cache_path(key):
+    return os.path.join(TTS_CACHE_DIR, key[:2], key)
+
+def tts_cache_get(key):
+    """命中返回音频 bytes，未命中返回 None"""
+    path = _tts_cache_path(key)
+    try:
+        with open(path, "rb") as f: data = f.read()
+        os.utime(path)  # LRU: 最近使用
+        TTS_CACHE_STATS["hits"] += 1
+        return data
+    except OSError:
+        TTS_CACHE_STATS["misses"] += 1
+        return None
+
+def tts_cache_put(key, data):
+    global _tts_cache_bytes
+    if not data: return
+    path = _tts_cache_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = _tmp_path(path)
+        with open(tmp_path, "wb") as f: f.write(data)
+        os.replace(tmp_path, path)
+        with _TTS_CACHE_LOCK:
+            if _tts_cache_bytes is None: _tts_cache_bytes = sum(size for _, size, _ in _tts_cache_files())
+            else: _tts_cache_bytes += len(data)
+            TTS_CACHE_STATS["writes"] += 1
+            if _tts_cache_bytes > TTS_CACHE_MAX_BYTES: _evict_tts_cache()
+    except Exception as e:
+        print(f"TTS cache write failed: {e}")
+
+def _tts_cache_files():
+    """[(mtime, size, path), ...]"""
+    files = []
+    for root, _, names in os.walk(TTS_CACHE_DIR):
+        for name in names:
+            if name.endswith(".tmp"): continue
+            path = os.path.join(root, name)
+            try:
+                info = os.stat(path)
+                files.append((info.st_mtime, info.st_size, path))
+            except OSError:
+                pass
+    return files
+
+def _evict_tts_cache():
+    """淘汰最久未使用的文件，直到低于上限的 90% (调用方持有锁)"""
+    global _tts_cache_bytes
+    files = sorted(_tts_cache_files())
+    _tts_cache_bytes = sum(size for _, size, _ in files)
+    target = TTS_CACHE_MAX_BYTES * 0.9
+    for _, size, path in files:
+        if _tts_cache_bytes <= target: break
+        try:
+            os.remove(path)
+            _tts_cache_bytes -= size
+            TTS_CACHE_STATS["evictions"] += 1
+        except OSError:
+            pass
+
+def tts_cache_stats():
+    """命中/未命中计数 + 当前条数与占用"""
+    files = _tts_cache_files()
+    lookups = TTS_CACHE_STATS["hits"] + TTS_CACHE_STATS["misses"]
+    return dict(TTS_CACHE_STATS,
+                entries=len(files),
+                bytes=sum(size for _, size, _ in files),
+                hit_rate=round(TTS_CACHE_STATS["hits"] / lookups, 3) if lookups else 0.0)
+
+# ==========================================
+# 🎙️ 9.6 录音预处理 (静音裁剪 / 单声道 / 16kHz)
+# ==========================================
+# st.audio_input 的原始 WAV 前后常有几秒静音，且多为 44.1/48kHz。
+# 发给语音识别前：合成单声道 → 重采样到 16kHz → 按帧能量裁掉首尾静音。只用标准库 (wave / array)。
+#   HOTEL_AUDIO_PREP=0 关闭
+AUDIO_PREP_ENABLED = os.environ.get("HOTEL_AUDIO_PREP", "1") != "0"
+STT_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+VAD_PAD_MS = 250          # 语音前后各保留一点，避免切掉开头的辅音
+VAD_NOISE_RATIO = 3.0     # 能量超过底噪 (最安静 10% 帧) 的几倍算语音
+VAD_MIN_RMS = 200         # 16bit 下的绝对下限，安静环境里底噪接近 0 时用
+AUDIO_PREP_STATS = {"clips": 0, "bytes_in": 0, "bytes_out": 0, "trimmed_ms": 0, "prep_ms": 0.0}
+
+def _downmix(samples, channels):
+    if channels == 1: return samples
+    per_channel = [samples[c::channels] for c in range(channels)]
+    return array.array("h", (sum(frame) // channels for frame in zip(*per_channel)))
+
+def _resample(samples, rate, target):
+    """整数倍降采样取块平均；其它比例先做同宽度的滑动平均再线性插值"""
+    if rate == target or not samples: return samples
+    if rate % target == 0:
+        f = rate // target
+        return array.array("h", (sum(samples[i:i + f]) // f for i in range(0, len(samples) - f + 1, f)))
+    ratio = rate / target
+    width = int(round(ratio))
+    if width >= 2:  # 简单低通，减少混叠
+        acc, smoothed = 0, array.array("h")
+        for i, v in enumerate(samples):
+            acc += v
+            if i >= width: acc -= samples[i - width]
+            smoothed.append(acc // min(i + 1, width))
+        samples = smoothed
+    out_len = int(len(samples) / ratio)
+    out = array.array("h")
+    last = len(samples) - 1
+    for j in range(out_len):
+        pos = j * ratio
+        i = int(pos)
+        nxt = samples[i + 1] if i < last else samples[i]
+        out.append(int(samples[i] + (nxt - samples[i]) * (pos - i)))
+    return out
+
+def _trim_silence(samples, rate):
+    """返回 (裁剪后的样本, 裁掉的毫秒数)；整段都像静音时不裁"""
+    frame = max(1, rate * VAD_FRAME_MS // 1000)
+    energies = []
+    for i in range(0, len(samples), frame):
+        chunk = samples[i:i + frame]
+        energies.append((sum(v * v for v in chunk) / len(chunk)) ** 0.5)
+    if not energies: return samples, 0
+    floor = sorted(energies)[len(energies) // 10]
+    threshold = max(floor * VAD_NOISE_RATIO, VAD_MIN_RMS)
+    voiced = [i for i, e in enumerate(energies) if e >= threshold]
+    if not voiced: return samples, 0
+    pad = VAD_PAD_MS // VAD_FRAME_MS
+    start = max(0, voiced[0] - pad) * frame
+    end = min(len(samples), (voiced[-1] + 1 + pad) * frame)
+    return samples[start:end], (len(samples) - (end - start)) * 1000 // rate
+
+def preprocess_audio(wav_bytes):
+    """
+    录音 → 单声道 16kHz、去掉首尾静音的 WAV。返回 (bytes, info)。
+    不是 16bit PCM WAV 时原样返回 (info["skipped"] 说明原因)。
+    """
+    info = {"bytes_in": len(wav_bytes or b"")}
+    if not AUDIO_PREP_ENABLED or not wav_bytes:
+        return wav_bytes, dict(info, skipped="disabled" if wav_bytes else "empty")
+    start = time.perf_counter()
+    try:
+        with wave.open(io.BytesIO(wav_bytes), "rb") as w:
+            channels, width, rate = w.getnchannels(), w.getsampwidth(), w.getframerate()
+            frames = w.readframes(w.getnframes())
+    except (wave.Error, EOFError) as e:
+        return wav_bytes, dict(info, skipped=f"not wav: {e}")
+    if width != 2:
+        return wav_bytes, dict(info, skipped=f"{width * 8}bit")
+
+    samples = array.array("h")
+    samples.frombytes(frames[:len(frames) - len(frames) % 2])
+    if sys.byteorder == "big": samples.byteswap()  # WAV 是小端
+    samples = _downmix(samples, channels)
+    samples = _resample(samples, rate, STT_SAMPLE_RATE)
+    samples, trimmed_ms = _trim_silence(samples, STT_SAMPLE_RATE)
+    if sys.byteorder == "big": samples.byteswap()
+
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(STT_SAMPLE_RATE)
+        w.writeframes(samples.tobytes())
+    out = buf.getvalue()
+    info.update(bytes_out=len(out), trimmed_ms=trimmed_ms, src=f"{rate}Hz/{channels}ch",
+                prep_ms=round((time.perf_counter() - start) * 1000, 1))
+    if len(out) >= len(wav_bytes):  # 已经很小了就发原始数据
+        out, info["bytes_out"] = wav_bytes, len(wav_bytes)
+    AUDIO_PREP_STATS["clips"] += 1
+    AUDIO_PREP_STATS["bytes_in"] += info["bytes_in"]
+    AUDIO_PREP_STATS["bytes_out"] += info["bytes_out"]
+    AUDIO_PREP_STATS["trimmed_ms"] += trimmed_ms
+    AUDIO_PREP_STATS["prep_ms"] += info["prep_ms"]
+    return out, info
+
 # 全局RP要求
 def get_global_world_logic(world_name, world_type):
     """
@@ -367,67 +1023,189 @@ def get_global_world_logic(world_name, world_type):
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
+# 进程内缓存：认证后的 client、打开过的表格和标签页句柄。
+# 每 45 分钟重新认证一次 (访问令牌有效期 60 分钟)；API 出错时丢弃句柄，下次重新打开。
+GSPREAD_CLIENT_TTL = 45 * 60
+_GS_LOCK = threading.RLock()
+_GS_STATE = {"client": None, "authorized_at": 0.0, "spreadsheet": None, "worksheets": {}}
+
+def _authorize_gspread():
+    """[内部函数] 认证并返回 client (失败时抛异常)"""
+    # 设定权限范围
+    scope = [
+        'https://spreadsheets.google.com/feeds',
+        'https://www.googleapis.com/auth/drive'
+    ]
+    
+    # 从 secrets.toml 读取认证信息
+    if "gcp_service_account" not in st.secrets:
+        raise KeyError("Secrets配置错误: 未找到 [gcp_service_account]")
+        
+    creds_dict = dict(st.secrets["gcp_service_account"])
+    creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
+    
+    # 建立连接
+    return gspread.authorize(creds)
+
+def _cached_gspread_client():
+    """缓存的 client，过期自动重新认证 (失败时抛异常)"""
+    with _GS_LOCK:
+        if _GS_STATE["client"] is None or time.time() - _GS_STATE["authorized_at"] > GSPREAD_CLIENT_TTL:
+            _GS_STATE.update(client=_authorize_gspread(), authorized_at=time.time(),
+                             spreadsheet=None, worksheets={})
+        return _GS_STATE["client"]
+
 def _get_gspread_client():
     """
     [内部函数] 连接 Google Sheets 的认证逻辑
     """
     try:
-        # 设定权限范围
-        scope = [
-            'https://spreadsheets.google.com/feeds',
-            'https://www.googleapis.com/auth/drive'
-        ]
-        
-        # 从 secrets.toml 读取认证信息
-        if "gcp_service_account" not in st.secrets:
-            st.error("Secrets配置错误: 未找到 [gcp_service_account]")
-            return None
-            
-        creds_dict = dict(st.secrets["gcp_service_account"])
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(creds_dict, scope)
-        
-        # 建立连接
-        client = gspread.authorize(creds)
-        return client
+        return _cached_gspread_client()
     except Exception as e:
         st.error(f"Google 认证失败: {e}")
         return None
 
+def _get_worksheet(index):
+    """缓存的标签页句柄：表格按名字只搜索一次 (Drive 搜索很慢)，之后复用"""
+    with _GS_LOCK:
+        client = _cached_gspread_client()
+        sheet = _GS_STATE["worksheets"].get(index)
+        if sheet is not None: return sheet
+        if _GS_STATE["spreadsheet"] is None:
+            # 获取文件名 (在 secrets.toml 中配置)
+            _GS_STATE["spreadsheet"] = client.open(st.secrets["gsheet"]["spreadsheet_name"])
+        sheet = _GS_STATE["spreadsheet"].get_worksheet(index)
+        _GS_STATE["worksheets"][index] = sheet
+        return sheet
+
+def _reset_gspread_handles():
+    """API 出错后调用：下次重新打开表格"""
+    with _GS_LOCK:
+        _GS_STATE.update(spreadsheet=None, worksheets={})
+
+# ==========================================
+# 📮 10.5 实验日志后台上传队列
+# ==========================================
+# upload_log_to_cloud 只负责入队，立即返回；后台线程用 append_rows 批量写入。
+# 写入失败 (限流/超时) 时指数退避重试，仍失败就先落盘到 spool 文件，之后再补传。
+UPLOAD_SPOOL_FILE = os.path.join(DATA_DIR, "upload_spool.jsonl")
+UPLOAD_BATCH_SIZE = 50
+UPLOAD_MAX_RETRIES = 4
+UPLOAD_SPOOL_RETRY_SECS = 60
+UPLOAD_STATS = {"queued": 0, "uploaded": 0, "batches": 0, "retries": 0, "spooled": 0}
+_UPLOAD_QUEUE = queue.Queue()
+_UPLOAD_LOCK = threading.Lock()
+_upload_worker = None
+_upload_in_flight = []  # 已从队列取出、还没写进 Sheets 的一批 (退出时也要落盘)
+
+def _spool_rows(rows):
+    with _UPLOAD_LOCK:
+        with open(UPLOAD_SPOOL_FILE, "a", encoding="utf-8") as f:
+            for row in rows: f.write(json.dumps(row, ensure_ascii=False) + "\n")
+    UPLOAD_STATS["spooled"] += len(rows)
+
+def _take_spooled_rows():
+    """取出 spool 里的全部行并清空文件"""
+    with _UPLOAD_LOCK:
+        if not os.path.exists(UPLOAD_SPOOL_FILE): return []
+        with open(UPLOAD_SPOOL_FILE, "r", encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        os.remove(UPLOAD_SPOOL_FILE)
+    return rows
+
+def _append_rows_with_retry(rows):
+    """批量追加到第 1 个标签页 (Log)，带指数退避；全部失败时抛出最后一个异常"""
+    for attempt in range(UPLOAD_MAX_RETRIES):
+        try:
+            # RAW：原样写入。USER_ENTERED 会把 "=…" 开头的感想当公式、把时间字符串转成日期
+            _get_worksheet(0).append_rows(rows, value_input_option="RAW")
+            UPLOAD_STATS["uploaded"] += len(rows)
+            UPLOAD_STATS["batches"] += 1
+            return
+        except Exception as e:
+            _reset_gspread_handles()
+            if attempt == UPLOAD_MAX_RETRIES - 1: raise
+            UPLOAD_STATS["retries"] += 1
+            delay = (2 ** attempt) + random.uniform(0, 1)
+            print(f"Log upload failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def _upload_worker_loop():
+    while True:
+        try:
+            rows = [_UPLOAD_QUEUE.get(timeout=UPLOAD_SPOOL_RETRY_SECS)]
+        except queue.Empty:
+            rows = []  # 空闲时也定期尝试补传 spool
+        # 把队列里已有的行凑成一批
+        while len(rows) < UPLOAD_BATCH_SIZE:
+            try: rows.append(_UPLOAD_QUEUE.get_nowait())
+            except queue.Empty: break
+        # 之前没传上去的先补上 (保持时间顺序)
+        rows = _take_spooled_rows() + rows
+        if not rows: continue
+        _set_in_flight(rows)
+        try:
+            _append_rows_with_retry(rows)
+        except Exception as e:
+            print(f"Log upload failed, spooled {len(rows)} rows: {e}")
+            _spool_rows(rows)
+        finally:
+            _set_in_flight([])
+
+def _set_in_flight(rows):
+    global _upload_in_flight
+    with _UPLOAD_LOCK: _upload_in_flight = rows
+
+def _ensure_upload_worker():
+    global _upload_worker
+    with _UPLOAD_LOCK:
+        if _upload_worker is None or not _upload_worker.is_alive():
+            _upload_worker = threading.Thread(target=_upload_worker_loop, name="sheet-uploader", daemon=True)
+            _upload_worker.start()
+
+@atexit.register
+def _spool_pending_uploads():
+    """
+    进程退出时，队列里还没传的行和正在上传的那一批都落盘，下次启动后补传。
+    正在上传的那批可能其实已经写进去了：宁可重复一行，也不丢数据。
+    """
+    with _UPLOAD_LOCK: rows = list(_upload_in_flight)
+    while True:
+        try: rows.append(_UPLOAD_QUEUE.get_nowait())
+        except queue.Empty: break
+    if rows: _spool_rows(rows)
+
 def upload_log_to_cloud(row_data):
     """
     功能：将一行完整的实验数据追加到 Google Sheet 的【第1个标签页 (Log)】
     参数：row_data (list) -> [时间, ID, 昵称, 模式, 分数, PreQ1...Q10, PostQ1...Q12, 感想, Log]
+    入队后立即返回 True；实际上传在后台线程完成。
     """
-    client = _get_gspread_client()
-    if not client: return False
-    
     try:
-        # 获取文件名 (在 secrets.toml 中配置)
-        spreadsheet_name = st.secrets["gsheet"]["spreadsheet_name"]
-        
-        # 打开表格 -> 获取第 1 个标签页 (索引为 0)
-        sheet = client.open(spreadsheet_name).get_worksheet(0)
-        
-        # 追加数据
-        sheet.append_row(row_data)
-        return True
+        # 没有 secrets.toml 时，访问 st.secrets 本身就会抛异常 (StreamlitSecretNotFoundError)
+        if "gcp_service_account" not in st.secrets:
+            st.error("Secrets配置错误: 未找到 [gcp_service_account]")
+            return False
     except Exception as e:
-        st.error(f"⚠️ 数据上传失败: {e}")
+        st.error(f"Google 认证失败: {e}")
         return False
+    _UPLOAD_QUEUE.put(list(row_data))
+    UPLOAD_STATS["queued"] += 1
+    _ensure_upload_worker()
+    return True
+
+def flush_spooled_uploads():
+    """上次进程留下 spool 文件时启动后台线程补传"""
+    if os.path.exists(UPLOAD_SPOOL_FILE): _ensure_upload_worker()
 
 def save_asset_to_cloud(name, category, data_dict):
     """
     功能：将人物卡/世界观存入 Google Sheet 的【第2个标签页 (Assets)】
     """
-    client = _get_gspread_client()
-    if not client: return False
-
     try:
-        spreadsheet_name = st.secrets["gsheet"]["spreadsheet_name"]
-        
         # 打开表格 -> 获取第 2 个标签页 (索引为 1)
         # 注意：你的 Google Sheet 必须至少有两个标签页！
-        sheet = client.open(spreadsheet_name).get_worksheet(1)
+        sheet = _get_worksheet(1)
         
         # 准备数据行
         json_str = json.dumps(data_dict, ensure_ascii=False)
@@ -441,22 +1219,101 @@ def save_asset_to_cloud(name, category, data_dict):
         sheet.append_row(row)
         return True
     except Exception as e:
+        _reset_gspread_handles()
         st.error(f"⚠️ 资产保存失败: {e}")
         return False
 
+# ==========================================
+# 🔄 10.6 Assets 标签页增量同步 (Delta Sync)
+# ==========================================
+# 本地镜像 = 已同步的行 (jsonl，只追加) + 元数据 (表头、已同步到第几行)。
+# 每次只用区间读取拉取新增的行，解析后的结果进程内共享，所有会话读同一份。
+# 没有 name 的行 (空白行、删到一半的行) 不进镜像，但 last_row 照样前进；count = 镜像里的条数。
+CLOUD_MIRROR_FILE = os.path.join(DATA_DIR, "cloud_assets_mirror.jsonl")
+CLOUD_MIRROR_META = os.path.join(DATA_DIR, "cloud_assets_mirror.meta.json")
+_CLOUD_LOCK = threading.Lock()
+_CLOUD_MIRROR = None  # {"header": [...], "last_row": int, "count": int, "records": [...]}
+
+def _cloud_record_name(record):
+    """表头的 name 列 (不区分大小写)，空白算没有"""
+    for key, value in record.items():
+        if str(key).strip().lower() == "name": return str(value).strip()
+    return ""
+
+def _load_cloud_mirror():
+    global _CLOUD_MIRROR
+    if _CLOUD_MIRROR is not None: return _CLOUD_MIRROR
+    mirror = {"header": [], "last_row": 1, "records": []}  # 第 1 行是表头
+    try:
+        with open(CLOUD_MIRROR_META, "r", encoding="utf-8") as f:
+            mirror.update(json.load(f))
+        with open(CLOUD_MIRROR_FILE, "r", encoding="utf-8") as f:
+            mirror["records"] = [json.loads(line) for line in f if line.strip()]
+        # 旧版元数据没有 count，当时每一行都进了镜像
+        if len(mirror["records"]) != mirror.get("count", mirror["last_row"] - 1): raise ValueError("mirror out of sync")
+        named = [r for r in mirror["records"] if _cloud_record_name(r)]
+        if len(named) != len(mirror["records"]):
+            mirror["records"], mirror["count"] = named, len(named)
+            _save_cloud_mirror(mirror, named, rewrite=True)
+    except FileNotFoundError:
+        mirror = {"header": [], "last_row": 1, "records": []}
+    except Exception as e:
+        print(f"Cloud mirror reset: {e}")
+        mirror = {"header": [], "last_row": 1, "records": []}
+    _CLOUD_MIRROR = mirror
+    return mirror
+
+def _save_cloud_mirror(mirror, new_records, rewrite=False):
+    with open(CLOUD_MIRROR_FILE, "w" if rewrite else "a", encoding="utf-8") as f:
+        for record in new_records: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    with open(CLOUD_MIRROR_META, "w", encoding="utf-8") as f:
+        json.dump({"header": mirror["header"], "last_row": mirror["last_row"], "count": mirror["count"]}, f, ensure_ascii=False)
+
+def sync_cloud_assets(full=False):
+    """
+    拉取 Assets 标签页里上次同步之后新增的行，返回新增的资产数 (没有 name 的行不算)。
+    full=True 时丢弃本地镜像从头同步 (表格里删过行时用)。
+    """
+    global _CLOUD_MIRROR
+    with _CLOUD_LOCK:
+        if full:
+            _CLOUD_MIRROR = {"header": [], "last_row": 1, "records": []}
+        mirror = _load_cloud_mirror()
+        sheet = _get_worksheet(1)
+        rewrite = full or not mirror["header"]
+        if not mirror["header"]:
+            mirror["header"] = sheet.row_values(1)
+            if not mirror["header"]: return 0
+        last_col = re.sub(r"\d", "", gspread.utils.rowcol_to_a1(1, len(mirror["header"])))
+        start = mirror["last_row"] + 1
+        # 区间读取：只取 start 行之后的数据 (末尾空行不会返回)
+        rows = sheet.get(f"A{start}:{last_col}", value_render_option="UNFORMATTED_VALUE")
+        new_records = []
+        for row in rows:
+            row = list(row) + [""] * (len(mirror["header"]) - len(row))
+            record = dict(zip(mirror["header"], row))
+            if _cloud_record_name(record): new_records.append(record)
+        if not rows and not rewrite: return 0
+        mirror["records"].extend(new_records)
+        mirror["last_row"] += len(rows)
+        mirror["count"] = len(mirror["records"])
+        _save_cloud_mirror(mirror, mirror["records"] if rewrite else new_records, rewrite=rewrite)
+        return len(new_records)
+
+def get_cloud_assets():
+    """所有会话共享的资产列表 (只读，不要修改)"""
+    with _CLOUD_LOCK:
+        return _load_cloud_mirror()["records"]
+
 def fetch_assets_from_cloud():
     """
     功能：从【第2个标签页 (Assets)】读取所有共享数据
+    增量同步后返回共享的资产列表。
     """
-    client = _get_gspread_client()
-    if not client: return []
-
     try:
-        spreadsheet_name = st.secrets["gsheet"]["spreadsheet_name"]
-        sheet = client.open(spreadsheet_name).get_worksheet(1)
-        
-        # 获取所有记录 (返回字典列表)
-        return sheet.get_all_records()
+        sync_cloud_assets()
     except Exception as e:
-        # 第一次读取可能为空，不报错，返回空列表
-        return []
\ No newline at end of file
+        # 第一次读取可能为空，不报错；同步失败时返回本地镜像
+        print(f"Cloud asset sync failed: {e}")
+        _reset_gspread_handles()
+    return get_cloud_assets()
@@ -18,26 +18,309 @@
 # logic.py
 import streamlit as st
 import google.generativeai as genai
+from google.api_core import exceptions as gexc
 import json
 import random
 import os
+import io
+import re
+import wave
+import time
+import threading
+import hashlib
+import contextvars
+import itertools
+import queue
+from contextlib import contextmanager
+from collections import deque
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
 import azure.cognitiveservices.speech as speechsdk
 from hotel_utils import (
     clean_json_text, ensure_dict, REALISM_BLOCK, 
-    STAFF_NAMES_MALE, STAFF_NAMES_FEMALE
+    STAFF_NAMES_MALE, STAFF_NAMES_FEMALE,
+    tts_cache_key, tts_cache_get, tts_cache_put,
+    preprocess_audio
 )
 
 # Default Model Configuration
 MODEL_NAME = "gemini-2.0-flash"
 
+# 模型 / 语音后端："live" = Gemini + Azure；"stub" = 本地桩 (stub_backends.py，压测与离线开发用)
+AI_BACKEND = os.environ.get("HOTEL_AI_BACKEND", "live")
+if AI_BACKEND == "stub":
+    import stub_backends
+
+# ==========================================
+# ⏱️ 0. 调用链路追踪 (Span Tracing)
+# ==========================================
+# 每个会话一个 Trace (放在 session_state)，所有外部调用 (STT / LLM / TTS / 评价) 记一个 span：
+# 阶段、第几轮、耗时、字数 / 字节数、模型 / 声优。没有激活的 Trace 时 span 什么也不做。
+# 后台线程要带上 Trace 时用 submit_traced (contextvars 不会自动传进线程池)。
+_CURRENT_TRACE = contextvars.ContextVar("hotel_trace", default=None)
+_CURRENT_SPAN = contextvars.ContextVar("hotel_span", default=None)
+
+class Trace:
+    def __init__(self):
+        self.turn = 0
+        self.spans = []
+        self._t0 = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock: self.spans.append(record)
+
+    def to_list(self):
+        with self._lock: return list(self.spans)
+
+def use_trace(trace):
+    """让当前线程 (本次 rerun) 的 span 记到这个 Trace 上"""
+    _CURRENT_TRACE.set(trace)
+    return trace
+
+@contextmanager
+def span(stage, **attrs):
+    trace = _CURRENT_TRACE.get()
+    if trace is None:
+        yield {}
+        return
+    record = {"stage": stage, "turn": trace.turn, **attrs}
+    token = _CURRENT_SPAN.set(record)
+    start = time.time()
+    record["start_s"] = round(start - trace._t0, 3)
+    try:
+        yield record
+        record.setdefault("ok", True)
+    except Exception as e:
+        record["ok"] = False
+        record["error"] = str(e)[:200]
+        raise
+    finally:
+        record["ms"] = round((time.time() - start) * 1000, 1)
+        try:
+            _CURRENT_SPAN.reset(token)
+        except ValueError:
+            pass  # 生成器在别的上下文里被关闭 (流式回复中途放弃)
+        trace.add(record)
+
+def annotate(**attrs):
+    """给当前所在的 span 补充字段 (例如缓存命中、输出字数)"""
+    record = _CURRENT_SPAN.get()
+    if record is not None: record.update(attrs)
+
+def submit_traced(pool, fn, *args, **kwargs):
+    """pool.submit，但把当前的 Trace 一起带进工作线程"""
+    return pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+# ==========================================
+# 🛡️ 0.6 Gemini 调用保护 (超时 / 重试 / 熔断)
+# ==========================================
+# 所有对 Gemini 的请求都经过 call_gemini：
+# - 每次请求带超时 (request_options)
+# - 429 / 5xx / 超时等可重试错误：指数退避 + 随机抖动，最多重试 GEMINI_MAX_RETRIES 次
+# - 连续失败 GEMINI_BREAKER_THRESHOLD 次后熔断 GEMINI_BREAKER_COOLDOWN 秒，期间直接失败不再排队等待，
+#   冷却后放一个请求试探，成功就恢复
+GEMINI_TIMEOUT_SECS = float(os.environ.get("HOTEL_GEMINI_TIMEOUT", "60"))
+GEMINI_MAX_RETRIES = int(os.environ.get("HOTEL_GEMINI_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = 0.5
+GEMINI_BACKOFF_CAP = 8.0
+GEMINI_BREAKER_THRESHOLD = 5
+GEMINI_BREAKER_COOLDOWN = 30.0
+
+RETRYABLE_ERRORS = (
+    gexc.TooManyRequests, gexc.ResourceExhausted, gexc.ServiceUnavailable,
+    gexc.InternalServerError, gexc.DeadlineExceeded, gexc.GatewayTimeout,
+    TimeoutError, ConnectionError,
+)
+GEMINI_STATS = {"calls": 0, "retries": 0, "failures": 0, "breaker_trips": 0, "fast_fails": 0}
+
+class GeminiUnavailable(Exception):
+    """熔断中：API 连续出错，暂时不再发请求"""
+
+class CircuitBreaker:
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, cooldown=GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None: return True
+            if time.time() - self._opened_at < self.cooldown or self._probing: return False
+            self._probing = True  # 冷却结束：只放一个试探请求
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def release(self):
+        """试探请求既没成功也不算 API 故障 (参数错误等)：只结束试探，保持 half-open，下一个请求再试"""
+        with self._lock:
+            self._probing = False
+
+    def failure(self):
+        """返回 True 表示这次失败让熔断器跳闸"""
+        with self._lock:
+            self._failures += 1
+            if self._probing or (self._opened_at is None and self._failures >= self.threshold):
+                self._opened_at = time.time()
+                self._probing = False
+                return True
+            return False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None: return "closed"
+            return "half-open" if time.time() - self._opened_at >= self.cooldown else "open"
+
+_GEMINI_BREAKER = CircuitBreaker()
+
+_GEMINI_STATS_LOCK = threading.Lock()
+
+def _count(key):
+    with _GEMINI_STATS_LOCK: GEMINI_STATS[key] += 1
+
+def call_gemini(fn, *args, timeout=None, on_retry=None, latency_key=None, **kwargs):
+    """
+    fn = model.generate_content / chat.send_message 等；其余参数原样传入，另加 request_options 超时。
+    不可重试的错误 (参数错误、安全拦截等) 直接抛出；熔断中抛 GeminiUnavailable。
+    on_retry(): 每次重试前调用 (例如清理 ChatSession 的半截状态)。
+    latency_key: 记录耗时用的模型名 (默认从 fn 所属的模型对象推断)。
+    """
+    latency_key = latency_key or _latency_key(fn)
+    if not _GEMINI_BREAKER.allow():
+        _count("fast_fails")
+        raise GeminiUnavailable("AIサーバーが混雑しています。しばらくしてから再度お試しください。")
+    kwargs.setdefault("request_options", {"timeout": timeout or GEMINI_TIMEOUT_SECS})
+    _count("calls")
+    resolved = False
+    try:
+        for attempt in range(GEMINI_MAX_RETRIES + 1):
+            try:
+                start = time.time()
+                result = fn(*args, **kwargs)
+                if latency_key: record_model_latency(latency_key, time.time() - start)
+                _GEMINI_BREAKER.success()
+                resolved = True
+                return result
+            except RETRYABLE_ERRORS:
+                if attempt == GEMINI_MAX_RETRIES or _GEMINI_BREAKER.state != "closed":
+                    _count("failures")
+                    if _GEMINI_BREAKER.failure(): _count("breaker_trips")
+                    resolved = True
+                    raise
+                _count("retries")
+                annotate(retries=attempt + 1)
+                time.sleep(random.uniform(0, min(GEMINI_BACKOFF_CAP, GEMINI_BACKOFF_BASE * 2 ** attempt)))
+                if on_retry: on_retry()
+            except Exception:
+                _count("failures")  # 请求本身有问题，不算 API 故障，也不重试
+                raise
+    finally:
+        # 其它任何退出路径 (参数错误、on_retry 出错、中断) 都要结束试探，否则熔断器永远停在 half-open
+        if not resolved: _GEMINI_BREAKER.release()
+
+def gemini_stats():
+    with _GEMINI_STATS_LOCK: s = dict(GEMINI_STATS)
+    s["breaker"] = _GEMINI_BREAKER.state
+    return s
+
+# ==========================================
+# 🧭 0.7 模型路由 (按任务分层级 + 滚动延迟 + 对冲请求)
+# ==========================================
+# 每种任务用自己的模型层级，可用环境变量单独换：HOTEL_MODEL_CHAT=gemini-2.0-flash-lite 等。
+# call_gemini 成功的请求按模型记录耗时 (流式对话记首块到达时间)，保留最近 LATENCY_WINDOW 次。
+# 对话回合可开启对冲 (HOTEL_CHAT_HEDGE=1)：第一个请求超过该模型的 p95 还没出首块，
+# 就再发一个相同的请求，谁先出首块用谁。
+# 默认：轻量任务 (听写、记忆摘要) 用更快更便宜的 Flash-Lite；
+# 对话和场景生成要角色扮演的质量，评价要和已有履历的分数可比，这三个保持 MODEL_NAME。
+LITE_MODEL_NAME = "gemini-2.0-flash-lite"
+DEFAULT_MODEL_TIERS = {
+    "chat": MODEL_NAME,
+    "generate": MODEL_NAME,
+    "eval": MODEL_NAME,
+    "stt": LITE_MODEL_NAME,
+    "memory": LITE_MODEL_NAME,
+}
+MODEL_TIERS = {
+    task: os.environ.get(f"HOTEL_MODEL_{task.upper()}", default)
+    for task, default in DEFAULT_MODEL_TIERS.items()
+}
+LATENCY_WINDOW = 200
+HEDGE_MIN_SAMPLES = 10        # 样本太少时用默认延迟
+HEDGE_DEFAULT_DELAY = 2.5     # 秒
+HEDGE_DELAY_BOUNDS = (0.3, 10.0)
+CHAT_HEDGE = os.environ.get("HOTEL_CHAT_HEDGE", "0") == "1"
+
+_MODEL_LATENCY = {}  # model_name -> deque[秒]
+_MODEL_LATENCY_LOCK = threading.Lock()
+HEDGE_STATS = {"turns": 0, "hedged": 0, "hedge_wins": 0}
+
+def _hedge_count(key):
+    with _MODEL_LATENCY_LOCK: HEDGE_STATS[key] += 1
+
+def model_for(task):
+    return MODEL_TIERS.get(task, MODEL_NAME)
+
+def _short_model_name(name):
+    return (name or MODEL_NAME).rsplit("/", 1)[-1]
+
+def record_model_latency(model_name, secs):
+    with _MODEL_LATENCY_LOCK:
+        _MODEL_LATENCY.setdefault(_short_model_name(model_name), deque(maxlen=LATENCY_WINDOW)).append(secs)
+
+def model_latency(model_name, pct=95):
+    """该模型最近的耗时百分位 (秒)；样本不足 HEDGE_MIN_SAMPLES 时返回 None"""
+    with _MODEL_LATENCY_LOCK:
+        samples = sorted(_MODEL_LATENCY.get(_short_model_name(model_name), ()))
+    if len(samples) < HEDGE_MIN_SAMPLES: return None
+    return samples[max(0, -(-pct * len(samples) // 100) - 1)]
+
+def hedge_delay(model_name):
+    p95 = model_latency(model_name, 95)
+    lo, hi = HEDGE_DELAY_BOUNDS
+    return HEDGE_DEFAULT_DELAY if p95 is None else min(hi, max(lo, p95))
+
+def model_router_stats():
+    with _MODEL_LATENCY_LOCK: names = list(_MODEL_LATENCY)
+    return {
+        "tiers": dict(MODEL_TIERS),
+        "latency": {n: {"p50_s": model_latency(n, 50), "p95_s": model_latency(n, 95)} for n in names},
+        "hedge": dict(HEDGE_STATS),  # 只读快照
+    }
+
+def _stream_key(model_name):
+    """流式请求记首块时间，和整段生成的耗时分开统计"""
+    return f"{_short_model_name(model_name)}#first_chunk"
+
+def chat_model_name(chat):
+    """ChatSession 实际用的模型名 (span 和延迟统计用)"""
+    return getattr(getattr(chat, "model", None), "model_name", None) or model_for("chat")
+
+def _latency_key(fn):
+    """model.generate_content / chat.send_message 这类绑定方法 -> 模型名"""
+    owner = getattr(fn, "__self__", None)
+    return getattr(owner, "model_name", None) or getattr(getattr(owner, "model", None), "model_name", None)
+
 def configure_genai(api_key):
     if api_key:
         genai.configure(api_key=api_key)
 
-def get_model(system_instruction=None):
+def get_model(system_instruction=None, task=None):
+    """task 给定时按模型路由选层级 (见 MODEL_TIERS)，否则用默认模型"""
+    model_name = model_for(task) if task else MODEL_NAME
+    if AI_BACKEND == "stub":
+        return stub_backends.StubModel(model_name, system_instruction=system_instruction)
     if system_instruction:
-        return genai.GenerativeModel(MODEL_NAME, system_instruction=system_instruction)
-    return genai.GenerativeModel(MODEL_NAME)
+        return genai.GenerativeModel(model_name, system_instruction=system_instruction)
+    return genai.GenerativeModel(model_name)
 
 # ==========================================
 # 🎵 Azure 日本语声优库 (纯净版)
@@ -56,6 +339,9 @@ VOICE_OPTIONS = {
     ]
 }
 
+# Guest Mode 开场白 (员工一方的固定第一句，TTS 缓存预热也会用到)
+GUEST_MODE_OPENER = "お電話ありがとうございます。フロントでございます。いかがなさいましたか？"
+
 # ==========================================
 # 🌍 1. World Generation (世界观生成：难易度决定可用手段)
 # ==========================================
@@ -101,8 +387,8 @@ def generate_world_setting(name, htype, season, stars, fac, policy, condition, d
     }}
     """
     try:
-        model = get_model()
-        resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        model = get_model(task="generate")
+        resp = call_gemini(model.generate_content, prompt, generation_config={"response_mime_type": "application/json"})
         return ensure_dict(json.loads(clean_json_text(resp.text)))
     except Exception as e:
         return {"error": str(e)}
@@ -177,8 +463,8 @@ def generate_guest_profile(params):
     
     # 4. 调用 AI 并处理结果
     try:
-        model = get_model()
-        resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        model = get_model(task="generate")
+        resp = call_gemini(model.generate_content, prompt, generation_config={"response_mime_type": "application/json"})
         data = ensure_dict(json.loads(clean_json_text(resp.text)))
 
         # ---------------------------------------------------------
@@ -250,8 +536,8 @@ def generate_staff_profile(name, role, exp, stress, weak, gender):
     }}
     """
     try:
-        model = get_model()
-        resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        model = get_model(task="generate")
+        resp = call_gemini(model.generate_content, prompt, generation_config={"response_mime_type": "application/json"})
         data = ensure_dict(json.loads(clean_json_text(resp.text)))
 
         # ---------------------------------------------------------
@@ -279,15 +565,44 @@ def generate_staff_profile(name, role, exp, stress, weak, gender):
     except Exception as e:
         return {"error": str(e)}
 
+# ==========================================
+# ⚡ 3.5 Quick Play 并发生成 (World / Staff / Guest 同时请求)
+# ==========================================
+def generate_scenario_concurrently(world_args=None, staff_args=None, guest_params=None):
+    """
+    三个生成请求互不依赖，同时发出，总等待时间 ≈ 最慢的那一个。
+    - world_args: generate_world_setting 的参数 tuple
+    - staff_args: generate_staff_profile 的参数 tuple
+    - guest_params: generate_guest_profile 的参数 dict
+    传 None 的部分不生成 (用于只重试失败的那一项)。
+    返回 {"world": ..., "staff": ..., "guest": ...}，每项各自成功或是 {"error": ...}，互不影响。
+    """
+    jobs = {}
+    if world_args is not None: jobs["world"] = (generate_world_setting, tuple(world_args))
+    if staff_args is not None: jobs["staff"] = (generate_staff_profile, tuple(staff_args))
+    if guest_params is not None: jobs["guest"] = (generate_guest_profile, (guest_params,))
+    if not jobs: return {}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = {key: pool.submit(fn, *args) for key, (fn, args) in jobs.items()}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = {"error": str(e)}
+    return results
+
 # ==========================================
 # 🧠 4. Memory & Transcription
 # ==========================================
-def update_memory_bank(current_mem, user_input, last_ai_reply, constraints):
-    # 这个函数保持不变，照抄即可
+def update_memory_bank(current_mem, user_input, last_ai_reply, constraints, transcript=None):
+    # transcript: 一次折叠多轮时传入整段对话文本 (会话压缩用)，代替 Last Turn
+    turn = f"[Dialogue to fold in]:\n{transcript}" if transcript else f'[Last Turn]: AI="{last_ai_reply}" / User="{user_input}"'
     prompt = f"""
     Analyze the dialogue state.
     [Rules]: {constraints}
-    [Last Turn]: AI="{last_ai_reply}" / User="{user_input}"
+    {turn}
     [Current Memory]: {json.dumps(current_mem, ensure_ascii=False)}
     
     OUTPUT JSON: 
@@ -297,21 +612,90 @@ def update_memory_bank(current_mem, user_input, last_ai_reply, constraints):
     - pending_issues: what needs to be solved.
     """
     try:
-        model = get_model()
-        resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        model = get_model(task="memory")
+        resp = call_gemini(model.generate_content, prompt, generation_config={"response_mime_type": "application/json"})
         return ensure_dict(json.loads(clean_json_text(resp.text)))
     except:
         return current_mem
 
-def transcribe_audio(audio_bytes):
+# 识别结果缓存：录音内容的 sha256 -> 文字 (进程内、所有会话共用，LRU 限制条数)
+# 同一段录音 (重新提交 / rerun 时 last_audio_id 没对上) 不会再识别第二次；出错的结果不缓存。
+STT_CACHE_MAX = int(os.environ.get("HOTEL_STT_CACHE_MAX", "256"))
+_STT_CACHE = {}  # digest -> transcript
+_STT_CACHE_LOCK = threading.Lock()
+STT_CACHE_STATS = {"hits": 0, "misses": 0}
+
+def audio_digest(audio_bytes):
+    """录音的稳定指纹 (跨进程一致，不像 hash() 每个进程加盐)"""
+    return hashlib.sha256(audio_bytes or b"").hexdigest()
+
+def _stt_cache_get(digest):
+    with _STT_CACHE_LOCK:
+        text = _STT_CACHE.get(digest)
+        if text is None:
+            STT_CACHE_STATS["misses"] += 1
+            return None
+        STT_CACHE_STATS["hits"] += 1
+        _STT_CACHE[digest] = _STT_CACHE.pop(digest)  # 移到最后 (LRU)
+        return text
+
+def _stt_cache_put(digest, text):
+    with _STT_CACHE_LOCK:
+        _STT_CACHE[digest] = text
+        while len(_STT_CACHE) > STT_CACHE_MAX:
+            _STT_CACHE.pop(next(iter(_STT_CACHE)))
+
+def stt_cache_stats():
+    with _STT_CACHE_LOCK:
+        s = dict(STT_CACHE_STATS)
+        s["entries"] = len(_STT_CACHE)
+    lookups = s["hits"] + s["misses"]
+    s["hit_rate"] = round(s["hits"] / lookups, 3) if lookups else None
+    return s
+
+def transcribe_audio(audio_bytes, digest=None, on_partial=None):
     """
     🎤 听力功能：复用全局默认模型 (Gemini 2.0 Flash)
+    发送前先做预处理 (单声道 16kHz + 裁掉首尾静音)，见 hotel_utils.preprocess_audio。
+    digest: 调用方已经算好的 audio_digest (省一次哈希)；同一段录音直接返回缓存的结果。
+    on_partial(text): STT_ENGINE="azure" 时每收到一个中间结果调用一次 (在调用方线程里)。
     """
+    digest = digest or audio_digest(audio_bytes)
+    with span("stt", model=model_for("stt") if AI_BACKEND != "stub" else "stub", bytes=len(audio_bytes or b"")) as sp:
+        cached = _stt_cache_get(digest) if STT_CACHE_MAX > 0 else None
+        if cached is not None:
+            sp.update(cache_hit=True, chars=len(cached))
+            return cached
+        audio_bytes, prep = preprocess_audio(audio_bytes)
+        sp.update(bytes_sent=len(audio_bytes or b""), trimmed_ms=prep.get("trimmed_ms", 0))
+        start = time.time()
+        text = None
+        if STT_ENGINE == "azure" and AI_BACKEND != "stub":
+            try:
+                text = transcribe_azure_stream(audio_bytes, on_partial=on_partial)
+                sp.update(engine="azure", model=f"azure-stt:{STT_LANGUAGE}")
+            except Exception as e:
+                # Azure 不可用 (没配密钥 / 网络 / 熔断中) 时退回 Gemini
+                print(f"Azure STT failed, falling back to Gemini: {e}")
+                sp["fallback"] = str(e)[:200]
+        if text is None: text = _transcribe_audio(audio_bytes)
+        stt_ms = round((time.time() - start) * 1000)
+        sp["chars"] = len(text)
+        if text.startswith("[Error:"): sp["ok"] = False
+        elif STT_CACHE_MAX > 0: _stt_cache_put(digest, text)
+        saved = prep["bytes_in"] - len(audio_bytes or b"")
+        print(f"🎙️ STT clip: {prep['bytes_in']:,} → {len(audio_bytes or b''):,} bytes "
+              f"(-{saved * 100 // max(prep['bytes_in'], 1)}%), trimmed {prep.get('trimmed_ms', 0)}ms, "
+              f"prep {prep.get('prep_ms', 0)}ms, stt {stt_ms}ms" + (f" [{prep['skipped']}]" if "skipped" in prep else ""))
+        return text
+
+def _transcribe_audio(audio_bytes):
+    if AI_BACKEND == "stub": return stub_backends.transcribe(audio_bytes)
     try:
         # ✅ 修改点：直接调用全局工具函数，不再硬编码模型名
-        model = get_model() 
+        model = get_model(task="stt")
         
-        response = model.generate_content([
+        response = call_gemini(model.generate_content, [
             "Transcribe this audio to Japanese text strictly. Output ONLY the text.",
             {"mime_type": "audio/wav", "data": audio_bytes}
         ])
@@ -319,65 +703,596 @@ def transcribe_audio(audio_bytes):
     except Exception as e:
         return f"[Error: {e}]"
 
-def get_azure_speech(text, gender="女性", style="customer-service", voice_name=None):
+def _open_chat_stream(chat, message, request_options=None):
+    """发出请求并等到第一块：429 / 超时一般在这里出现，之后才开始 yield (失败可以整轮重试)"""
+    response = chat.send_message(message, stream=True, request_options=request_options)
+    it = iter(response)
+    first = next(it, None)
+    return itertools.chain([first] if first is not None else [], it)
+
+def _reset_chat_turn(chat):
+    """丢掉 ChatSession 里失败的那半轮，否则下一次 send_message 会报未完成的迭代"""
+    for attr in ("_last_sent", "_last_received"):
+        if hasattr(chat, attr): setattr(chat, attr, None)
+
+def _open_model_stream(model, contents, request_options=None):
+    """对冲用：不经过 ChatSession，直接对 history + 本轮发言做流式生成，等到第一块"""
+    it = iter(model.generate_content(contents, stream=True, request_options=request_options))
+    first = next(it, None)
+    return itertools.chain([first] if first is not None else [], it)
+
+_HEDGE_POOL = ThreadPoolExecutor(max_workers=8)
+
+def _hedged_stream(model, contents, sp):
     """
-    🔊 终极版：优先使用指定的声优 ID (voice_name)，保留 SSML 语气功能
+    先发一个请求；hedge_delay 内没出首块就再发一个，用先出首块的那个。
+    两个都失败时抛出第一个错误。慢的那个无法取消，出首块后直接丢弃。
     """
+    model_name = getattr(model, "model_name", None) or model_for("chat")
+    results = queue.Queue()
+    def attempt(tag):
+        try: results.put((tag, call_gemini(_open_model_stream, model, contents, latency_key=_stream_key(model_name))))
+        except Exception as e: results.put((tag, e))
+
+    _hedge_count("turns")
+    submit_traced(_HEDGE_POOL, attempt, "primary")
+    pending = 1
     try:
-        # 1. 读取密钥 (注意：确保你的 secrets.toml 里是 [azure] 还是 [AZURE_SPEECH_KEY] 格式，这里假设是 st.secrets["azure"]["speech_key"])
-        # 如果你的 secrets 格式是 AZURE_SPEECH_KEY，请改为 st.secrets["AZURE_SPEECH_KEY"]
-        try:
-            api_key = st.secrets["azure"]["speech_key"]
-            region = st.secrets["azure"]["region"]
-        except:
-            # 兼容另一种写法
-            api_key = st.secrets["AZURE_SPEECH_KEY"]
-            region = st.secrets["AZURE_SPEECH_REGION"]
+        tag, res = results.get(timeout=hedge_delay(_stream_key(model_name)))
+    except queue.Empty:
+        _hedge_count("hedged")
+        sp["hedged"] = True
+        submit_traced(_HEDGE_POOL, attempt, "hedge")
+        pending = 2
+        tag, res = results.get()
+    pending -= 1
+    if isinstance(res, Exception) and pending:
+        first_error = res
+        tag, res = results.get()
+        if isinstance(res, Exception): raise first_error
+    elif isinstance(res, Exception):
+        raise res
+    if tag == "hedge":
+        _hedge_count("hedge_wins")
+        sp["hedge_won"] = True
+    return res
 
-        speech_config = speechsdk.SpeechConfig(subscription=api_key, region=region)
-        
-        # 2. ✅ 核心逻辑：确定使用哪个声优 ID
-        target_voice = "ja-JP-NanamiNeural" # 默认值
-        
-        if voice_name:
-            # 如果传了具体的 ID (比如 'ja-JP-DaichiNeural')，直接用它
-            target_voice = voice_name
+def stream_chat_reply(chat, message, hedge=None):
+    """
+    💬 流式对话：逐块 yield 模型输出的文本，第一块一到就能开始显示。
+    全部迭代完后 chat.history 会和 send_message 一样记录这一轮。
+    hedge=True (默认取 CHAT_HEDGE) 时用对冲请求，成功后手动把这一轮追加到 chat.history。
+    """
+    hedge = CHAT_HEDGE if hedge is None else hedge
+    model = getattr(chat, "model", None)
+    model_name = chat_model_name(chat)
+    with span("llm", model=model_name, chars_in=len(message)) as sp:
+        start = time.time()
+        if hedge and model is not None:
+            user_turn = {"role": "user", "parts": [message]}
+            chunks = _hedged_stream(model, list(chat.history) + [user_turn], sp)
         else:
-            # 没传 ID，就按性别兜底
-            if gender == "男性":
-                target_voice = "ja-JP-KeitaNeural"
-            else:
-                target_voice = "ja-JP-NanamiNeural"
-            
-        speech_config.speech_synthesis_voice_name = target_voice
-        
-        # 3. 构建 SSML (为了让 style 语气生效，必须用 SSML)
-        # 注意：有些男声优可能不支持 style，但 Azure 会自动忽略，不会报错
-        ssml = f"""
+            chunks = call_gemini(_open_chat_stream, chat, message, on_retry=lambda: _reset_chat_turn(chat),
+                                 latency_key=_stream_key(model_name))
+        usage = None
+        chars_out = 0
+        reply = []
+        try:
+            for chunk in chunks:
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                try:
+                    text = chunk.text
+                except ValueError:
+                    # 没有文本的块 (例如只带 finish_reason / 安全评级)
+                    continue
+                if text:
+                    if not chars_out: sp["first_token_ms"] = round((time.time() - start) * 1000, 1)
+                    chars_out += len(text)
+                    reply.append(text)
+                    yield text
+        except BaseException:
+            # 流中途断了 (或调用方不再迭代)：丢掉 ChatSession 里没收完的这一轮，
+            # 否则之后每次 send_message 都会报 BrokenResponseError
+            if not hedge: _reset_chat_turn(chat)
+            raise
+        if hedge and model is not None:
+            chat.history = list(chat.history) + [user_turn, {"role": "model", "parts": ["".join(reply)]}]
+        sp["chars_out"] = chars_out
+        if usage is not None: sp["prompt_tokens"] = getattr(usage, "prompt_token_count", None)
+    record_prompt_usage(usage)  # 最后一块带本轮的 token 用量
+
+# ==========================================
+# 🗜️ 4.3 会话压缩 (Rolling Compaction，可选)
+# ==========================================
+# chat.history 会无限增长，每一轮都要把整段记录重新发给模型。
+# 开启后 (HOTEL_CHAT_COMPACT_EVERY=K)，每攒够 K 轮旧对话就在后台用 update_memory_bank
+# 折叠成记忆 (summary / mood_score / facts / pending_issues)，
+# 模型只看到「记忆摘要 + 最近 HOTEL_CHAT_KEEP_TURNS 轮」，每轮输入长度基本持平。
+CHAT_COMPACT_EVERY = int(os.environ.get("HOTEL_CHAT_COMPACT_EVERY", "0"))  # 0 = 关闭
+CHAT_KEEP_TURNS = int(os.environ.get("HOTEL_CHAT_KEEP_TURNS", "4"))
+_COMPACT_POOL = ThreadPoolExecutor(max_workers=2)
+
+def _content_text(content):
+    """chat.history 里的一条 Content -> 纯文本"""
+    return "".join(getattr(p, "text", "") for p in content.parts)
+
+class ChatCompactor:
+    """
+    挂在一个 ChatSession 上。每轮回复后调用 maybe_compact() (后台折叠)，
+    下一轮发送前调用 apply() (把折叠结果换进 chat.history)，两者都不阻塞。
+    """
+
+    def __init__(self, chat, constraints=None, every=CHAT_COMPACT_EVERY, keep=CHAT_KEEP_TURNS):
+        self.chat = chat
+        self.constraints = constraints
+        self.every = every
+        self.keep = keep
+        self.memory = {}
+        self.compactions = 0
+        self._summary_len = 0   # history 开头的摘要占几条 (0 或 2)
+        self._job = None        # (future, fold_end)
+
+    def maybe_compact(self):
+        if self._job is not None: return
+        history = self.chat.history
+        if len(history) - self._summary_len < (self.every + self.keep) * 2: return
+        fold_end = len(history) - self.keep * 2
+        transcript = "\n".join(
+            f"{'User' if c.role == 'user' else 'AI'}: {_content_text(c)}"
+            for c in history[self._summary_len:fold_end])
+        future = _COMPACT_POOL.submit(
+            update_memory_bank, self.memory, None, None, self.constraints, transcript)
+        self._job = (future, fold_end)
+
+    def apply(self):
+        """折叠完成了就替换 history：摘要一问一答 + fold_end 之后的全部记录"""
+        if self._job is None or not self._job[0].done(): return False
+        future, fold_end = self._job
+        self._job = None
+        try:
+            memory = future.result()
+        except Exception as e:
+            print(f"Chat compaction failed: {e}")
+            return False
+        if not memory or memory is self.memory: return False  # update_memory_bank 失败时原样返回
+        self.memory = memory
+        summary = [
+            {"role": "user", "parts": ["【これまでの経緯 (要約)】\n" + json.dumps(memory, ensure_ascii=False)]},
+            {"role": "model", "parts": ["承知しました。この経緯を踏まえて会話を続けます。"]},
+        ]
+        self.chat.history = summary + list(self.chat.history[fold_end:])
+        self._summary_len = 2
+        self.compactions += 1
+        return True
+
+# ==========================================
+# 🔌 4.4 Azure 合成器连接池 (按声优复用 + 预热)
+# ==========================================
+# SpeechConfig / SpeechSynthesizer 每次新建都要重新建连接 (TLS 握手)。
+# 这里按 voice_id 保留空闲的合成器，Chat 页面一开始就为双方声优预先打开连接。
+# 一个合成器同一时间只给一个请求用 (句子流水线会并发)，不够就临时新建。
+SYNTH_POOL_MAX_IDLE = 3                    # 每个声优最多保留几个空闲合成器
+_SYNTH_POOL = {}                           # voice_id -> [entry, ...]
+_SYNTH_LOCK = threading.Lock()
+_PREWARM_POOL = ThreadPoolExecutor(max_workers=2)
+TTS_TIMING_MAX = int(os.environ.get("HOTEL_TTS_TIMING_MAX", "500"))   # 只保留最近 N 次的首字节延迟
+TTS_TIMING = {"cold": deque(maxlen=TTS_TIMING_MAX), "warm": deque(maxlen=TTS_TIMING_MAX), "rebuilds": 0}   # 首字节延迟 (ms)
+
+# 合成输出格式：名称 -> (SpeechSynthesisOutputFormat 成员名, MIME)。None = SDK 默认的 RIFF PCM。
+# WAV 16kHz/16bit ≈ 256 kbps，一段长的怒气发言就是几 MB；MP3 48 kbps 约小 5 倍，浏览器都能播。
+# Opus (Ogg) 更小，但句子流水线拼接后是 chained Ogg，部分浏览器只播第一句，适合不分句的场合。
+TTS_FORMATS = {
+    "wav": (None, "audio/wav"),
+    "mp3-32k": ("Audio16Khz32KBitRateMonoMp3", "audio/mpeg"),
+    "mp3-48k": ("Audio24Khz48KBitRateMonoMp3", "audio/mpeg"),
+    "mp3-96k": ("Audio24Khz96KBitRateMonoMp3", "audio/mpeg"),
+    "opus-16k": ("Ogg16Khz16BitMonoOpus", "audio/ogg"),
+    "opus-24k": ("Ogg24Khz16BitMonoOpus", "audio/ogg"),
+}
+TTS_FORMAT = os.environ.get("HOTEL_TTS_FORMAT", "mp3-48k")
+if TTS_FORMAT not in TTS_FORMATS:
+    print(f"Unknown HOTEL_TTS_FORMAT={TTS_FORMAT!r}, using wav")
+    TTS_FORMAT = "wav"
+
+def resolve_voice(gender="女性", voice_name=None):
+    """优先使用指定的声优 ID，没有就按性别兜底"""
+    if voice_name:
+        # 如果传了具体的 ID (比如 'ja-JP-DaichiNeural')，直接用它
+        return voice_name
+    return "ja-JP-KeitaNeural" if gender == "男性" else "ja-JP-NanamiNeural"
+
+def _azure_credentials():
+    # 读取密钥 (注意：确保你的 secrets.toml 里是 [azure] 还是 [AZURE_SPEECH_KEY] 格式，这里假设是 st.secrets["azure"]["speech_key"])
+    # 如果你的 secrets 格式是 AZURE_SPEECH_KEY，请改为 st.secrets["AZURE_SPEECH_KEY"]
+    try:
+        return st.secrets["azure"]["speech_key"], st.secrets["azure"]["region"]
+    except:
+        # 兼容另一种写法
+        return st.secrets["AZURE_SPEECH_KEY"], st.secrets["AZURE_SPEECH_REGION"]
+
+def _new_synthesizer(voice_id, fmt=None):
+    """新建合成器并立刻打开连接 (fmt 默认 TTS_FORMAT)"""
+    api_key, region = _azure_credentials()
+    speech_config = speechsdk.SpeechConfig(subscription=api_key, region=region)
+    speech_config.speech_synthesis_voice_name = voice_id
+    sdk_format = TTS_FORMATS[fmt or TTS_FORMAT][0]
+    if sdk_format:
+        speech_config.set_speech_synthesis_output_format(getattr(speechsdk.SpeechSynthesisOutputFormat, sdk_format))
+    synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+    connection = speechsdk.Connection.from_speech_synthesizer(synthesizer)
+    connection.open(True)
+    entry = {"synth": synthesizer, "conn": connection, "t0": None, "first_byte": None}
+
+    def on_chunk(evt):
+        if entry["t0"] is not None and entry["first_byte"] is None:
+            entry["first_byte"] = (time.perf_counter() - entry["t0"]) * 1000
+    synthesizer.synthesizing.connect(on_chunk)
+    return entry
+
+def _acquire_synthesizer(voice_id):
+    """取一个空闲合成器；返回 (entry, 是否冷启动)"""
+    with _SYNTH_LOCK:
+        idle = _SYNTH_POOL.get(voice_id)
+        if idle: return idle.pop(), False
+    return _new_synthesizer(voice_id), True
+
+def _release_synthesizer(voice_id, entry):
+    with _SYNTH_LOCK:
+        idle = _SYNTH_POOL.setdefault(voice_id, [])
+        if len(idle) < SYNTH_POOL_MAX_IDLE:
+            idle.append(entry)
+            return
+    _close_synthesizer(entry)
+
+def _close_synthesizer(entry):
+    try: entry["conn"].close()
+    except Exception: pass
+
+def prewarm_synthesizers(voice_ids):
+    """后台为这些声优各准备一个已连接的合成器 (已有空闲的就跳过)"""
+    if AI_BACKEND == "stub": return
+    def warm(voice_id):
+        try: _release_synthesizer(voice_id, _new_synthesizer(voice_id))
+        except Exception as e: print(f"TTS prewarm failed for {voice_id}: {e}")
+
+    for voice_id in dict.fromkeys(v for v in voice_ids if v):
+        with _SYNTH_LOCK:
+            if _SYNTH_POOL.get(voice_id): continue
+        _PREWARM_POOL.submit(warm, voice_id)
+
+def _speak_pooled(voice_id, ssml):
+    """用池里的合成器合成；连接出错时丢弃并重建一次"""
+    for attempt in range(2):
+        t_request = time.perf_counter()
+        entry, cold = _acquire_synthesizer(voice_id)
+        entry["t0"], entry["first_byte"] = t_request, None
+        try:
+            result = entry["synth"].speak_ssml_async(ssml).get()
+        except Exception:
+            _close_synthesizer(entry)
+            TTS_TIMING["rebuilds"] += 1
+            if attempt: raise
+            continue
+
+        broken = (result.reason == speechsdk.ResultReason.Canceled and
+                  result.cancellation_details.reason == speechsdk.CancellationReason.Error)
+        if broken:
+            _close_synthesizer(entry)
+            TTS_TIMING["rebuilds"] += 1
+            if attempt == 0: continue
+            return result
+
+        if entry["first_byte"] is not None:
+            TTS_TIMING["cold" if cold else "warm"].append(entry["first_byte"])
+        _release_synthesizer(voice_id, entry)
+        return result
+
+def tts_latency_stats():
+    """冷启动 vs 复用连接的平均首字节延迟 (最近 TTS_TIMING_MAX 次)，以及每次调用节省的时间"""
+    def avg(values): return round(sum(values) / len(values), 1) if values else None
+    # 合成线程会同时 append，先拷贝一份再遍历
+    cold_ms, warm_ms = list(TTS_TIMING["cold"]), list(TTS_TIMING["warm"])
+    cold, warm = avg(cold_ms), avg(warm_ms)
+    return {
+        "cold_calls": len(cold_ms), "warm_calls": len(warm_ms),
+        "cold_first_byte_ms": cold, "warm_first_byte_ms": warm,
+        "saved_ms_per_call": round(cold - warm, 1) if cold is not None and warm is not None else None,
+        "rebuilds": TTS_TIMING["rebuilds"],
+    }
+
+def build_ssml(text, voice_id, style, styledegree):
+    # 注意：有些男声优可能不支持 style，但 Azure 会自动忽略，不会报错
+    return f"""
         <speak version='1.0' xmlns='http://www.w3.org/2001/10/synthesis' xmlns:mstts='http://www.w3.org/2001/mstts' xml:lang='ja-JP'>
-            <voice name='{target_voice}'>
-                <mstts:express-as style='{style}' styledegree='1.2'>
+            <voice name='{voice_id}'>
+                <mstts:express-as style='{style}' styledegree='{styledegree}'>
                     {text}
                 </mstts:express-as>
             </voice>
         </speak>
         """
-        
-        synthesizer = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
-        result = synthesizer.speak_ssml_async(ssml).get()
-        
-        if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
-            return result.audio_data
-        elif result.reason == speechsdk.ResultReason.Canceled:
-            cancellation_details = result.cancellation_details
-            st.error(f"TTS Canceled: {cancellation_details.reason}")
-            if cancellation_details.reason == speechsdk.CancellationReason.Error:
-                st.error(f"Error details: {cancellation_details.error_details}")
-        return None
-        
-    except Exception as e:
-        st.error(f"TTS Error: {e}")
-        return None
+
+def get_azure_speech(text, gender="女性", style="customer-service", voice_name=None, styledegree=1.2,
+                     raise_errors=False):
+    """
+    🔊 终极版：优先使用指定的声优 ID (voice_name)，保留 SSML 语气功能
+    同样的 (文本, 声优, 语气, 强度) 直接从磁盘缓存返回，不再请求 Azure。
+    raise_errors=True：出错时抛异常 (后台线程里用，那里没有 ScriptRunContext，st.error 不会显示)；
+    否则在页面上显示错误并返回 None。
+    """
+    with span("tts", voice=resolve_voice(gender, voice_name), style=style, chars=len(text or "")) as sp:
+        try:
+            audio = _get_azure_speech(text, gender, style, voice_name, styledegree)
+        except Exception as e:
+            sp["ok"] = False
+            if raise_errors: raise
+            st.error(f"TTS Error: {e}")
+            return None
+        sp["bytes"] = len(audio) if audio else 0
+        if not audio: sp["ok"] = False
+        return audio
+
+def _get_azure_speech(text, gender, style, voice_name, styledegree):
+    """出错抛异常 (包括 Azure 返回 Canceled)，由 get_azure_speech 决定怎么显示"""
+    # 1. ✅ 核心逻辑：确定使用哪个声优 ID
+    target_voice = resolve_voice(gender, voice_name)
+    if AI_BACKEND == "stub": return stub_backends.synthesize(text, target_voice)  # 桩后端不进缓存
+
+    # 2. 先查缓存
+    cache_key = tts_cache_key(text, target_voice, style, styledegree, TTS_FORMAT)
+    cached = tts_cache_get(cache_key)
+    if cached:
+        annotate(cache_hit=True)
+        return cached
+    
+    # 3. 构建 SSML (为了让 style 语气生效，必须用 SSML)
+    ssml = build_ssml(text, target_voice, style, styledegree)
+    
+    # 4. 从连接池取合成器 (已预热的直接复用连接)
+    result = _speak_pooled(target_voice, ssml)
+    
+    if result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+        tts_cache_put(cache_key, result.audio_data)
+        return result.audio_data
+    elif result.reason == speechsdk.ResultReason.Canceled:
+        cancellation_details = result.cancellation_details
+        message = f"TTS Canceled: {cancellation_details.reason}"
+        if cancellation_details.reason == speechsdk.CancellationReason.Error:
+            message += f" ({cancellation_details.error_details})"
+        raise RuntimeError(message)
+    return None
+
+# ==========================================
+# 🔊 4.5 句子级 TTS 流水线 (LLM 生成与语音合成重叠)
+# ==========================================
+# 一句话 (以 。！？ 结尾) 一生成完就提交合成，后面的句子还在生成/合成时，
+# 前面的音频已经排好队了。回复结束后只需再等最后一句的合成时间。
+SENTENCE_RE = re.compile(r'.*?[。！？!?]+[」』）)]*', re.DOTALL)
+APOLOGY_WORDS = ["申し訳", "すみません", "お詫び"]
+
+def split_sentences(buffer):
+    """把缓冲区切成 (完整句子列表, 剩余未结束的文本)"""
+    sentences = []
+    pos = 0
+    for match in SENTENCE_RE.finditer(buffer):
+        sentence = match.group(0).strip()
+        if sentence: sentences.append(sentence)
+        pos = match.end()
+    return sentences, buffer[pos:]
+
+def pick_speech_style(text):
+    """道歉的句子用 empathetic，其余用 customer-service"""
+    return "empathetic" if any(w in text for w in APOLOGY_WORDS) else "customer-service"
+
+class SpeechPipeline:
+    """
+    用法：
+        pipeline = SpeechPipeline(gender, voice_name)
+        for chunk in pipeline.wrap(stream_chat_reply(chat, msg)):      # 边显示边送去合成
+            for audio in pipeline.ready_audio(): play(audio)            # 合成好的句子马上放
+        for audio in pipeline.iter_audio(): play(audio)                 # 剩下的按顺序等
+    合成失败的句子跳过，异常收集在 pipeline.errors 里，由调用方 (脚本线程) 显示。
+    """
+    def __init__(self, gender="女性", voice_name=None, style=None, max_workers=2):
+        self.gender = gender
+        self.voice_name = voice_name
+        self.style = style  # None = 每句按内容自动选择
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = []
+        self._next = 0      # 下一个要交出去的句子
+        self._buffer = ""
+        self.errors = []
+
+    def _submit(self, sentence):
+        style = self.style or pick_speech_style(sentence)
+        self._futures.append(submit_traced(
+            self._pool, get_azure_speech, sentence, gender=self.gender, style=style, voice_name=self.voice_name,
+            raise_errors=True))
+
+    def feed(self, text_chunk):
+        self._buffer += text_chunk
+        sentences, self._buffer = split_sentences(self._buffer)
+        for sentence in sentences: self._submit(sentence)
+
+    def finish(self):
+        """文本流结束：最后不带句号的半句也送去合成"""
+        rest, self._buffer = self._buffer.strip(), ""
+        if rest: self._submit(rest)
+        self._pool.shutdown(wait=False)
+
+    def wrap(self, chunks):
+        """透传文本块的同时喂给流水线"""
+        try:
+            for chunk in chunks:
+                self.feed(chunk)
+                yield chunk
+        finally:
+            self.finish()
+
+    def _take(self):
+        future = self._futures[self._next]
+        self._next += 1
+        try:
+            return future.result()
+        except Exception as e:
+            print(f"TTS pipeline error: {e}")
+            self.errors.append(e)
+            return None
+
+    def ready_audio(self):
+        """不等待：按顺序交出已经合成好的句子，遇到还没好的就停 (保证播放顺序)"""
+        while self._next < len(self._futures) and self._futures[self._next].done():
+            audio = self._take()
+            if audio: yield audio
+
+    def iter_audio(self):
+        """按句子顺序依次取出剩下的音频 (等待合成完成；合成失败的句子跳过)"""
+        while self._next < len(self._futures):
+            audio = self._take()
+            if audio: yield audio
+
+def audio_mime(data):
+    """按文件头判断音频的 MIME (缓存 / 桩后端 / 不同格式混在一起时也能给 st.audio 正确的类型)"""
+    if not data: return None
+    if data[:4] == b"RIFF": return "audio/wav"
+    if data[:4] == b"OggS": return "audio/ogg"
+    if data[:4] == b"\x1aE\xdf\xa3": return "audio/webm"
+    if data[:3] == b"ID3" or (data[0] == 0xFF and data[1] & 0xE0 == 0xE0): return "audio/mpeg"
+    return TTS_FORMATS[TTS_FORMAT][1]
+
+def join_audio_chunks(chunks):
+    """
+    把按句合成的音频拼成一段，交给 st.audio 连续播放。
+    WAV (RIFF) 合并 PCM 数据；其他格式 (如 MP3 帧) 直接首尾相接。
+    """
+    chunks = [c for c in chunks if c]
+    if not chunks: return None
+    if len(chunks) == 1: return chunks[0]
+    if not all(c[:4] == b"RIFF" for c in chunks): return b"".join(chunks)
+    out = io.BytesIO()
+    with wave.open(io.BytesIO(chunks[0]), "rb") as first:
+        params = first.getparams()
+    with wave.open(out, "wb") as writer:
+        writer.setparams(params)
+        for chunk in chunks:
+            with wave.open(io.BytesIO(chunk), "rb") as reader:
+                writer.writeframes(reader.readframes(reader.getnframes()))
+    return out.getvalue()
+
+# ==========================================
+# 🎙️ 4.6 Azure 流式语音识别 (Push Stream + 中间结果)
+# ==========================================
+# HOTEL_STT_ENGINE=azure 时 transcribe_audio 先走这里：PCM 按 STT_CHUNK_MS 一块块推给
+# PushAudioInputStream，识别器边收边出中间结果 (recognizing)，最后一块推完很快就能拿到定稿，
+# 不用像 Gemini 那样整段上传后再等生成。出错 / 超时 / 熔断时抛异常，由 transcribe_audio 退回 Gemini。
+# 注意：st.audio_input 只在录音结束后才交出整段音频，所以现在是「录完后按块快速推送」，
+# 并不是边录边识别；接入能实时给出 PCM 的录音组件时，直接在录音回调里调用
+# AzureStreamingRecognizer.write() 即可做到边说边出结果。
+STT_ENGINE = os.environ.get("HOTEL_STT_ENGINE", "gemini")   # "gemini" / "azure"
+STT_LANGUAGE = os.environ.get("HOTEL_STT_LANGUAGE", "ja-JP")
+STT_CHUNK_MS = 100
+STT_AZURE_TIMEOUT_SECS = float(os.environ.get("HOTEL_STT_AZURE_TIMEOUT", "15"))
+_AZURE_STT_BREAKER = CircuitBreaker()
+
+class AzureStreamingRecognizer:
+    """
+    一次识别会话：write() 推 PCM，close() 表示说完了，result() 等定稿。
+    SDK 的回调在它自己的线程里，这里只往队列里放事件，由调用方线程取出来处理。
+    """
+
+    def __init__(self, sample_rate=16000, channels=1, language=STT_LANGUAGE):
+        api_key, region = _azure_credentials()
+        speech_config = speechsdk.SpeechConfig(subscription=api_key, region=region)
+        speech_config.speech_recognition_language = language
+        fmt = speechsdk.audio.AudioStreamFormat(samples_per_second=sample_rate, bits_per_sample=16, channels=channels)
+        self._stream = speechsdk.audio.PushAudioInputStream(stream_format=fmt)
+        self._recognizer = speechsdk.SpeechRecognizer(
+            speech_config=speech_config, audio_config=speechsdk.audio.AudioConfig(stream=self._stream))
+        self._events = queue.Queue()
+        self._segments = []
+        self.partials = 0
+        self.first_partial_ms = None
+        self._t0 = time.perf_counter()
+
+        self._recognizer.recognizing.connect(lambda evt: self._events.put(("partial", evt.result.text)))
+        self._recognizer.recognized.connect(self._on_recognized)
+        self._recognizer.canceled.connect(self._on_canceled)
+        self._recognizer.session_stopped.connect(lambda evt: self._events.put(("stopped", None)))
+        self._recognizer.start_continuous_recognition()
+
+    def _on_recognized(self, evt):
+        if evt.result.reason == speechsdk.ResultReason.RecognizedSpeech and evt.result.text:
+            self._events.put(("final", evt.result.text))
+
+    def _on_canceled(self, evt):
+        details = evt.cancellation_details
+        if details.reason == speechsdk.CancellationReason.Error:
+            self._events.put(("error", f"{details.error_code}: {details.error_details}"))
+        else:
+            self._events.put(("stopped", None))  # EndOfStream：音频推完了
+
+    def write(self, pcm):
+        self._stream.write(pcm)
+
+    def close(self):
+        self._stream.close()
+
+    def result(self, timeout=STT_AZURE_TIMEOUT_SECS, on_partial=None):
+        """等到会话结束，返回拼好的定稿文字；中间结果交给 on_partial"""
+        deadline = time.monotonic() + timeout
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: raise TimeoutError("Azure STT timed out")
+                try:
+                    kind, text = self._events.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                if kind == "partial":
+                    self.partials += 1
+                    if self.first_partial_ms is None:
+                        self.first_partial_ms = round((time.perf_counter() - self._t0) * 1000)
+                    if on_partial: on_partial("".join(self._segments) + text)
+                elif kind == "final":
+                    self._segments.append(text)
+                    if on_partial: on_partial("".join(self._segments))
+                elif kind == "error":
+                    raise RuntimeError(text)
+                else:
+                    return "".join(self._segments).strip()
+        finally:
+            self._recognizer.stop_continuous_recognition()
+
+def transcribe_azure_stream(audio_bytes, on_partial=None):
+    """
+    整段 WAV (16bit PCM) 按块推给 Azure 流式识别；失败抛异常。
+    录音坏了 (不是 WAV / 不是 16bit) 不算 Azure 故障：只结束熔断器的试探，不计失败。
+    """
+    if not _AZURE_STT_BREAKER.allow(): raise RuntimeError("Azure STT circuit open")
+    resolved = False
+    try:
+        with wave.open(io.BytesIO(audio_bytes), "rb") as w:
+            if w.getsampwidth() != 2: raise ValueError(f"unsupported sample width: {w.getsampwidth()}")
+            rate, channels = w.getframerate(), w.getnchannels()
+            pcm = w.readframes(w.getnframes())
+        try:
+            rec = AzureStreamingRecognizer(sample_rate=rate, channels=channels)
+            step = rate * channels * 2 * STT_CHUNK_MS // 1000
+            for i in range(0, len(pcm), step):
+                rec.write(pcm[i:i + step])
+            rec.close()
+            text = rec.result(on_partial=on_partial)
+        except Exception:
+            _AZURE_STT_BREAKER.failure()
+            resolved = True
+            raise
+        _AZURE_STT_BREAKER.success()
+        resolved = True
+    finally:
+        # 任何其它退出路径 (录音格式错误等) 都要结束试探，否则熔断器永远停在 half-open
+        if not resolved: _AZURE_STT_BREAKER.release()
+    annotate(partials=rec.partials, first_partial_ms=rec.first_partial_ms)
+    return text
 
 # ==========================================
 # 📊 5. Evaluation System (評価システム)
@@ -441,9 +1356,9 @@ def evaluate_interaction(log_text, world_context):
     }}
     """
     try:
-        model = get_model()
+        model = get_model(task="eval")
         # 确保生成配置强制使用 JSON 模式
-        resp = model.generate_content(prompt, generation_config={"response_mime_type": "application/json"})
+        resp = call_gemini(model.generate_content, prompt, generation_config={"response_mime_type": "application/json"})
         data = ensure_dict(json.loads(clean_json_text(resp.text)))
         return data
     except Exception as e:
@@ -452,6 +1367,18 @@ def evaluate_interaction(log_text, world_context):
             "manager_review": {"score": 0, "overall_status": "エラー", "advice": "APIの接続を確認してください。"}
         }
 
+_EVAL_POOL = ThreadPoolExecutor(max_workers=4)
+
+def start_evaluation(log_text, world_context):
+    """在后台开始评价，立即返回 Future (结果同 evaluate_interaction)"""
+    return submit_traced(_EVAL_POOL, _traced_evaluation, log_text, world_context)
+
+def _traced_evaluation(log_text, world_context):
+    with span("eval", model=model_for("eval"), chars_in=len(log_text)) as sp:
+        result = evaluate_interaction(log_text, world_context)
+        if "error" in result: sp["ok"] = False
+        return result
+
 # ==========================================
 # 🤖 6. System Instructions (Core Logic)
 # ==========================================
@@ -561,3 +1488,138 @@ def get_observer_system_instruction(world, guest, staff, date_ctx):
         "content": "セリフの内容のみ（カッコなどのト書きは不要）"
     }}
     """
+
+# ==========================================
+# 🧩 6.5 编译后的 System Prompt 缓存 (跨会话复用)
+# ==========================================
+# 同一个 (world, guest, staff, role, date) 只构建一次 prompt 和 GenerativeModel，
+# 选了同一场景的所有会话共用。prompt 足够长时用 Gemini Context Caching (CachedContent)，
+# 之后每一轮不再重复处理这段 system instruction；不支持或太短时退回普通 system_instruction。
+# 注意：服务端要求缓存内容至少 CONTEXT_CACHE_MIN_TOKENS (2.0 Flash 为 4096)，而现在的 system prompt
+# 只有 1,000~1,500 字左右，所以默认配置下实际走的都是退回路径 (统计里的 too_short)，
+# 只有模板变长、或 chat 层级换成门槛更低的模型 (如 2.5 Flash: 1024) 并调低该值时才会真正缓存。
+CACHE_MODEL_NAME = os.environ.get("HOTEL_CACHE_MODEL")  # 默认跟随 chat 层级 (见 _cache_model_name)
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("HOTEL_CONTEXT_CACHE_MIN_TOKENS", "4096"))  # 服务端的最小缓存长度
+CONTEXT_CACHE_TTL_SECS = 3600
+CONTEXT_CACHE_REFRESH_SECS = 600  # 剩余不到 10 分钟就续期，长时间的对话中途不会过期
+PROMPT_CACHE_MAX = 64
+
+SYSTEM_INSTRUCTION_BUILDERS = {
+    "staff": get_staff_system_instruction,
+    "guest": get_guest_system_instruction,
+    "observer": get_observer_system_instruction,
+}
+
+_PROMPT_CACHE = {}  # key -> {"model", "cache" (CachedContent 或 None), "expires", "args"}
+_PROMPT_CACHE_LOCK = threading.Lock()
+PROMPT_CACHE_STATS = {
+    "hits": 0, "misses": 0, "context_cached": 0, "context_cache_errors": 0, "too_short": 0,
+    "refreshes": 0, "rebuilds": 0, "turns": 0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+}
+
+def _prompt_cache_key(role, world, guest, staff, date_ctx):
+    raw = json.dumps([role, world, guest, staff, date_ctx], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _cache_model_name():
+    """CachedContent 要带版本号的模型名：跟随 chat 层级，没写版本时补 -001"""
+    if CACHE_MODEL_NAME: return CACHE_MODEL_NAME
+    name = model_for("chat")
+    if not name.startswith("models/"): name = "models/" + name
+    if not re.search(r"-\d{3}$", name): name += "-001"
+    return name
+
+def _compile_session_model(sys_prompt):
+    """返回 (model, CachedContent 或 None, 过期时间)"""
+    if AI_BACKEND == "stub": return get_model(sys_prompt, task="chat"), None, None
+    if len(sys_prompt) < CONTEXT_CACHE_MIN_TOKENS:  # 粗略估计 (日文约 1 字 ≈ 1 token)，太短的服务端会拒绝
+        with _PROMPT_CACHE_LOCK: PROMPT_CACHE_STATS["too_short"] += 1
+        return get_model(sys_prompt, task="chat"), None, None
+    try:
+        from google.generativeai import caching
+        cached = caching.CachedContent.create(
+            model=_cache_model_name(),
+            system_instruction=sys_prompt,
+            ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SECS),
+        )
+        model = genai.GenerativeModel.from_cached_content(cached_content=cached)
+        return model, cached, time.time() + CONTEXT_CACHE_TTL_SECS - 60
+    except Exception as e:
+        print(f"Context caching unavailable, falling back: {e}")
+        with _PROMPT_CACHE_LOCK: PROMPT_CACHE_STATS["context_cache_errors"] += 1
+    return get_model(sys_prompt, task="chat"), None, None
+
+def _extend_context_cache(entry):
+    """把 CachedContent 的 TTL 续满；失败返回 False"""
+    try:
+        entry["cache"].update(ttl=timedelta(seconds=CONTEXT_CACHE_TTL_SECS))
+    except Exception as e:
+        print(f"Context cache refresh failed: {e}")
+        return False
+    with _PROMPT_CACHE_LOCK:
+        entry["expires"] = time.time() + CONTEXT_CACHE_TTL_SECS - 60
+        PROMPT_CACHE_STATS["refreshes"] += 1
+    return True
+
+def _fresh_entry(entry):
+    """快过期的 CachedContent 先续期；返回 entry 是否还能用"""
+    if entry["cache"] is not None and entry["expires"] - time.time() < CONTEXT_CACHE_REFRESH_SECS:
+        _extend_context_cache(entry)
+    return entry["expires"] is None or entry["expires"] > time.time()
+
+def get_session_model(role, world, guest, staff, date_ctx):
+    """
+    取某个场景 + 角色对应的对话模型 (已编译好的 system prompt)。
+    role: "staff" / "guest" / "observer" (其它值按 observer 处理)
+    """
+    key = _prompt_cache_key(role, world, guest, staff, date_ctx)
+    with _PROMPT_CACHE_LOCK:
+        entry = _PROMPT_CACHE.get(key)
+    if entry and _fresh_entry(entry):
+        with _PROMPT_CACHE_LOCK:
+            PROMPT_CACHE_STATS["hits"] += 1
+            if key in _PROMPT_CACHE: _PROMPT_CACHE[key] = _PROMPT_CACHE.pop(key)  # 移到最后 (LRU)
+        return entry["model"]
+    with _PROMPT_CACHE_LOCK: PROMPT_CACHE_STATS["misses"] += 1
+
+    builder = SYSTEM_INSTRUCTION_BUILDERS.get(role, get_observer_system_instruction)
+    model, cache, expires = _compile_session_model(builder(world, guest, staff, date_ctx))
+    entry = {"model": model, "cache": cache, "expires": expires, "args": (role, world, guest, staff, date_ctx)}
+    model._prompt_cache_entry = entry  # 被 LRU 挤出去以后，正在用它的对话也还能续期
+    with _PROMPT_CACHE_LOCK:
+        if cache is not None: PROMPT_CACHE_STATS["context_cached"] += 1
+        _PROMPT_CACHE[key] = entry
+        while len(_PROMPT_CACHE) > PROMPT_CACHE_MAX:
+            _PROMPT_CACHE.pop(next(iter(_PROMPT_CACHE)))
+    return model
+
+def refresh_session_model(model):
+    """
+    每轮发送前调用：模型用的 CachedContent 快过期就续期。
+    续不上且已经过期时重新编译，返回新的模型 (调用方用原来的 history 重新 start_chat)；
+    否则原样返回 model。
+    """
+    entry = getattr(model, "_prompt_cache_entry", None)
+    if entry is None or entry["cache"] is None or _fresh_entry(entry): return model
+    key = _prompt_cache_key(*entry["args"])
+    with _PROMPT_CACHE_LOCK:
+        if _PROMPT_CACHE.get(key) is entry: del _PROMPT_CACHE[key]
+        PROMPT_CACHE_STATS["rebuilds"] += 1
+    return get_session_model(*entry["args"])
+
+def record_prompt_usage(usage):
+    """记录一轮对话的 token 用量 (response.usage_metadata)，统计缓存省下的 prompt token"""
+    if usage is None: return
+    with _PROMPT_CACHE_LOCK:
+        PROMPT_CACHE_STATS["turns"] += 1
+        PROMPT_CACHE_STATS["prompt_tokens"] += getattr(usage, "prompt_token_count", 0) or 0
+        PROMPT_CACHE_STATS["cached_prompt_tokens"] += getattr(usage, "cached_content_token_count", 0) or 0
+
+def prompt_cache_stats():
+    with _PROMPT_CACHE_LOCK:
+        s = dict(PROMPT_CACHE_STATS)
+        s["entries"] = len(_PROMPT_CACHE)
+    lookups = s["hits"] + s["misses"]
+    s["hit_rate"] = round(s["hits"] / lookups, 3) if lookups else None
+    s["prompt_token_savings"] = round(s["cached_prompt_tokens"] / s["prompt_tokens"], 3) if s["prompt_tokens"] else None
+    return s
@@ -0,0 +1,157 @@
+# scenario_pool.py
+# ==========================================
+# 🎲 Quick Play 预生成场景池 (Scenario Warm Pool)
+# ==========================================
+# 后台提前生成 N 套 (world, staff, guest)，点击 Quick Play 时直接拿走一套，
+# 然后在后台补到目标深度。课堂上多人同时点击时，池子里有货的人不用等 Gemini。
+#   HOTEL_SCENARIO_POOL=5 streamlit run app.py   # 目标深度 (0 = 关闭，默认 3)
+# 池子是进程内共享的 (所有会话同一个)，用 get_pool() 取。
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import hotel_utils as utils
+import logic
+
+POOL_TARGET_DEPTH = int(os.environ.get("HOTEL_SCENARIO_POOL", "3"))
+POOL_MAX_ATTEMPTS = 3  # 一套场景里失败的部分最多重试几次
+POOL_RETRY_COOLDOWN = float(os.environ.get("HOTEL_SCENARIO_POOL_COOLDOWN", "60"))  # 补货失败后隔多少秒再试
+
+
+def random_scenario_args(rng=random):
+    """Quick Play 的随机参数：(world_args, staff_args, guest_params)"""
+    world_args = (
+        rng.choice(utils.HOTEL_NAMES),
+        rng.choice(utils.HOTEL_TYPES),
+        rng.choice(utils.SEASONS),
+        round(rng.uniform(1.0, 5.0), 1),        # 随机星级
+        rng.choice(utils.FACILITY_LEVELS),      # 随机设施
+        rng.choice(utils.QUICK_POLICIES),       # 随机经营方针
+        rng.choice(utils.SPECIAL_CONDITIONS),
+        rng.choice(utils.DIFFICULTY_LEVELS),    # 难度
+    )
+    staff_args = (
+        "",
+        "フロント",
+        rng.choice(utils.EXP_LEVELS),     # 随机经验
+        rng.choice(utils.STRESS_LEVELS),  # 随机压力
+        "特になし",
+        rng.choice(utils.GENDERS),
+    )
+    guest_params = {
+        "name": rng.choice(utils.CHAR_NAMES),
+        "job": rng.choice(utils.CHAR_JOBS),
+        "booking_channel": rng.choice(utils.BOOKING_CHANNELS),
+        "date_context": rng.choice(utils.DATE_CONTEXTS),
+        "incident_type": rng.choice(utils.COMPLAINT_TYPES),
+        "severity": rng.randint(1, 5),  # 随机严重度
+        "vip_level": rng.choice(utils.VIP_LEVELS),
+        "initial_mood": rng.choice(utils.INITIAL_MOODS),
+    }
+    return world_args, staff_args, guest_params
+
+
+def generate_scenario(parts=None, max_attempts=1):
+    """
+    生成一套完整场景。parts 里已有的部分不再生成 (只补缺的)。
+    返回 (parts, failed)：failed 为空表示三项都齐了。
+    """
+    parts = dict(parts or {})
+    failed = {}
+    for _ in range(max_attempts):
+        world_args, staff_args, guest_params = random_scenario_args()
+        results = logic.generate_scenario_concurrently(
+            world_args=None if "world" in parts else world_args,
+            staff_args=None if "staff" in parts else staff_args,
+            guest_params=None if "guest" in parts else guest_params,
+        )
+        failed = {}
+        for key, data in results.items():
+            if "error" in data: failed[key] = data["error"]
+            else: parts[key] = data
+        if not failed: break
+    return parts, failed
+
+
+class ScenarioPool:
+    """线程安全的场景池：take() 立即返回，补货在后台线程里做"""
+
+    def __init__(self, target_depth=POOL_TARGET_DEPTH):
+        self.target_depth = target_depth
+        self._ready = deque()
+        self._lock = threading.Lock()
+        self._refilling = False
+        self._retry_after = 0.0            # 补货失败后，在这个时刻 (monotonic) 之前不再补货
+        self._stats = {"generated": 0, "served": 0, "misses": 0, "failures": 0,
+                       "refill_total_s": 0.0, "refill_last_s": None}
+
+    def take(self):
+        """拿走一套现成场景 {"world","staff","guest"}；池子空了返回 None"""
+        with self._lock:
+            scenario = self._ready.popleft() if self._ready else None
+            self._stats["served" if scenario else "misses"] += 1
+        self.refill()
+        return scenario
+
+    def refill(self):
+        """池子不满、没有补货线程在跑、也不在失败冷却中时，启动一个后台补货线程"""
+        with self._lock:
+            if self._refilling or len(self._ready) >= self.target_depth: return
+            if time.monotonic() < self._retry_after: return
+            self._refilling = True
+        threading.Thread(target=self._refill_loop, daemon=True).start()
+
+    def _refill_loop(self):
+        try:
+            while True:
+                with self._lock:
+                    if len(self._ready) >= self.target_depth: return
+                start = time.perf_counter()
+                parts, failed = generate_scenario(max_attempts=POOL_MAX_ATTEMPTS)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    if failed:
+                        # 连续失败 (额度用完 / 没有 API Key 等) 就先停下，冷却之后的 take 再试
+                        self._stats["failures"] += 1
+                        self._retry_after = time.monotonic() + POOL_RETRY_COOLDOWN
+                        return
+                    self._ready.append(parts)
+                    self._stats["generated"] += 1
+                    self._stats["refill_total_s"] += elapsed
+                    self._stats["refill_last_s"] = round(elapsed, 2)
+        except Exception as e:
+            print(f"Scenario pool refill error: {e}")
+            with self._lock:
+                self._retry_after = time.monotonic() + POOL_RETRY_COOLDOWN
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+            s["depth"] = len(self._ready)
+            s["target_depth"] = self.target_depth
+            s["refilling"] = self._refilling
+            s["retry_in_s"] = max(0.0, round(self._retry_after - time.monotonic(), 1))
+        s["refill_avg_s"] = round(s.pop("refill_total_s") / s["generated"], 2) if s["generated"] else None
+        return s
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_pool():
+    """
+    进程内唯一的场景池 (第一次调用时创建并开始补货)；深度为 0 时返回 None。
+    之后的补货只由 take() 触发，页面每次刷新调用这里不会重新补货。
+    """
+    global _POOL
+    if POOL_TARGET_DEPTH <= 0: return None
+    with _POOL_LOCK:
+        if _POOL is not None: return _POOL
+        _POOL = ScenarioPool()
+    _POOL.refill()
+    return _POOL
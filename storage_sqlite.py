@@ -0,0 +1,229 @@
+# storage_sqlite.py
+# ==========================================
+# 🗄️ SQLite Storage Engine (可选后端)
+# ==========================================
+# 与 hotel_utils 的 JSON 文件后端提供同样的操作，由 hotel_utils 统一调度：
+#   HOTEL_STORAGE_BACKEND=sqlite streamlit run app.py
+# - WAL 模式：读写互不阻塞，多个会话同时写入由 SQLite 加锁串行化
+# - 每次修改只动一行，不再整文件重写
+# - 索引：资产 (kind, name) 主键；履历/评分按 world、timestamp
+#
+# 从现有 JSON 文件导入：
+#   python storage_sqlite.py import [--db data/hotel.db]
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assets (
+    kind  TEXT NOT NULL,          -- worlds / characters / staff
+    name  TEXT NOT NULL,
+    seq   INTEGER NOT NULL,       -- 越大越新 (对应 JSON 里排在前面)
+    data  TEXT NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+CREATE INDEX IF NOT EXISTS idx_assets_kind_seq ON assets(kind, seq);
+
+CREATE TABLE IF NOT EXISTS history (
+    id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT,
+    world     TEXT,
+    guest     TEXT,
+    data      TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp);
+CREATE INDEX IF NOT EXISTS idx_history_world ON history(world);
+
+CREATE TABLE IF NOT EXISTS ratings (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,
+    world      TEXT NOT NULL,
+    score      INTEGER,
+    old_rating REAL,
+    new_rating REAL,
+    timestamp  TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_ratings_world ON ratings(world);
+CREATE INDEX IF NOT EXISTS idx_ratings_timestamp ON ratings(timestamp);
+"""
+
+
+def _dump(item):
+    return json.dumps(item, ensure_ascii=False)
+
+
+class SQLiteStore:
+    """一个数据库文件 = 一个 store；每个线程各用一条连接 (线程结束后由别的线程回收，进程退出时全部关闭)"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._conns = {}                  # thread -> conn，用来关掉已经结束的线程留下的连接
+        self._conns_lock = threading.Lock()
+        dir_path = os.path.dirname(db_path)
+        if dir_path and not os.path.exists(dir_path): os.makedirs(dir_path)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：自己用 BEGIN IMMEDIATE 控制事务
+            # check_same_thread=False：只有本线程在用，但回收/退出时要从别的线程 close
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                for thread in [t for t in self._conns if not t.is_alive()]:
+                    self._conns.pop(thread).close()
+                self._conns[threading.current_thread()] = conn
+        return conn
+
+    def _write(self, fn):
+        """在一个写事务里执行 fn(conn)，出错回滚"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+            return result
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            with self._conns_lock: self._conns.pop(threading.current_thread(), None)
+            conn.close()
+            self._local.conn = None
+
+    def close_all(self):
+        """关闭所有线程的连接 (进程退出 / 切换数据库时)；之后各线程再用会重新连接"""
+        with self._conns_lock:
+            conns, self._conns = list(self._conns.values()), {}
+        for conn in conns:
+            try: conn.close()
+            except sqlite3.Error: pass
+        self._local = threading.local()
+
+    # ---------- 资产库 (worlds / characters / staff) ----------
+    def load_assets(self, kind):
+        rows = self._conn().execute(
+            "SELECT data FROM assets WHERE kind = ? ORDER BY seq DESC", (kind,))
+        return [json.loads(r[0]) for r in rows]
+
+    def get_asset(self, kind, name):
+        row = self._conn().execute(
+            "SELECT data FROM assets WHERE kind = ? AND name = ?", (kind, name)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def list_names(self, kind):
+        rows = self._conn().execute(
+            "SELECT name FROM assets WHERE kind = ? ORDER BY seq DESC", (kind,))
+        return [r[0] for r in rows]
+
+    def load_page(self, kind, page, page_size):
+        rows = self._conn().execute(
+            "SELECT data FROM assets WHERE kind = ? ORDER BY seq DESC LIMIT ? OFFSET ?",
+            (kind, page_size, page * page_size))
+        return [json.loads(r[0]) for r in rows]
+
+    def add_asset(self, kind, item):
+        """同名覆盖，并排到最前面 (与 add_to_library 行为一致)"""
+        def op(conn):
+            top = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM assets WHERE kind = ?", (kind,)).fetchone()[0]
+            conn.execute(
+                "INSERT OR REPLACE INTO assets (kind, name, seq, data) VALUES (?, ?, ?, ?)",
+                (kind, item["name"], top + 1, _dump(item)))
+        self._write(op)
+
+    def delete_asset(self, kind, name):
+        self._write(lambda conn: conn.execute(
+            "DELETE FROM assets WHERE kind = ? AND name = ?", (kind, name)))
+
+    def replace_assets(self, kind, items):
+        """整体覆盖某一类资产 (备份恢复 / 导入用)，items 为最新在前的列表"""
+        def op(conn):
+            conn.execute("DELETE FROM assets WHERE kind = ?", (kind,))
+            total = len(items)
+            conn.executemany(
+                "INSERT OR IGNORE INTO assets (kind, name, seq, data) VALUES (?, ?, ?, ?)",
+                [(kind, it["name"], total - i, _dump(it)) for i, it in enumerate(items)])
+        self._write(op)
+
+    def update_world(self, world_name, update_fn, score):
+        """
+        在同一个写事务里读取-计算-写回酒店评分，并记一条 ratings。
+        update_fn(world_dict, score) -> (old_rating, new_rating)，直接修改 world_dict。
+        """
+        def op(conn):
+            row = conn.execute(
+                "SELECT data FROM assets WHERE kind = 'worlds' AND name = ?", (world_name,)).fetchone()
+            if not row: return None
+            world = json.loads(row[0])
+            old_rating, new_rating = update_fn(world, score)
+            conn.execute(
+                "UPDATE assets SET data = ? WHERE kind = 'worlds' AND name = ?", (_dump(world), world_name))
+            conn.execute(
+                "INSERT INTO ratings (world, score, old_rating, new_rating, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (world_name, score, old_rating, new_rating, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            return old_rating, new_rating
+        return self._write(op)
+
+    # ---------- 履历 ----------
+    def add_history(self, entry):
+        self._write(lambda conn: conn.execute(
+            "INSERT INTO history (timestamp, world, guest, data) VALUES (?, ?, ?, ?)",
+            (entry.get("timestamp") or entry.get("date"), entry.get("world"), entry.get("guest"), _dump(entry))))
+
+    def iter_history(self):
+        """最新的在前"""
+        for row in self._conn().execute("SELECT data FROM history ORDER BY id DESC"):
+            yield json.loads(row[0])
+
+    def load_history(self, page=0, page_size=None):
+        if page_size is None: return list(self.iter_history())
+        rows = self._conn().execute(
+            "SELECT data FROM history ORDER BY id DESC LIMIT ? OFFSET ?", (page_size, page * page_size))
+        return [json.loads(r[0]) for r in rows]
+
+    def replace_history(self, entries):
+        """整体覆盖履历，entries 为最新在前的列表"""
+        def op(conn):
+            conn.execute("DELETE FROM history")
+            conn.executemany(
+                "INSERT INTO history (timestamp, world, guest, data) VALUES (?, ?, ?, ?)",
+                [(e.get("timestamp") or e.get("date"), e.get("world"), e.get("guest"), _dump(e))
+                 for e in reversed(entries)])
+        self._write(op)
+
+    # ---------- 导入 ----------
+    def import_from_json(self, assets_by_kind, history_entries):
+        """
+        从 JSON 后端导入。assets_by_kind: {"worlds": [...], "characters": [...], "staff": [...]}
+        history_entries: 最新在前的履历列表
+        """
+        for kind, items in assets_by_kind.items():
+            self.replace_assets(kind, [it for it in items if isinstance(it, dict) and it.get("name")])
+        self.replace_history(history_entries)
+        return {kind: len(items) for kind, items in assets_by_kind.items()}, len(history_entries)
+
+
+if __name__ == "__main__":
+    import argparse
+    import hotel_utils as utils
+
+    parser = argparse.ArgumentParser(description="Import the JSON data files into SQLite")
+    parser.add_argument("command", choices=["import"])
+    parser.add_argument("--db", default=utils.DB_FILE)
+    args = parser.parse_args()
+
+    utils.set_storage_backend("json")
+    store = SQLiteStore(args.db)
+    counts, n_history = store.import_from_json(
+        {utils.asset_kind(p): utils.load_json(p) for p in (utils.WORLDS_FILE, utils.CHARS_FILE, utils.STAFF_FILE)},
+        utils.load_history())
+    print(f"Imported into {args.db}: {counts}, history={n_history}")
@@ -0,0 +1,203 @@
+# stub_backends.py
+# ==========================================
+# 🧪 本地桩后端 (Stub Model / STT / TTS)
+# ==========================================
+# 不连 Gemini / Azure，按可配置的延迟和大小分布返回确定性的假结果，
+# 用来测 app 自身的开销和做容量测试 (bench_load.py)：
+#   HOTEL_AI_BACKEND=stub streamlit run app.py
+#   HOTEL_STUB_PROFILE='{"llm_first_token_ms": [300, 0.3]}' HOTEL_AI_BACKEND=stub python bench_load.py
+# 延迟 / 大小都是对数正态分布 [中位数, sigma]；同样的输入 + 同样的 seed 得到同样的结果。
+import hashlib
+import io
+import json
+import math
+import os
+import random
+import re
+import time
+import wave
+from types import SimpleNamespace
+
+DEFAULT_PROFILE = {
+    "llm_first_token_ms": [600, 0.35],   # 第一块文字到达
+    "llm_chunk_ms": [60, 0.3],           # 之后每一块的间隔
+    "llm_json_ms": [2500, 0.4],          # 非流式的 JSON 生成 (World/Guest/Staff/评价)
+    "reply_chars": [70, 0.4],            # 对话回复的字数
+    "stt_ms": [900, 0.3],                # 语音识别
+    "tts_ms": [350, 0.3],                # 语音合成 (每次请求的固定部分)
+    "tts_ms_per_char": [6, 0.2],         # 语音合成 (按字数增长的部分)
+    "speech_ms_per_char": [130, 0.15],   # 合成出来的音频长度
+}
+PROFILE = dict(DEFAULT_PROFILE)
+PROFILE.update(json.loads(os.environ.get("HOTEL_STUB_PROFILE", "{}")))
+SEED = int(os.environ.get("HOTEL_STUB_SEED", "0"))
+TIME_SCALE = float(os.environ.get("HOTEL_STUB_TIME_SCALE", "1.0"))  # 0 = 不 sleep，只测纯开销
+
+SAMPLE_RATE = 16000
+REPLY_FILLER = "大変申し訳ございません。すぐに確認いたしますので、少々お待ちいただけますでしょうか。"
+
+STUB_CALLS = {"generate": 0, "chat_turns": 0, "stt": 0, "tts": 0}
+
+
+def configure(profile=None, seed=None, time_scale=None):
+    """在代码里改分布 (bench_load.py 用)"""
+    global SEED, TIME_SCALE
+    if profile: PROFILE.update(profile)
+    if seed is not None: SEED = seed
+    if time_scale is not None: TIME_SCALE = time_scale
+
+def _rng(*parts):
+    raw = json.dumps([SEED] + [str(p) for p in parts], ensure_ascii=False)
+    return random.Random(int(hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16], 16))
+
+def _draw(rng, key):
+    median, sigma = PROFILE[key]
+    return median * math.exp(rng.gauss(0, sigma))
+
+def _sleep_ms(ms):
+    if TIME_SCALE > 0: time.sleep(ms * TIME_SCALE / 1000)
+
+
+# ==========================================
+# 🤖 1. 模型 (GenerativeModel / ChatSession 的最小替身)
+# ==========================================
+def _prompt_text(contents):
+    if isinstance(contents, str): return contents
+    if isinstance(contents, (list, tuple)):
+        return "\n".join(c for c in contents if isinstance(c, str))
+    return str(contents)
+
+def _json_from_template(prompt, rng):
+    """
+    按 prompt 里的「出力JSON形式」模板生成同结构的 JSON，调用方拿到的字段和真实模型一致。
+    """
+    # 模板 = 最后一个 "JSON" 之后的第一个 "{" 到最后一个 "}"
+    start = prompt.find("{", max(prompt.rfind("JSON"), 0))
+    end = prompt.rfind("}")
+    template = prompt[start:end + 1] if start != -1 and end > start else "{}"
+    template = re.sub(r"\s(#|//)[^\n]*", "", template)  # 去掉模板里的注释
+    try:
+        data = json.loads(template)
+    except json.JSONDecodeError:
+        data = dict(re.findall(r'"(\w+)":\s*"([^"]*)"', template))
+    if isinstance(data, dict):
+        _fill_scores(data, rng)
+    return data
+
+def _fill_scores(data, rng):
+    for k, v in data.items():
+        if isinstance(v, dict): _fill_scores(v, rng)
+        elif k == "score": data[k] = rng.randint(30, 95)
+        elif k == "satisfaction": data[k] = "★" * rng.randint(1, 5)
+
+class _Chunk(SimpleNamespace):
+    pass
+
+def _usage(prompt_chars, out_chars):
+    return SimpleNamespace(prompt_token_count=prompt_chars, candidates_token_count=out_chars,
+                           cached_content_token_count=0)
+
+class StubChat:
+    """ChatSession 的替身：history 元素带 .role / .parts[i].text"""
+
+    def __init__(self, model, history=None):
+        self.model = model
+        self.history = history or []
+
+    @property
+    def history(self):
+        return self._history
+
+    @history.setter
+    def history(self, contents):
+        # 和真实 SDK 一样接受 {"role", "parts": [str]} 形式的 dict
+        self._history = [
+            SimpleNamespace(role=c["role"], parts=[SimpleNamespace(text=p) for p in c["parts"]])
+            if isinstance(c, dict) else c for c in contents
+        ]
+
+    def _reply(self, message):
+        return _chat_reply(self.model.system_instruction, len(self.history), message)
+
+    def _record(self, message, text):
+        self.history.append(SimpleNamespace(role="user", parts=[SimpleNamespace(text=message)]))
+        self.history.append(SimpleNamespace(role="model", parts=[SimpleNamespace(text=text)]))
+
+    def send_message(self, message, stream=False, **kwargs):
+        STUB_CALLS["chat_turns"] += 1
+        rng, text = self._reply(message)
+        prompt_chars = len(self.model.system_instruction or "") + sum(
+            len(p.text) for c in self.history for p in c.parts) + len(message)
+        if not stream:
+            _sleep_ms(_draw(rng, "llm_first_token_ms") + _draw(rng, "llm_chunk_ms") * (len(text) // 20))
+            self._record(message, text)
+            return _Chunk(text=text, usage_metadata=_usage(prompt_chars, len(text)))
+        return _stream_chunks(rng, text, prompt_chars, on_done=lambda: self._record(message, text))
+
+def _chat_reply(system_instruction, n_history, message):
+    rng = _rng("chat", system_instruction, n_history, message)
+    n = max(1, int(_draw(rng, "reply_chars")))
+    text = (REPLY_FILLER * (n // len(REPLY_FILLER) + 1))[:n]
+    if "JSON" in (system_instruction or ""):  # 观察者模式要 JSON
+        text = json.dumps({"role": rng.choice(["Guest", "Staff"]), "content": text}, ensure_ascii=False)
+    return rng, text
+
+def _stream_chunks(rng, text, prompt_chars, on_done=None):
+    _sleep_ms(_draw(rng, "llm_first_token_ms"))
+    pieces = [text[i:i + 20] for i in range(0, len(text), 20)]
+    for i, piece in enumerate(pieces):
+        if i: _sleep_ms(_draw(rng, "llm_chunk_ms"))
+        last = i == len(pieces) - 1
+        yield _Chunk(text=piece, usage_metadata=_usage(prompt_chars, len(text)) if last else None)
+    if on_done: on_done()
+
+class StubModel:
+    """GenerativeModel 的替身"""
+
+    def __init__(self, model_name="stub", system_instruction=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+        STUB_CALLS["generate"] += 1
+        if stream:
+            # 对冲请求：contents = history + 本轮发言；每次调用重新抽样延迟 (两次请求快慢不同)
+            history = [c for c in contents if not isinstance(c, str)]
+            message = history[-1]["parts"][0] if history and isinstance(history[-1], dict) else ""
+            _, text = _chat_reply(self.system_instruction, len(history) - 1, message)
+            return _stream_chunks(random.Random(), text, len(_prompt_text(contents)))
+        prompt = _prompt_text(contents)
+        rng = _rng("generate", self.system_instruction, prompt)
+        _sleep_ms(_draw(rng, "llm_json_ms"))
+        if generation_config and generation_config.get("response_mime_type") == "application/json":
+            text = json.dumps(_json_from_template(prompt, rng), ensure_ascii=False)
+        else:
+            text = REPLY_FILLER
+        return _Chunk(text=text, usage_metadata=_usage(len(prompt), len(text)))
+
+    def start_chat(self, history=None):
+        return StubChat(self, history)
+
+
+# ==========================================
+# 🎤 2. 语音识别 / 🔊 语音合成
+# ==========================================
+def transcribe(audio_bytes):
+    STUB_CALLS["stt"] += 1
+    rng = _rng("stt", hashlib.sha256(audio_bytes or b"").hexdigest())
+    _sleep_ms(_draw(rng, "stt_ms"))
+    return "申し訳ございません、すぐに確認いたします。"
+
+def synthesize(text, voice_id):
+    """返回与文字长度成比例的静音 WAV (16kHz / 16bit / mono)"""
+    STUB_CALLS["tts"] += 1
+    rng = _rng("tts", voice_id, text)
+    _sleep_ms(_draw(rng, "tts_ms") + _draw(rng, "tts_ms_per_char") * len(text))
+    frames = int(SAMPLE_RATE * _draw(rng, "speech_ms_per_char") * max(1, len(text)) / 1000)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(b"\x00\x00" * frames)
+    return buf.getvalue()
@@ -0,0 +1,76 @@
+import json
+import os
+
+import pytest
+
+import hotel_utils as utils
+
+
+@pytest.fixture
+def library(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "STORAGE_BACKEND", "json")
+    monkeypatch.setattr(utils, "_INDEX_CACHE", {})
+    utils.invalidate_cache()
+    path = str(tmp_path / "worlds.json")
+    yield path
+    utils.invalidate_cache()
+
+
+def _world(name, **extra):
+    # 多字节字符：字节偏移和字符偏移不一致
+    return dict({"name": name, "type": "高級旅館", "background_story": "老舗の伝統を守る。" * 20}, **extra)
+
+
+def _reload_index():
+    """丢掉进程内缓存，模拟新进程读取"""
+    utils._INDEX_CACHE.clear()
+    utils.invalidate_cache()
+
+
+def test_lookup_after_add(library):
+    for name in ("グランド・ホテル", "Hotel Sakura", "カプセル東京"):
+        utils.add_to_library(library, _world(name))
+
+    assert utils.list_names(library) == ["カプセル東京", "Hotel Sakura", "グランド・ホテル"]
+    for name in utils.list_names(library):
+        assert utils.get_by_name(library, name) == _world(name)
+    assert utils.get_by_name(library, "missing") is None
+    # 写出的文件仍是普通的 JSON 数组
+    with open(library, encoding="utf-8") as f:
+        assert [w["name"] for w in json.load(f)] == utils.list_names(library)
+
+
+def test_lookup_after_replace_and_delete(library):
+    for name in ("A", "ビー", "C"):
+        utils.add_to_library(library, _world(name))
+    utils.add_to_library(library, _world("ビー", type="カプセル"))
+    utils.delete_from_library(library, "A")
+    _reload_index()
+
+    assert utils.list_names(library) == ["ビー", "C"]
+    assert utils.get_by_name(library, "ビー")["type"] == "カプセル"
+    assert utils.get_by_name(library, "C") == _world("C")
+    assert utils.get_by_name(library, "A") is None
+
+
+def test_missing_index_is_rebuilt(library):
+    for name in ("A", "ビー"):
+        utils.add_to_library(library, _world(name))
+    os.remove(utils._index_path(library))
+    _reload_index()
+
+    assert utils.get_by_name(library, "A") == _world("A")
+    with open(utils._index_path(library), encoding="utf-8") as f:
+        assert json.load(f)["sig"] == utils._file_sig(library)
+
+
+def test_stale_index_after_manual_edit(library):
+    utils.add_to_library(library, _world("A"))
+    # 手动改写 (不同的缩进)：旧索引的偏移全部失效，必须按签名发现并重新扫描
+    with open(library, "w", encoding="utf-8") as f:
+        json.dump([_world("ビー"), _world("A", type="ビジネス")], f, ensure_ascii=False, indent=1)
+    _reload_index()
+
+    assert utils.list_names(library) == ["ビー", "A"]
+    assert utils.get_by_name(library, "A")["type"] == "ビジネス"
+    assert utils.get_by_name(library, "ビー") == _world("ビー")
@@ -0,0 +1,60 @@
+import pytest
+from google.api_core import exceptions as gexc
+
+import logic
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    b = logic.CircuitBreaker(threshold=5, cooldown=30.0)
+    monkeypatch.setattr(logic, "_GEMINI_BREAKER", b)
+    monkeypatch.setattr(logic, "GEMINI_MAX_RETRIES", 0)
+    return b
+
+
+def _raise(exc):
+    def fn(**kwargs):
+        raise exc
+    return fn
+
+
+def _trip(breaker, monkeypatch):
+    for _ in range(breaker.threshold):
+        with pytest.raises(gexc.ServiceUnavailable):
+            logic.call_gemini(_raise(gexc.ServiceUnavailable("503")), latency_key="test")
+    assert breaker.state == "open"
+    # 冷却结束
+    monkeypatch.setattr(breaker, "_opened_at", breaker._opened_at - breaker.cooldown)
+    assert breaker.state == "half-open"
+
+
+def test_non_retryable_probe_does_not_wedge_breaker(breaker, monkeypatch):
+    _trip(breaker, monkeypatch)
+
+    with pytest.raises(gexc.InvalidArgument):
+        logic.call_gemini(_raise(gexc.InvalidArgument("bad request")), latency_key="test")
+
+    # 试探结束后仍然放行下一个请求，成功就恢复
+    assert logic.call_gemini(lambda **kwargs: "ok", latency_key="test") == "ok"
+    assert breaker.state == "closed"
+
+
+def test_failed_probe_reopens_breaker(breaker, monkeypatch):
+    _trip(breaker, monkeypatch)
+
+    with pytest.raises(gexc.ServiceUnavailable):
+        logic.call_gemini(_raise(gexc.ServiceUnavailable("503")), latency_key="test")
+    assert breaker.state == "open"
+    with pytest.raises(logic.GeminiUnavailable):
+        logic.call_gemini(lambda **kwargs: "ok", latency_key="test")
+
+
+def test_malformed_clip_does_not_wedge_azure_stt_breaker(monkeypatch):
+    b = logic.CircuitBreaker(threshold=1, cooldown=30.0)
+    monkeypatch.setattr(logic, "_AZURE_STT_BREAKER", b)
+    b.failure()
+    monkeypatch.setattr(b, "_opened_at", b._opened_at - b.cooldown)
+
+    with pytest.raises(Exception):
+        logic.transcribe_azure_stream(b"not a wav")
+    assert b.allow()  # 试探已结束，下一段录音还能再试
@@ -0,0 +1,68 @@
+import json
+import os
+
+import pytest
+
+import hotel_utils as utils
+
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "STORAGE_BACKEND", "json")
+    monkeypatch.setattr(utils, "HISTORY_FILE", str(tmp_path / "history.json"))
+    monkeypatch.setattr(utils, "HISTORY_LOG", str(tmp_path / "history.jsonl"))
+    utils.invalidate_cache()
+    yield tmp_path
+    utils.invalidate_cache()
+
+
+def _entry(i):
+    # 每条 ~1.5 KiB、长度各不相同，多字节字符保证块边界会切在字符中间
+    return {"timestamp": f"2024-01-01 {i:05d}", "world": "グランド・ホテル", "score": i,
+            "log_text": "お客様：部屋が寒い。" * (40 + i % 7)}
+
+
+def test_reverse_read_across_block_boundary(history):
+    entries = [_entry(i) for i in range(120)]
+    for e in entries:
+        utils.add_to_history(e)
+    assert os.path.getsize(utils.HISTORY_LOG) > 2 * utils._HISTORY_READ_BLOCK
+
+    assert list(utils.iter_history()) == entries[::-1]
+    assert utils.load_history(page=1, page_size=50) == entries[::-1][50:100]
+
+
+@pytest.mark.parametrize("block", [1, 7, 1000])
+def test_reverse_read_with_small_blocks(history, monkeypatch, block):
+    monkeypatch.setattr(utils, "_HISTORY_READ_BLOCK", block)
+    entries = [_entry(i) for i in range(5)]
+    for e in entries:
+        utils.add_to_history(e)
+    assert list(utils.iter_history()) == entries[::-1]
+
+
+def test_broken_line_is_skipped(history):
+    utils.add_to_history(_entry(1))
+    with open(utils.HISTORY_LOG, "ab") as f:
+        f.write(b'{"timestamp": "half-writ')  # 进程被杀时写到一半
+    utils.add_to_history(_entry(2))
+    assert list(utils.iter_history()) == [_entry(2), _entry(1)]
+
+
+def test_legacy_json_is_migrated_before_new_entries(history):
+    with open(utils.HISTORY_FILE, "w", encoding="utf-8") as f:
+        json.dump([_entry(1), _entry(0)], f, ensure_ascii=False)  # 旧格式：最新在前
+    utils.add_to_history(_entry(2))
+
+    assert list(utils.iter_history()) == [_entry(2), _entry(1), _entry(0)]
+    assert os.path.exists(utils.HISTORY_FILE + ".migrated")
+
+
+def test_restore_retires_legacy_json(history):
+    with open(utils.HISTORY_FILE, "w", encoding="utf-8") as f:
+        json.dump([_entry(0)], f, ensure_ascii=False)
+    utils.save_history([_entry(2), _entry(1)])
+    utils.add_to_history(_entry(3))
+
+    assert list(utils.iter_history()) == [_entry(3), _entry(2), _entry(1)]
+    assert not os.path.exists(utils.HISTORY_FILE)
@@ -0,0 +1,93 @@
+import array
+import io
+import math
+import wave
+
+import pytest
+
+import hotel_utils as utils
+
+
+@pytest.fixture(autouse=True)
+def prep_enabled(monkeypatch):
+    monkeypatch.setattr(utils, "AUDIO_PREP_ENABLED", True)
+
+
+def _wav(channels, rate, segments, width=2):
+    """segments: [(秒数, 频率 Hz 或 None=静音, 振幅)]；多声道时每个声道振幅递增"""
+    samples = array.array("h")
+    for secs, freq, amp in segments:
+        for n in range(int(secs * rate)):
+            v = amp * math.sin(2 * math.pi * freq * n / rate) if freq else 0
+            for c in range(channels):
+                samples.append(int(v * (c + 1) / channels))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(width)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes() if width == 2 else bytes(len(samples)))
+    return buf.getvalue()
+
+
+def _read(data):
+    with wave.open(io.BytesIO(data), "rb") as w:
+        samples = array.array("h")
+        samples.frombytes(w.readframes(w.getnframes()))
+        return w.getnchannels(), w.getframerate(), samples
+
+
+def _zero_crossings(samples):
+    return sum(1 for a, b in zip(samples, samples[1:]) if a < 0 <= b)
+
+
+@pytest.mark.parametrize("rate", [48000, 44100])
+def test_stereo_is_downmixed_resampled_and_trimmed(rate):
+    clip = _wav(2, rate, [(0.5, None, 0), (1.0, 440, 8000), (0.5, None, 0)])
+    out, info = utils.preprocess_audio(clip)
+
+    channels, out_rate, samples = _read(out)
+    assert (channels, out_rate) == (1, utils.STT_SAMPLE_RATE)
+    assert info["src"] == f"{rate}Hz/2ch"
+    # 1 秒语音 + 前后各 VAD_PAD_MS，误差一帧以内
+    frame_ms = utils.VAD_FRAME_MS
+    expected_ms = 1000 + 2 * utils.VAD_PAD_MS
+    assert abs(len(samples) * 1000 / out_rate - expected_ms) <= 2 * frame_ms
+    assert abs(info["trimmed_ms"] - (2000 - expected_ms)) <= 2 * frame_ms
+    # 重采样后音高不变：440Hz 一秒约 440 次过零
+    assert abs(_zero_crossings(samples) - 440) <= 5
+    # 两个声道振幅 1/2 和 2/2 → 平均 3/4
+    assert max(samples) == pytest.approx(8000 * 3 / 4, rel=0.05)
+    assert info["bytes_out"] == len(out) < len(clip)
+
+
+def test_downmix_averages_channels():
+    stereo = array.array("h", [1000, 3000, -1000, -3000, 0, 10])
+    assert list(utils._downmix(stereo, 2)) == [2000, -2000, 5]
+
+
+def test_integer_ratio_resample_averages_blocks():
+    assert list(utils._resample(array.array("h", [0, 300, 600, 900, 1200, 1500]), 48000, 16000)) == [300, 1200]
+
+
+def test_silent_clip_is_not_trimmed():
+    clip = _wav(1, 16000, [(1.0, None, 0)])
+    out, info = utils.preprocess_audio(clip)
+    assert info["trimmed_ms"] == 0
+    assert out == clip  # 处理后没有变小就发原始数据
+
+
+def test_speech_only_clip_round_trips_unchanged():
+    clip = _wav(1, 16000, [(1.0, 300, 6000)])
+    out, info = utils.preprocess_audio(clip)
+    assert out == clip
+    assert info["trimmed_ms"] == 0
+
+
+def test_non_pcm16_input_is_passed_through():
+    out, info = utils.preprocess_audio(b"not a wav")
+    assert out == b"not a wav" and info["skipped"].startswith("not wav")
+    clip8 = _wav(1, 16000, [(0.1, None, 0)], width=1)
+    out, info = utils.preprocess_audio(clip8)
+    assert out == clip8 and info["skipped"] == "8bit"
+    assert utils.preprocess_audio(b"") == (b"", {"bytes_in": 0, "skipped": "empty"})
@@ -0,0 +1,66 @@
+import pytest
+
+import logic
+
+
+@pytest.fixture
+def stt(monkeypatch):
+    """识别本体换成计数器；缓存清空、上限 2 条"""
+    calls = []
+
+    def fake_transcribe(audio_bytes):
+        calls.append(audio_bytes)
+        return "[Error: quota]" if audio_bytes.startswith(b"err") else f"text:{audio_bytes.decode()}"
+
+    monkeypatch.setattr(logic, "_transcribe_audio", fake_transcribe)
+    monkeypatch.setattr(logic, "STT_ENGINE", "gemini")
+    monkeypatch.setattr(logic, "STT_CACHE_MAX", 2)
+    monkeypatch.setattr(logic, "_STT_CACHE", {})
+    monkeypatch.setattr(logic, "STT_CACHE_STATS", {"hits": 0, "misses": 0})
+    return calls
+
+
+def test_same_clip_is_transcribed_once(stt):
+    assert logic.transcribe_audio(b"a") == "text:a"
+    assert logic.transcribe_audio(b"a") == "text:a"
+    assert logic.transcribe_audio(b"a", digest=logic.audio_digest(b"a")) == "text:a"
+
+    assert stt == [b"a"]
+    stats = logic.stt_cache_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1)
+    assert stats["hit_rate"] == pytest.approx(2 / 3, abs=1e-3)
+
+
+def test_errors_are_not_cached(stt):
+    assert logic.transcribe_audio(b"err").startswith("[Error:")
+    logic.transcribe_audio(b"err")
+    assert stt == [b"err", b"err"]
+    assert logic.stt_cache_stats()["entries"] == 0
+
+
+def test_least_recently_used_clip_is_evicted(stt):
+    logic.transcribe_audio(b"a")
+    logic.transcribe_audio(b"b")
+    logic.transcribe_audio(b"a")  # a 变成最近使用
+    logic.transcribe_audio(b"c")  # 超过 2 条：挤掉 b
+    assert logic.stt_cache_stats()["entries"] == 2
+
+    stt.clear()
+    logic.transcribe_audio(b"a")
+    logic.transcribe_audio(b"c")
+    assert stt == []
+    logic.transcribe_audio(b"b")
+    assert stt == [b"b"]
+
+
+def test_cache_disabled(stt, monkeypatch):
+    monkeypatch.setattr(logic, "STT_CACHE_MAX", 0)
+    logic.transcribe_audio(b"a")
+    logic.transcribe_audio(b"a")
+    assert stt == [b"a", b"a"]
+
+
+def test_digest_is_stable():
+    assert logic.audio_digest(b"a") == logic.audio_digest(bytearray(b"a"))
+    assert logic.audio_digest(None) == logic.audio_digest(b"")
+    assert logic.audio_digest(b"a") != logic.audio_digest(b"b")
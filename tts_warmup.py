@@ -0,0 +1,54 @@
+# tts_warmup.py
+# ==========================================
+# 🔥 TTS 缓存预热
+# ==========================================
+# 把 characters.json 里每位客人的 default_complaint (Staff Mode 的第一句)
+# 和每位员工声线的 Guest Mode 开场白提前合成进磁盘缓存：
+#   python tts_warmup.py [--workers 4]
+# 需要与 app 相同的 .streamlit/secrets.toml (Azure 密钥)。
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import hotel_utils as utils
+import logic
+
+
+def warmup_jobs():
+    """(文本, 性别, 声优) 列表，参数与 app.py 里开场时的调用一致"""
+    jobs = []
+    for g in utils.load_json(utils.CHARS_FILE):
+        if g.get("default_complaint"):
+            jobs.append((g["default_complaint"], g.get("gender", "女性"), g.get("voice_id")))
+    for s in utils.load_json(utils.STAFF_FILE):
+        jobs.append((logic.GUEST_MODE_OPENER, s.get("gender", "女性"), s.get("voice_id")))
+    return list(dict.fromkeys(jobs))  # 去重，保持顺序
+
+
+def warm_tts_cache(workers=4):
+    jobs = warmup_jobs()
+    start = time.perf_counter()
+
+    def run(job):
+        text, gender, voice = job
+        try:  # 线程池里 st.error 不会显示，错误自己打出来
+            return logic.get_azure_speech(text, gender=gender, style="customer-service", voice_name=voice,
+                                          raise_errors=True) is not None
+        except Exception as e:
+            print(f"TTS warmup failed for {voice}: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ok = sum(pool.map(run, jobs))
+    elapsed = time.perf_counter() - start
+    return len(jobs), ok, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-synthesize common lines into the TTS cache")
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    total, ok, elapsed = warm_tts_cache(args.workers)
+    print(f"Warmed {ok}/{total} lines in {elapsed:.1f}s")
+    print(utils.tts_cache_stats())